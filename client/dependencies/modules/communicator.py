@@ -2,12 +2,51 @@
 """
 This module contains the functions for sending and receiving messages
 between two sockets.
+
+Two framings are supported, chosen per connection during the handshake:
+1. The length of the message as a 64 byte space padded string.
+2. The length of the message as a four byte unsigned integer.
 """
 
 import socket
+import struct
+import weakref
 
 HEADER: int = 64
 ENCODING: str = 'utf-8'
+# The protocol versions the client can ask for during the handshake
+PROTOCOL_VERSIONS: tuple[str, ...] = ('1', '2')
+FRAME_HEADER: struct.Struct = struct.Struct('!I')
+
+# The protocol version of every connection that is not using version 1
+_versions: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def set_version(connection: socket.socket, version: str) -> None:
+    """
+    Sets the protocol version negotiated for the given connection.
+    :param connection: The connection.
+    :param version: One of PROTOCOL_VERSIONS.
+    """
+    _versions[connection] = version
+
+
+def get_version(connection: socket.socket) -> str:
+    """Returns the protocol version of the given connection."""
+    return _versions.get(connection, '1')
+
+
+def header(length: int, version: str = '1') -> bytes:
+    """
+    Creates the header of a message.
+    :param length: The length of the encoded message.
+    :param version: The protocol version of the connection.
+    :return: The header.
+    """
+    if version == '1':
+        message_length = str(length).encode(ENCODING)
+        return message_length + b' ' * (HEADER - len(message_length))
+    return FRAME_HEADER.pack(length)
 
 
 def send(message: str | bytes, connection: socket.socket, encode=True):
@@ -16,27 +55,38 @@ def send(message: str | bytes, connection: socket.socket, encode=True):
     It is important to note that the message is sent in two parts:
     1. The length of the message.
     2. The message itself.
+    Both parts are written with a single system call where possible.
     :param message: The message to send.
     :param connection: Connection to send the message to
     :param encode: Whether to encode the message or not.
     """
-    message_length = len(message)
-    message_length = str(message_length).encode(ENCODING)
-    message_length += b' ' * (HEADER - len(message_length))
-    connection.send(message_length)
     if encode:
         message = message.encode(ENCODING)
-    connection.send(message)
+    _sendall(connection, header(len(message), get_version(connection)), message)
 
 
-def _recv(connection: socket.socket, *args, **kwargs) -> str | bytes:
-    data = connection.recv(*args, **kwargs)
-    if not data:
-        raise ConnectionResetError
-    return data
+def _sendall(connection: socket.socket, message_header: bytes, message: bytes) -> None:
+    if not hasattr(connection, 'sendmsg'):
+        connection.sendall(message_header + message)
+        return
+    sent = connection.sendmsg([message_header, message])
+    if sent < len(message_header) + len(message):
+        connection.sendall(memoryview(message_header + message)[sent:])
 
 
-def receive(connection: socket.socket, decode=True) -> str | bytes:
+def _recv_into(connection: socket.socket, length: int) -> bytearray:
+    buffer = bytearray(length)
+    view = memoryview(buffer)
+    received = 0
+    while received < length:
+        data_length = connection.recv_into(view[received:], length - received)
+        if not data_length:
+            raise ConnectionResetError
+        received += data_length
+    return buffer
+
+
+def receive(connection: socket.socket, decode=True) -> str | bytearray:
     """
     Receives a message from the given connection.
     :param connection: Connection to receive the message from.
@@ -44,16 +94,17 @@ def receive(connection: socket.socket, decode=True) -> str | bytes:
     :return: The message that was received.
     :raises ConnectionResetError: If the connection is closed.
     """
+    if get_version(connection) != '1':
+        message_length = FRAME_HEADER.unpack(_recv_into(connection, FRAME_HEADER.size))[0]
+        message = _recv_into(connection, message_length)
+        return message.decode(ENCODING) if decode else message
     while True:
         try:
-            message_length = int(_recv(connection, HEADER).decode(ENCODING))
-            length_received = 0
-            message = b''
-            while length_received < message_length:
-                message += _recv(connection, message_length - length_received)
-                length_received = len(message)
+            message_length = int(_recv_into(connection, HEADER).decode(ENCODING))
+            message = _recv_into(connection, message_length)
             if decode:
                 message = message.decode(ENCODING)
             return message
         except ValueError:
             pass
+
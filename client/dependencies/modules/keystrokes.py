@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+This module encodes the keystrokes a player types during a round and
+validates them against the sentence as they arrive.
+
+The keystrokes are sent in batches, each batch being a single message:
+    k<characters>\\0<milliseconds>,<milliseconds>,...
+with one character per keystroke, BACKSPACE for a deleted character and
+EDIT for a key that moves the cursor, followed by the milliseconds since
+the previous keystroke for each of them.
+Once the countdown of a round is over the client also sends READY
+followed by the round, the time of the round is measured from it.
+
+It is the same on the client and the server.
+"""
+
+PREFIX: str = 'k'
+SEPARATOR: str = '\0'
+BACKSPACE: str = '\b'
+# A keystroke that edits the typed text in a way that is not followed,
+# like moving the cursor, after which only how much was typed and when
+# can be checked.
+EDIT: str = '\x7f'
+READY: str = 'r'
+
+
+def encode_keystrokes(keystrokes: list[tuple[str, int]]) -> str:
+    """
+    Encodes a batch of keystrokes.
+    :param keystrokes: The character and the milliseconds since the
+        previous keystroke of each keystroke.
+    :return: The message.
+    """
+    return (PREFIX + ''.join(character for character, _ in keystrokes) + SEPARATOR +
+            ','.join(str(delay) for _, delay in keystrokes))
+
+
+def decode_keystrokes(message: str) -> zip:
+    """
+    Decodes a batch of keystrokes.
+    :param message: The message.
+    :return: The character and the milliseconds since the previous
+        keystroke of each keystroke.
+    :raises ValueError: If the message is invalid.
+    """
+    characters, delays = message[len(PREFIX):].split(SEPARATOR)
+    delays = [int(delay) for delay in delays.split(',')] if delays else []
+    if len(characters) != len(delays):
+        raise ValueError('Invalid keystrokes')
+    return zip(characters, delays)
+
+
+def is_keystrokes(message: str) -> bool:
+    """Checks if a message is a batch of keystrokes."""
+    return message.startswith(PREFIX)
+
+
+def encode_ready(game_round: int) -> str:
+    """Encodes the message telling that the player can start typing a round."""
+    return READY + str(game_round)
+
+
+def decode_ready(message: str) -> int:
+    """
+    Decodes the message telling that the player can start typing.
+    :return: The round.
+    :raises ValueError: If the message is invalid.
+    """
+    return int(message[len(READY):])
+
+
+def is_ready(message: str) -> bool:
+    """Checks if a message tells that the player can start typing."""
+    return message.startswith(READY)
+
+
+class KeystrokeValidator:
+    """
+    It follows the keystrokes of a player in a round.
+    Only counters are kept, not the typed text: the text before the
+    first error is the start of the sentence, so the position of the
+    cursor and of the first error are enough to know whether the text
+    matches the sentence.
+    """
+
+    __slots__ = ('sentence', 'position', 'first_error', 'keys', 'correct', 'elapsed',
+                 'edited')
+
+    sentence: str
+    # length of the typed text
+    position: int
+    # position of the first character that does not match, if any
+    first_error: int | None
+    # number of characters typed and how many of them were correct
+    keys: int
+    correct: int
+    # milliseconds from the start of the round to the last keystroke
+    elapsed: int
+    # whether the text was edited in a way that is not followed
+    edited: bool
+
+    def __init__(self, sentence: str):
+        self.sentence = sentence
+        self.position = 0
+        self.first_error = None
+        self.keys = 0
+        self.correct = 0
+        self.elapsed = 0
+        self.edited = False
+
+    def feed(self, message: str) -> None:
+        """
+        Follows a batch of keystrokes.
+        :raises ValueError: If the message is invalid.
+        """
+        for character, delay in decode_keystrokes(message):
+            self.elapsed += delay
+            if character == BACKSPACE:
+                if self.position:
+                    self.position -= 1
+                    if self.first_error is not None and self.position <= self.first_error:
+                        self.first_error = None
+            elif character == EDIT:
+                self.edited = True
+            else:
+                self.keys += 1
+                if (self.first_error is None and self.position < len(self.sentence) and
+                        self.sentence[self.position] == character):
+                    self.correct += 1
+                elif self.first_error is None:
+                    self.first_error = self.position
+                self.position += 1
+
+    @property
+    def matches(self) -> bool:
+        """Whether the typed text is the sentence."""
+        return self.first_error is None and self.position == len(self.sentence)
+
+    @property
+    def progress(self) -> float:
+        """The fraction of the sentence typed correctly so far."""
+        typed = self.position if self.first_error is None else self.first_error
+        return min(typed, len(self.sentence)) / (len(self.sentence) or 1)
+
+    @property
+    def accuracy(self) -> float:
+        """The fraction of the characters typed that were correct."""
+        return self.correct / self.keys if self.keys else 0
+
+    def check(self, time_taken: float) -> float:
+        """
+        Checks the time taken a client reports against the keystrokes.
+        :param time_taken: The time taken, 0 if the sentence was
+            incorrect and -1 if the player cheated.
+        :return: The time taken, which is no less than the time the
+            keystrokes took, 0 if no character was received and -1 if
+            the sentence was reported correct without having been typed.
+        """
+        if time_taken <= 0:
+            return time_taken
+        if not self.keys:
+            # Nothing was typed, the player did not finish.
+            return 0
+        if self.edited:
+            # The text cannot be replayed once the cursor has moved, but
+            # deleting with the cursor is the only edit that is not
+            # counted, so the sentence needs at least as many characters
+            # as are left.
+            if self.position < len(self.sentence):
+                return -1
+        elif not self.matches:
+            return -1
+        return max(time_taken, self.elapsed / 1000)
+
+    def check_typed(self, count: int) -> int:
+        """
+        Checks the number of characters a client reports as typed
+        correctly in a timed round against the keystrokes.
+        :param count: The number of characters, 0 if none and -1 if
+            the player cheated.
+        :return: The number of characters, which is no more than the
+            keystrokes typed correctly.
+        """
+        if count <= 0:
+            return count
+        # The first error is not followed once the cursor has moved, but
+        # no more characters can have been typed than are left.
+        typed = self.position if self.first_error is None or self.edited else self.first_error
+        return min(count, typed)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+This module records the keystrokes of the player during a round and
+streams them to the server in batches.
+"""
+
+import time
+import socket
+import threading
+from pynput import keyboard
+from dependencies.modules.communicator import send
+from dependencies.modules.keystrokes import encode_keystrokes, BACKSPACE, EDIT
+
+# Seconds between the batches of keystrokes
+BATCH_INTERVAL: float = 0.1
+# Keys that move the cursor or delete characters after it
+EDIT_KEYS: tuple = tuple(getattr(keyboard.Key, name) for name in
+                         ('left', 'right', 'up', 'down', 'home', 'end', 'delete')
+                         if hasattr(keyboard.Key, name))
+
+
+class KeystrokeRecorder:
+    """
+    It records the keystrokes from when it is started until it is
+    stopped, sending what has been typed every BATCH_INTERVAL.
+    The text typed is kept too, for the rounds whose time runs out
+    before the player has pressed enter, and so are the keystrokes, to
+    be sent again if the connection drops during the round.
+    """
+
+    def __init__(self, server: socket.socket):
+        self.server = server
+        self.typed = ''
+        # every keystroke of the round and those not sent yet
+        self.keystrokes: list[tuple[str, int]] = []
+        self._keystrokes: list[tuple[str, int]] = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._last = 0
+        self._listener = keyboard.Listener(on_press=self._on_press)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> 'KeystrokeRecorder':
+        """Starts recording, from when the player can start typing."""
+        self._last = time.monotonic()
+        self._listener.start()
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stops recording and sends the keystrokes that are left."""
+        self._listener.stop()
+        self._stopped.set()
+        self._thread.join()
+        self._flush()
+
+    def _on_press(self, key) -> None:
+        if key == keyboard.Key.space:
+            character = ' '
+        elif key == keyboard.Key.backspace:
+            character = BACKSPACE
+        elif key in EDIT_KEYS:
+            character = EDIT
+        else:
+            character = getattr(key, 'char', None)
+            if not character or len(character) != 1:
+                return
+        now = time.monotonic()
+        with self._lock:
+            if character == BACKSPACE:
+                self.typed = self.typed[:-1]
+            elif character != EDIT:
+                self.typed += character
+            keystroke = (character, round((now - self._last) * 1000))
+            self.keystrokes.append(keystroke)
+            self._keystrokes.append(keystroke)
+            self._last = now
+
+    def _run(self) -> None:
+        try:
+            while not self._stopped.wait(BATCH_INTERVAL):
+                self._flush()
+        # The connection being lost is noticed when the time is sent.
+        except OSError:
+            pass
+
+    def _flush(self) -> None:
+        with self._lock:
+            keystrokes, self._keystrokes = self._keystrokes, []
+        if keystrokes:
+            send(encode_keystrokes(keystrokes), self.server)
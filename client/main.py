@@ -2,8 +2,9 @@
 """
 TypeSpeed is a typing speed test game where the user can host or
 join a game and compete with other players to see who can type
-the fastest. Each game can have a maximum of 10 players and each
-game has five rounds.
+the fastest. Each game can have a maximum of 10 players, and the host
+chooses its number of rounds, its mode and how it is scored. Games can
+also be watched without playing them.
 
 This module is the client for TypeSpeed.
 It handles the user input and the communication between the server.
@@ -17,18 +18,26 @@ __DEBUG__: bool = False
 
 SERVER: str = '45.79.122.54'
 PORT: int = 6969
+# Times to try reconnecting to a game, and seconds between the tries
+REJOIN_ATTEMPTS: int = 5
+REJOIN_DELAY: float = 2
 
 if __name__ == '__main__':
     import os
     import sys
     import time
-    import pickle
     import socket
     import inputimeout
     from pynput import keyboard
     from colorama import Fore, Style
-    from dependencies.modules.communicator import send, receive
+    from dependencies.modules.communicator import send, receive, set_version
+    from dependencies.modules.schema import (decode_round_result, decode_game_result,
+                                             decode_progress, decode_leaderboard,
+                                             decode_session, decode_resume,
+                                             decode_round_start, message_type)
     from dependencies.modules.loader import Loader
+    from dependencies.modules.recorder import KeystrokeRecorder
+    from dependencies.modules.keystrokes import encode_ready, encode_keystrokes
 
     startup: bool = True
     server: socket.socket | None = None
@@ -154,6 +163,151 @@ if __name__ == '__main__':
         return _username
 
 
+    def print_progress(_round: str, progress: dict[str, int], playing: bool = True) -> None:
+        """
+        Prints how much of the sentence every player has typed.
+        :param _round: The round, like 1/5.
+        :param progress: The percentage of the sentence of every player.
+        :param playing: Whether the user plays the game, instead of
+            watching it.
+        """
+        cls()
+        print_bright(f'Round {_round}')
+        if playing:
+            print('Waiting for other players to finish...')
+        for player, percent in progress.items():
+            bar = '#' * (percent // 5) + '-' * (20 - percent // 5)
+            print(f'[{bar}] {percent:3}% {check_username(player)}')
+
+
+    def print_round_result(_round: str, result: dict[str, tuple[float, int]],
+                           timed: bool) -> None:
+        """
+        Prints the result of a round.
+        :param _round: The round, like 1/5.
+        :param result: The time taken and the wpm of every player.
+        :param timed: Whether the round was timed, everyone typed for
+            the same time then.
+        """
+        cls()
+        print_bright(f'Round {_round} result')
+        dnf = []
+        cheat = []
+        for key, value in result.items():
+            if value[0] == 0:
+                dnf.append(key)
+            elif value[0] == -1:
+                cheat.append(key)
+            elif timed:
+                print(f'{check_username(key)}: {value[1]}WPM')
+            else:
+                print(f'{check_username(key)}: {round(value[0], 2)}s({value[1]}WPM)')
+        for key in cheat:
+            print(Fore.RED + f'{check_username(key)}: CHEATED' + Style.RESET_ALL)
+        for key in dnf:
+            print(Style.DIM + f'{check_username(key)}: DNF' + Style.RESET_ALL)
+
+
+    def print_game_result(game_result: dict[str, int]) -> None:
+        """
+        Prints the result of a game.
+        :param game_result: The score of every player, in order.
+        """
+        cls()
+        print_bright('Game result')
+        for position, player in enumerate(game_result.items()):
+            print(f'{position + 1}) {check_username(player[0])}: {player[1]}')
+
+
+    def connect(version: str = '2') -> socket.socket:
+        """
+        Connects to the server and negotiates the protocol version.
+        Servers that do not support the version close the connection.
+        Version 1 is not asked for as its results are pickled.
+        :param version: The protocol version to ask for.
+        :return: The socket connected to the server.
+        :raises ConnectionResetError: If the server does not support
+            the version.
+        """
+        _server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        _server.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        _server.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 10)
+        _server.connect((SERVER, PORT))
+        _server.send(version.encode())
+        try:
+            _server.settimeout(10)
+            if _server.recv(1).decode() != version:
+                raise ConnectionResetError
+            _server.settimeout(None)
+        except (ConnectionResetError, socket.timeout, UnicodeDecodeError):
+            _server.close()
+            raise ConnectionResetError
+        set_version(_server, version)
+        return _server
+
+
+    def send_answer(answer: str, keystrokes: list[tuple[str, int]] | None = None) -> None:
+        """
+        Sends the time of the user for the round.
+        If the connection has dropped, it is sent again after
+        reconnecting, so the error is left to the next receive.
+        :param answer: The time taken, 0 if the sentence is incorrect
+            and -1 if the user cheated.
+        :param keystrokes: Every keystroke of the round, sent before the
+            time after reconnecting, as the server then checks the time
+            against them instead of those sent before.
+        """
+        try:
+            if keystrokes is not None:
+                send(encode_keystrokes(keystrokes), server)
+            send(answer, server)
+        except OSError:
+            pass
+
+
+    def rejoin(token: str) -> tuple[int, dict | None, bool]:
+        """
+        Reconnects to the game after the connection has dropped.
+        The game keeps the place of the user for a while, which the
+        token of the user's session gives back.
+        :param token: The token of the user's session.
+        :return: The round of the game, its descriptor if the round is
+            in progress and whether the time of the user has been
+            received.
+        :raises ConnectionResetError: If the game could not be rejoined.
+        """
+        global server
+        server.close()
+        with Loader('Connection lost, reconnecting...', end=''):
+            for _ in range(REJOIN_ATTEMPTS):
+                try:
+                    server = connect()
+                    # Sending 4 to the server to tell that the user
+                    # wants to reconnect to a game, followed by the
+                    # token.
+                    send('4', server)
+                    send(token, server)
+                    if receive(server) != '1':
+                        break
+                    return decode_resume(receive(server))
+                except OSError:
+                    time.sleep(REJOIN_DELAY)
+        raise ConnectionResetError
+
+
+    def typed_correctly(original: str, typed: str) -> int:
+        """
+        Counts the characters typed before the first mistake.
+        :param original: The text to type.
+        :param typed: The typed text.
+        :return: The number of characters.
+        """
+        for index, (original_char, typed_char) in enumerate(zip(original, typed)):
+            if original_char != typed_char:
+                return index
+        return min(len(original), len(typed))
+
+
     def get_username(header: str) -> str:
         """Get the username from the user."""
         while True:
@@ -178,11 +332,7 @@ if __name__ == '__main__':
                 loader.start()
                 if not __DEBUG__ and startup:
                     time.sleep(2)
-                server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                server.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-                server.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 10)
-                server.connect((SERVER, PORT))
-                server.send(b'1')
+                server = connect()
                 loader.stop()
                 if startup:
                     cls(f'{__PROJECT__}')
@@ -207,10 +357,13 @@ if __name__ == '__main__':
                 print_bright('Menu')
                 print('0) Host a game')
                 print('1) Join a game')
-                print('2) Quit')
+                print('2) Leaderboard')
+                print('3) Quick match')
+                print('4) Spectate a game')
+                print('5) Quit')
                 user_input = input('Enter your choice: ')
 
-                if user_input in ['0', '1', '2']:
+                if user_input in ['0', '1', '2', '3', '4', '5']:
                     break
                 cls()
                 print_red('Invalid input!')
@@ -232,14 +385,69 @@ if __name__ == '__main__':
                         print_red('Invalid number of players!')
                     input('Press enter to try again...')
 
+                while True:
+                    cls()
+                    print_bright('Host a game')
+                    difficulty = return_menu_input(
+                        'Enter the difficulty(easy/medium/hard, leave empty for any): ').lower()
+                    if difficulty in ('', 'easy', 'medium', 'hard'):
+                        break
+                    cls()
+                    print_red('Invalid difficulty!')
+                    input('Press enter to try again...')
+
+                while True:
+                    cls()
+                    print_bright('Host a game')
+                    mode = return_menu_input(
+                        'Enter the mode(classic/timed/sudden, leave empty for classic): ').lower()
+                    if mode in ('', 'classic', 'timed', 'sudden'):
+                        break
+                    cls()
+                    print_red('Invalid mode!')
+                    input('Press enter to try again...')
+
+                while True:
+                    try:
+                        cls()
+                        print_bright('Host a game')
+                        rounds = return_menu_input(
+                            'Enter the number of rounds(max 20, leave empty for 5): ')
+                        assert not rounds or 0 < int(rounds) <= 20
+                        break
+                    except (ValueError, AssertionError):
+                        cls()
+                        print_red('Invalid number of rounds!')
+                    input('Press enter to try again...')
+
+                while True:
+                    cls()
+                    print_bright('Host a game')
+                    scoring = return_menu_input(
+                        'Enter the scoring(speed/accuracy, leave empty for speed): ').lower()
+                    if scoring in ('', 'speed', 'accuracy'):
+                        break
+                    cls()
+                    print_red('Invalid scoring!')
+                    input('Press enter to try again...')
+
                 username = get_username('Host a game')
 
                 # Sending 0 to the server to tell that the user wants to
-                # host a game.
+                # host a game, followed by the number of players and the
+                # options of the game.
+                options = [f'{name}={value}' for name, value in
+                           (('difficulty', difficulty), ('mode', mode), ('rounds', rounds),
+                            ('scoring', scoring)) if value]
                 send('0', server)
-                send(str(players), server)
+                send(' '.join([str(players), *options]), server)
                 send(username, server)
                 game_id = receive(server)
+                if not game_id:
+                    cls()
+                    print_red('The server is full, try again later!')
+                    input('Press enter to continue...')
+                    raise InterruptedError
 
             elif user_input == '1':
                 while True:
@@ -275,25 +483,202 @@ if __name__ == '__main__':
                     input('Press enter to try again...')
 
             elif user_input == '2':
+                while True:
+                    cls()
+                    print_bright('Leaderboard')
+                    window = return_menu_input(
+                        'Enter the leaderboard(all/today, leave empty for all): ').lower() or 'all'
+                    if window in ('all', 'today'):
+                        break
+                    cls()
+                    print_red('Invalid leaderboard!')
+                    input('Press enter to try again...')
+                cls()
+                print_bright('Leaderboard')
+                username = return_menu_input('Enter your username(leave empty to skip): ')
+
+                # Sending 2 to the server to tell that the user wants to
+                # see a leaderboard, followed by which one and the
+                # username to find the position of.
+                send('2', server)
+                send(f'{window} 10', server)
+                send(username, server)
+                leaderboard, rank = decode_leaderboard(receive(server))
+
+                cls()
+                print_bright('Leaderboard(today)' if window == 'today' else 'Leaderboard')
+                if not leaderboard:
+                    print('No results yet!')
+                for position, player in enumerate(leaderboard):
+                    print(f'{position + 1}) {check_username(player[0])}: {player[1]}WPM')
+                if rank and rank[0] > len(leaderboard):
+                    print('...')
+                    print(f'{rank[0]}) {check_username(username)}: {rank[1]}WPM')
+                input('Press enter to continue...')
+                raise InterruptedError
+
+            elif user_input == '3':
+                username = get_username('Quick match')
+
+                # Sending 3 to the server to tell that the user wants to
+                # be matched with other players, the server then tells
+                # the id and the number of players of the game once the
+                # user has been matched.
+                send('3', server)
+                send(username, server)
+                receive(server)
+                cls()
+                print_bright('Quick match')
+                with Loader('Looking for players...', end=''):
+                    game_id = receive(server)
+                    players = receive(server)
+
+            elif user_input == '4':
+                cls()
+                print_bright('Spectate a game')
+                game_id = return_menu_input('Enter the game ID: ')
+                # Sending 5 to the server to tell that the user wants to
+                # watch a game, the server then sends the rounds, the
+                # progress and the results of the game.
+                send('5', server)
+                send(game_id, server)
+                message = receive(server)
+                if message != '1':
+                    cls()
+                    if message == '0':
+                        print_red('Invalid game ID!')
+                    else:
+                        print_red('The game cannot be watched!')
+                    input('Press enter to continue...')
+                    raise InterruptedError
+
+                username = None
+                cls()
+                print_bright(f'Spectating game {game_id}')
+                print('Waiting for the game to start...')
+                _round = ''
+                timed = False
+                while True:
+                    message = receive(server)
+                    kind = message_type(message)
+                    if kind == 'start':
+                        descriptor = decode_round_start(message)
+                        _round = f'{descriptor["round"]}/{descriptor["rounds"]}'
+                        timed = descriptor['mode'] == 'timed'
+                        cls()
+                        print_bright(f'Round {_round}')
+                        print('The players are typing: ' +
+                              Style.BRIGHT + descriptor['text'] + Style.RESET_ALL)
+                    elif kind == 'progress':
+                        print_progress(_round, decode_progress(message), playing=False)
+                    elif kind == 'round':
+                        print_round_result(_round, decode_round_result(message), timed)
+                    elif kind == 'game':
+                        print_game_result(decode_game_result(message))
+                        input('Press enter to continue...')
+                        break
+                raise InterruptedError
+
+            elif user_input == '5':
                 break
 
+            token = None
             while True:
                 players_connected = receive(server)
                 # -1 is a ping from the server to check if the client
                 # is still connected.
-                if players_connected != '-1':
-                    cls()
-                    print(f'Game ID: {game_id}')  # noqa
+                if players_connected == '-1':
+                    continue
+                # The token to reconnect with if the connection drops
+                # during the game.
+                if message_type(players_connected) == 'session':
+                    token = decode_session(players_connected)
+                    continue
+                cls()
+                print(f'Game ID: {game_id}')  # noqa
 
-                    if players_connected == '0':
-                        print('Players connected: ' + Fore.GREEN +
-                              f'{players}/{players}' + Style.RESET_ALL)  # noqa
-                        time.sleep(2)
-                        break
-                    print('Players connected: ' + Fore.RED +
-                          f'{players_connected}/{players}' + Style.RESET_ALL)
+                if players_connected == '0':
+                    print('Players connected: ' + Fore.GREEN +
+                          f'{players}/{players}' + Style.RESET_ALL)  # noqa
+                    time.sleep(2)
+                    break
+                print('Players connected: ' + Fore.RED +
+                      f'{players_connected}/{players}' + Style.RESET_ALL)
+
+            # The messages of the game are handled as they arrive, so
+            # that the game can go on from wherever it is after
+            # reconnecting.
+            _round = ''
+            descriptor = sentence = user_sentence = answer = None
+            while True:
+                try:
+                    message = receive(server)
+                    kind = message_type(message)
+                except ConnectionResetError:
+                    if not token:
+                        raise
+                    _, resumed, submitted = rejoin(token)
+                    if resumed is None or submitted:
+                        continue
+                    if resumed == descriptor and answer is not None:
+                        # The time was typed but not received.
+                        send_answer(answer, recorder.keystrokes)
+                        continue
+                    # The round started while disconnected, it is
+                    # played like any other.
+                    message, kind = None, 'start'
+
+                if message == '-1':
+                    continue
+
+                # The progress of the other players is shown until the
+                # result of the round arrives.
+                if kind == 'progress':
+                    print_progress(_round, decode_progress(message))
+                    continue
+
+                if kind == 'round':
+                    result = decode_round_result(message)
+                    if sentence is not None:
+                        cls()
+                        print_bright(f'Round {_round}')
+                        if descriptor['mode'] == 'timed':
+                            # Only the part of the text that was typed
+                            # is compared.
+                            sentence = sentence[:max(len(user_sentence), 1)]
+                        print(f'Original sentence: {sentence}')
+                        if user_sentence != sentence:
+                            print('Your sentence: ' + compare_sentences(sentence, user_sentence))
+                        else:
+                            print('Your sentence: ' +
+                                  Fore.GREEN + Style.BRIGHT + user_sentence + Style.RESET_ALL)
+                        time.sleep(5)
+                    sentence = user_sentence = answer = None
+
+                    print_round_result(_round, result,
+                                       descriptor is not None and descriptor['mode'] == 'timed')
+                    time.sleep(5)
+                    continue
+
+                if kind == 'game':
+                    print_game_result(decode_game_result(message))
+                    input('Press enter to continue...')
+                    break
 
-            for _round in range(1, 6):
+                if kind != 'start':
+                    continue
+                # The next round, played by the rules it is sent with.
+                descriptor = resumed if message is None else decode_round_start(message)
+                _round = f'{descriptor["round"]}/{descriptor["rounds"]}'
+                if username not in descriptor['players']:
+                    # An eliminated player watches the others play.
+                    cls()
+                    print_bright(f'Round {_round}')
+                    print_red('You have been eliminated!')
+                    print('Waiting for other players to finish...')
+                    continue
+                sentence = descriptor['text']
+                timed = descriptor['mode'] == 'timed'
 
                 copy = False
                 paste = False
@@ -320,8 +705,6 @@ if __name__ == '__main__':
                                              '<cmd>+v': on_paste,
                                              '<ctrl>+v': on_paste}):
 
-                    sentence = receive(server)
-
                     cls()
                     print_bright(f'Round no.{_round} is about to start! Get ready...')
                     time.sleep(2)
@@ -330,75 +713,61 @@ if __name__ == '__main__':
                         time.sleep(1)
                         cls()
                         print_bright(f'Round {_round}')
-                        print('Type the following words as fast as you can: ' +
-                              Style.BRIGHT + sentence + Style.RESET_ALL)
+                        if timed:
+                            print(f'Type as much of the following text as you can in '
+                                  f'{descriptor["time"]:g}s: ' +
+                                  Style.BRIGHT + sentence + Style.RESET_ALL)
+                        else:
+                            print('Type the following words as fast as you can: ' +
+                                  Style.BRIGHT + sentence + Style.RESET_ALL)
                         if time_left:
                             print(f'Start typing in {time_left}s')
                         else:
                             print('Start typing!')
 
                     flush_input()
+                    # The server measures the round from when the
+                    # player can start typing.
+                    try:
+                        send(encode_ready(descriptor['round']), server)
+                    # The connection being lost is noticed when the
+                    # next message is received.
+                    except OSError:
+                        pass
+                    # The keystrokes are streamed to the server while
+                    # the sentence is typed.
+                    recorder = KeystrokeRecorder(server).start()
                     try:
                         start = time.time()
-                        user_sentence = inputimeout.inputimeout('Type: ', timeout=20)
+                        user_sentence = inputimeout.inputimeout('Type: ',
+                                                                timeout=descriptor['time'])
                         end = time.time()
                     except inputimeout.TimeoutOccurred:
-                        user_sentence = ''
+                        # What was typed of a timed round counts when
+                        # the time runs out.
+                        user_sentence = recorder.typed if timed else ''
+                    finally:
+                        try:
+                            recorder.stop()
+                        # The connection being lost is noticed when the
+                        # next message is received.
+                        except OSError:
+                            pass
 
                     if copy and paste:
-                        send('-1', server)
+                        answer = '-1'
+                    elif timed:
+                        # A timed round is scored from the characters
+                        # typed before the first mistake.
+                        answer = str(typed_correctly(sentence, user_sentence))
                     elif user_sentence != sentence:
-                        send('0', server)
+                        answer = '0'
                     else:
-                        send(str(end - start), server)  # noqa
+                        answer = str(end - start)  # noqa
+                    send_answer(answer)
 
                     print('Waiting for other players to finish...')
 
-                while True:
-                    try:
-                        result = receive(server, decode=False)
-                        if result.decode() != '-1':
-                            break
-                    except UnicodeDecodeError:
-                        break
-
-                result = pickle.loads(result)  # noqa
-                cls()
-                print_bright(f'Round {_round}')
-                print(f'Original sentence: {sentence}')
-                if user_sentence != sentence:
-                    print('Your sentence: ' + compare_sentences(sentence, user_sentence))
-                else:
-                    print('Your sentence: ' +
-                          Fore.GREEN + Style.BRIGHT + user_sentence + Style.RESET_ALL)
-                time.sleep(5)
-
-                cls()
-
-                print_bright(f'Round {_round} result')
-                dnf = []
-                cheat = []
-                for key, value in result.items():
-                    if value[0] == 0:
-                        dnf.append(key)
-                    elif value[0] == -1:
-                        cheat.append(key)
-                    else:
-                        print(f'{check_username(key)}: {round(value[0], 2)}s({value[1]}WPM)')
-                for key in cheat:
-                    print(Fore.RED + f'{check_username(key)}: CHEATED' + Style.RESET_ALL)
-                for key in dnf:
-                    print(Style.DIM + f'{check_username(key)}: DNF' + Style.RESET_ALL)
-                time.sleep(5)
-
-            game_result = list(pickle.loads(receive(server, decode=False)).items())
-
-            cls()
-            print_bright('Game result')
-            for position, player in enumerate(game_result):
-                print(f'{position + 1}) {check_username(player[0])}: {player[1]}')
-            input('Press enter to continue...')
-
         except (KeyboardInterrupt, InterruptedError):
             pass
 
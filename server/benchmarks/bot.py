@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+A headless client that hosts or joins a game and plays it with
+synthetic times, so that the server can be driven without a terminal.
+
+Every message the bot receives is timestamped, which is what the load
+benchmark measures the latencies from.
+
+Run from the server directory:
+    python -m benchmarks.bot --players 2
+    python -m benchmarks.bot --join 1234
+    python -m benchmarks.bot --quick
+    python -m benchmarks.bot --spectate 1234
+"""
+
+import time
+import pickle
+import random
+import socket
+import argparse
+from dependencies.modules.communicator import send, receive, set_version, ENCODING  # noqa
+from dependencies.modules.schema import (decode_round_result, decode_game_result,  # noqa
+                                         decode_round_start, message_type)
+from dependencies.modules.keystrokes import encode_keystrokes, encode_ready  # noqa
+
+# Rounds of a game played by a client of version 1, which is not sent
+# the rules
+ROUNDS: int = 5
+
+
+class Bot:
+    """
+    It represents a player of a game.
+    The times it submits, or the characters it has typed in a timed
+    round, are worked out from its words per minute, and it waits that
+    long before submitting them if delay is set.
+    """
+
+    address: tuple[str, int]
+    username: str
+    version: str
+    wpm: int
+    # fraction of the typing time to actually wait before submitting
+    delay: float
+    connection: socket.socket | None
+    # the messages received and sent with the time they were, as
+    # (event, round, time.monotonic())
+    events: list[tuple[str, int, float]]
+    round_results: list
+    game_result: list | dict | None
+
+    def __init__(self, address: tuple[str, int], username: str, version: str = '2',
+                 wpm: int | None = None, delay: float = 0):
+        self.address = address
+        self.username = username
+        self.version = version
+        self.wpm = wpm or random.randint(40, 120)
+        self.delay = delay
+        self.connection = None
+        self.events = []
+        self.round_results = []
+        self.game_result = None
+
+    def connect(self) -> float:
+        """
+        Connects to the server and negotiates the protocol version.
+        :return: The seconds the connection and the handshake took.
+        :raises ConnectionError: If the server did not accept the version.
+        """
+        start = time.monotonic()
+        self.connection = socket.create_connection(self.address)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connection.send(self.version.encode(ENCODING))
+        if self.version != '1' and self.connection.recv(1) != self.version.encode(ENCODING):
+            raise ConnectionRefusedError('Protocol version not accepted')
+        set_version(self.connection, self.version)
+        return time.monotonic() - start
+
+    def host(self, player_count: int, options: str = '') -> str:
+        """
+        Hosts a game.
+        :param player_count: The number of players of the game.
+        :param options: The options of the game, like difficulty=hard.
+        :return: The id of the game.
+        :raises ConnectionRefusedError: If the server is full.
+        """
+        send('0', self.connection)
+        send(f'{player_count} {options}'.strip(), self.connection)
+        send(self.username, self.connection)
+        game_id = receive(self.connection)
+        if not game_id:
+            raise ConnectionRefusedError('The server is full')
+        # The number of players in the game
+        receive(self.connection)
+        return game_id
+
+    def join(self, game_id: str, retries: int = 20) -> bool:
+        """
+        Joins a game.
+        :param game_id: The id of the game.
+        :param retries: How many times to ask again for a game that does
+            not exist yet.
+        :return: Whether the game was joined.
+        """
+        send('1', self.connection)
+        send(game_id, self.connection)
+        while (reply := receive(self.connection)) == '0' and retries:
+            retries -= 1
+            time.sleep(0.01)
+            send(game_id, self.connection)
+        if reply != '1':
+            return False
+        send(self.username, self.connection)
+        if receive(self.connection) != '1':
+            return False
+        # The number of players of the game
+        receive(self.connection)
+        return True
+
+    def quick_match(self) -> str:
+        """
+        Waits for the matchmaker to put the bot in a game.
+        :return: The id of the game.
+        """
+        send('3', self.connection)
+        send(self.username, self.connection)
+        # The bot has been queued
+        receive(self.connection)
+        game_id = receive(self.connection)
+        # The number of players of the game
+        receive(self.connection)
+        return game_id
+
+    def spectate(self, game_id: str) -> bool:
+        """
+        Starts watching a game.
+        :param game_id: The id of the game.
+        :return: Whether the game can be watched.
+        """
+        send('5', self.connection)
+        send(game_id, self.connection)
+        return receive(self.connection) == '1'
+
+    def watch(self) -> None:
+        """
+        Receives the rounds and the results of the game being watched
+        until the result of the game.
+        :raises ConnectionError: If the server closed the connection.
+        """
+        game_round = 0
+        while (kind := message_type(message := receive(self.connection, False))) != 'game':
+            if kind == 'start':
+                game_round = decode_round_start(message)['round'] - 1
+                self.events.append(('sentence', game_round, time.monotonic()))
+            elif kind == 'round':
+                self.events.append(('result', game_round, time.monotonic()))
+                self.round_results.append(decode_round_result(message))
+        self.events.append(('game_result', game_round + 1, time.monotonic()))
+        self.game_result = decode_game_result(message)
+
+    def play(self) -> None:
+        """
+        Waits for the game to start and plays every round.
+        :raises ConnectionError: If the server closed the connection.
+        """
+        # Pings and the number of players until the game starts
+        while receive(self.connection) != '0':
+            pass
+        self.events.append(('start', 0, time.monotonic()))
+        if self.version == '1':
+            for game_round in range(ROUNDS):
+                sentence = self._receive()
+                self.events.append(('sentence', game_round, time.monotonic()))
+                self._submit(game_round, {'mode': 'classic', 'text': sentence})
+                result = self._receive(decode=False)
+                self.events.append(('result', game_round, time.monotonic()))
+                self.round_results.append(pickle.loads(result))
+            result = self._receive(decode=False)
+            self.events.append(('game_result', ROUNDS, time.monotonic()))
+            self.game_result = pickle.loads(result)
+            return
+
+        # The rounds are played as the server describes them, until the
+        # result of the game.
+        game_round = 0
+        while (kind := message_type(message := self._receive(decode=False))) != 'game':
+            if kind == 'start':
+                descriptor = decode_round_start(message)
+                game_round = descriptor['round'] - 1
+                self.events.append(('sentence', game_round, time.monotonic()))
+                # An eliminated player only watches the round.
+                if self.username in descriptor['players']:
+                    self._submit(game_round, descriptor)
+            elif kind == 'round':
+                self.events.append(('result', game_round, time.monotonic()))
+                self.round_results.append(decode_round_result(message))
+        self.events.append(('game_result', game_round + 1, time.monotonic()))
+        self.game_result = decode_game_result(message)
+
+    def close(self) -> None:
+        """Closes the connection."""
+        if self.connection:
+            self.connection.close()
+
+    def _submit(self, game_round: int, descriptor: dict) -> None:
+        # Submits the time of a round, or the characters typed within
+        # its time if it is timed.
+        text = descriptor['text']
+        if self.version != '1':
+            # The bot has no countdown, it starts typing at once.
+            send(encode_ready(descriptor['round']), self.connection)
+        if descriptor['mode'] == 'timed':
+            typing_time = descriptor['time']
+            report = min(len(text), int(self.wpm * 5 * typing_time / 60))
+        else:
+            typing_time = report = len(text) / 5 / self.wpm * 60
+        if self.delay:
+            time.sleep(typing_time * self.delay)
+        if self.version != '1':
+            # The keystrokes are checked against the report, they are
+            # sent as one batch evenly spread over the typing time.
+            typed = text[:report] if descriptor['mode'] == 'timed' else text
+            delay = int(typing_time * 1000 / (len(typed) or 1))
+            send(encode_keystrokes([(character, delay) for character in typed]),
+                 self.connection)
+        send(str(report), self.connection)
+        self.events.append(('submitted', game_round, time.monotonic()))
+
+    def _receive(self, decode: bool = True) -> str | bytearray:
+        # Skip the pings that were sent before the game started and the
+        # progress of the other players.
+        while ((message := receive(self.connection, decode)) in ('-1', b'-1') or
+               (self.version != '1' and message_type(message) == 'progress')):
+            pass
+        return message
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='TypeSpeed bot')
+    parser.add_argument('--server', default='127.0.0.1:6969', help='address of the server')
+    parser.add_argument('--username', default=f'bot{random.randint(1000, 9999)}')
+    parser.add_argument('--version', choices=('1', '2'), default='2')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--players', type=int, default=2, help='host a game of this many players')
+    group.add_argument('--join', help='join the game of this id')
+    group.add_argument('--quick', action='store_true', help='find a quick match')
+    group.add_argument('--spectate', help='watch the game of this id')
+    parser.add_argument('--options', default='',
+                        help='options of the hosted game, like "rounds=3 mode=timed"')
+    parser.add_argument('--delay', type=float, default=0,
+                        help='fraction of the typing time to wait before submitting')
+    args = parser.parse_args()
+
+    server_address, port = args.server.rsplit(':', 1)
+    bot = Bot((server_address, int(port)), args.username, args.version, delay=args.delay)
+    bot.connect()
+    if args.spectate:
+        if not bot.spectate(args.spectate):
+            raise SystemExit(f'Could not watch game {args.spectate}')
+        bot.watch()
+        print(bot.game_result)
+        bot.close()
+        raise SystemExit
+    if args.quick:
+        print(f'Matched into game {bot.quick_match()}', flush=True)
+    elif args.join:
+        if not bot.join(args.join):
+            raise SystemExit(f'Could not join game {args.join}')
+    else:
+        print(f'Hosting game {bot.host(args.players, args.options)}', flush=True)
+    bot.play()
+    print(bot.game_result)
+    bot.close()
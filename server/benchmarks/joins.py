@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Stresses the joining of games to check that it is free of races.
+
+The server is started on its own port, then for every game a bot hosts
+it and more bots than it has places try to join it at the same instant,
+their usernames drawn from a pool smaller than them so that many of
+them ask for the same one. A game is correct if exactly its places were
+taken, by players of different usernames, and if it is then played to
+the end with every one of them in its result. The time the locks of the
+games were waited for and held is read from the metrics of the server.
+
+Run from the server directory:
+    python -m benchmarks.joins --games 50 --players 4 --joiners 16
+"""
+
+import sys
+import argparse
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.bot import Bot  # noqa
+from benchmarks.load import start_server, stop_server  # noqa
+
+
+def stress_game(address: tuple[str, int], players: int, joiners: int, usernames: int) -> list[str]:
+    """
+    Hosts a game and has bots join it all at once.
+    :param address: The address of the server.
+    :param players: The number of players of the game.
+    :param joiners: The number of bots that try to join.
+    :param usernames: The number of usernames the bots are drawn from.
+    :return: What went wrong, nothing if the game is correct.
+    """
+    host = Bot(address, 'host')
+    host.connect()
+    game_id = host.host(players)
+    bots = [Bot(address, f'player{index % usernames}') for index in range(joiners)]
+    for bot in bots:
+        bot.connect()
+    joined = []
+    barrier = threading.Barrier(joiners)
+
+    def _join(bot: Bot) -> None:
+        barrier.wait()
+        if bot.join(game_id, retries=0):
+            joined.append(bot)
+
+    threads = [threading.Thread(target=_join, args=(bot,)) for bot in bots]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for bot in bots:
+        if bot not in joined:
+            bot.close()
+
+    errors = []
+    names = [bot.username for bot in joined]
+    if len(joined) != players - 1:
+        errors.append(f'game {game_id}: {len(joined) + 1} players joined a game of {players}')
+    if len(set(names)) != len(names) or host.username in names:
+        errors.append(f'game {game_id}: usernames taken twice {sorted(names)}')
+    if errors:
+        for bot in [host, *joined]:
+            bot.close()
+        return errors
+
+    threads = [threading.Thread(target=bot.play) for bot in [host, *joined]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for bot in [host, *joined]:
+        bot.close()
+        if set(bot.game_result or ()) != {host.username, *names}:
+            errors.append(f'game {game_id}: {bot.username} got the result {bot.game_result}')
+    return errors
+
+
+def lock_times(metrics_port: int) -> dict[str, tuple[int, float, float]]:
+    """
+    Reads the times of the locks of the games from the metrics.
+    :return: The count, the mean and the bound of the 99th percentile
+        of the wait and of the hold, in seconds.
+    """
+    with urllib.request.urlopen(f'http://127.0.0.1:{metrics_port}/metrics') as response:
+        lines = response.read().decode().splitlines()
+    times = {}
+    for name in ('wait', 'held'):
+        metric = f'typespeed_game_lock_{name}_seconds'
+        buckets = [(float(line.split('"')[1]), float(line.split()[-1]))
+                   for line in lines if line.startswith(metric + '_bucket')]
+        total = float(next(line for line in lines if line.startswith(metric + '_sum')).split()[-1])
+        count = int(buckets[-1][1])
+        p99 = next((bound for bound, cumulative in buckets if cumulative >= count * 0.99), 0)
+        times[name] = count, total / count if count else 0, p99
+    return times
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='TypeSpeed join stress test')
+    parser.add_argument('--port', type=int, default=7071)
+    parser.add_argument('--metrics-port', type=int, default=9091)
+    parser.add_argument('--mode', choices=('thread', 'asyncio'), default='thread')
+    parser.add_argument('--games', type=int, default=50)
+    parser.add_argument('--players', type=int, default=4, help='players of every game')
+    parser.add_argument('--joiners', type=int, default=16,
+                        help='bots that try to join every game')
+    parser.add_argument('--usernames', type=int, default=6,
+                        help='usernames the bots are drawn from')
+    parser.add_argument('--concurrency', type=int, default=10,
+                        help='games stressed at the same time')
+    parser.add_argument('--log', help='file to write the log of the server to')
+    args = parser.parse_args()
+
+    address = ('127.0.0.1', args.port)
+    process = start_server(args.port, args.mode, 1, args.log,
+                           ['--metrics-port', str(args.metrics_port)])
+    try:
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            futures = [executor.submit(stress_game, address, args.players, args.joiners,
+                                       args.usernames) for _ in range(args.games)]
+            errors = [error for future in futures for error in future.result()]
+        times = lock_times(args.metrics_port) if args.mode == 'thread' else {}
+    finally:
+        stop_server(process)
+
+    for error in errors:
+        print(error, file=sys.stderr)
+    print(f'server: {args.mode}')
+    print(f'games: {args.games - len({error.split(":")[0] for error in errors})}/{args.games} '
+          f'correct, {args.joiners} joiners for {args.players - 1} places each')
+    for name, (count, mean, p99) in times.items():
+        print(f'lock {name}: {count} times, mean {mean * 1e6:.1f}us, p99 <= {p99 * 1e6:.0f}us')
+    if errors:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
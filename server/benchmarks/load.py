@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+Measures the capacity of the server by driving it with bots.
+
+The server is started on its own port, then:
+1. A burst of connections is opened and handshaken to measure the
+   connections per second.
+2. Games of bots are played, a number of them at once, to measure the
+   games per second, the broadcast latency (from the last time of a
+   round being submitted to each player receiving the round result),
+   the round completion latency (from the first player receiving the
+   sentence to the last player receiving the round result), and the
+   memory and threads of the server while the games are running.
+
+Run from the server directory:
+    python -m benchmarks.load --games 200 --players 4 --concurrency 50
+"""
+
+import os
+import sys
+import time
+import signal
+import socket
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.bot import Bot  # noqa
+from dependencies.modules.rounds import create_rules  # noqa
+
+SERVER_DIRECTORY: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Seconds between the samples of the memory and threads of the server
+SAMPLE_INTERVAL: float = 0.05
+
+
+def start_server(port: int, mode: str, workers: int, log: str | None,
+                 arguments: list[str] | None = None) -> subprocess.Popen:
+    """
+    Starts the server and waits until it accepts connections.
+    :param arguments: Other arguments of the server.
+    :raises RuntimeError: If the server did not start.
+    """
+    output = open(log, 'w') if log else subprocess.DEVNULL
+    process = subprocess.Popen([sys.executable, 'main.py', '--port', str(port),
+                                '--mode', mode, '--workers', str(workers), '--rate-limit', '0',
+                                *(arguments or [])],
+                               cwd=SERVER_DIRECTORY, stdout=output, stderr=output)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            # The server drops a connection that closes without a
+            # handshake.
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            # The other workers are given the time to start as well.
+            time.sleep(0.2 * workers)
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError('The server did not start')
+
+
+def stop_server(process: subprocess.Popen) -> None:
+    """Interrupts the server and waits for it to exit."""
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(5)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def process_tree(pid: int) -> list[int]:
+    """Returns the process and all of its descendants."""
+    pids = [pid]
+    for pid in pids:
+        try:
+            for task in os.listdir(f'/proc/{pid}/task'):
+                with open(f'/proc/{pid}/task/{task}/children') as file:
+                    pids.extend(int(child) for child in file.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def sample(pid: int) -> tuple[int, int]:
+    """
+    Returns the resident memory in kilobytes and the number of threads
+    of a process and its descendants.
+    """
+    memory = threads = 0
+    for process in process_tree(pid):
+        try:
+            with open(f'/proc/{process}/status') as file:
+                for line in file:
+                    if line.startswith('VmRSS:'):
+                        memory += int(line.split()[1])
+                    elif line.startswith('Threads:'):
+                        threads += int(line.split()[1])
+        except OSError:
+            pass
+    return memory, threads
+
+
+class Sampler(threading.Thread):
+    """It records the peak memory and threads of the server."""
+
+    def __init__(self, pid: int):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.peak_memory = self.peak_threads = 0
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(SAMPLE_INTERVAL):
+            memory, threads = sample(self.pid)
+            self.peak_memory = max(self.peak_memory, memory)
+            self.peak_threads = max(self.peak_threads, threads)
+
+    def stop(self) -> None:
+        """Stops sampling."""
+        self._stopped.set()
+        self.join()
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Returns the value below which the percent of the values fall."""
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def measure_connections(address: tuple[str, int], count: int, threads: int) -> float:
+    """
+    Opens and handshakes connections as fast as possible.
+    :return: The connections per second.
+    """
+    def _connect(index: int) -> Bot:
+        bot = Bot(address, f'connection{index}', version='2' if index % 2 else '1')
+        bot.connect()
+        return bot
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(threads) as executor:
+        bots = list(executor.map(_connect, range(count)))
+    elapsed = time.monotonic() - start
+    for bot in bots:
+        bot.close()
+    return count / elapsed
+
+
+def play_game(address: tuple[str, int], players: int, delay: float,
+              options: str) -> list[Bot]:
+    """
+    Hosts a game with a bot and fills it with more bots, alternating
+    between the protocol versions, then plays it. Clients of version 1
+    can only play by the classic rules, other games only have bots of
+    version 2.
+    :return: The bots of the game.
+    """
+    classic = create_rules(dict(option.split('=', 1) for option in options.split())).classic
+    bots = [Bot(address, f'bot{index}', version='2' if index % 2 == 0 or not classic else '1',
+                delay=delay) for index in range(players)]
+    try:
+        for bot in bots:
+            bot.connect()
+        game_id = bots[0].host(players, options)
+        for bot in bots[1:]:
+            if not bot.join(game_id):
+                raise ConnectionRefusedError(f'Could not join game {game_id}')
+        threads = [threading.Thread(target=bot.play, daemon=True) for bot in bots]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        for bot in bots:
+            bot.close()
+    return bots
+
+
+def latencies(bots: list[Bot]) -> tuple[list[float], list[float]]:
+    """
+    Works out the latencies of a game from the events of its bots.
+    :return: The broadcast latencies and the round completion latencies.
+    """
+    broadcast, completion = [], []
+    rounds = {event[1] for bot in bots for event in bot.events if event[0] == 'result'}
+    for game_round in rounds:
+        def _times(name: str) -> list[float]:
+            return [at for bot in bots for event, _round, at in bot.events
+                    if event == name and _round == game_round]
+
+        results = _times('result')
+        submitted = max(_times('submitted'))
+        broadcast.extend(result - submitted for result in results)
+        completion.append(max(results) - min(_times('sentence')))
+    return broadcast, completion
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='TypeSpeed load benchmark')
+    parser.add_argument('--port', type=int, default=7070)
+    parser.add_argument('--mode', choices=('thread', 'asyncio'), default='thread')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--connections', type=int, default=500,
+                        help='connections of the connection burst')
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--players', type=int, default=4, help='players of every game')
+    parser.add_argument('--concurrency', type=int, default=25,
+                        help='games played at the same time')
+    parser.add_argument('--delay', type=float, default=0,
+                        help='fraction of the typing time the bots wait')
+    parser.add_argument('--options', default='', help='options of the games')
+    parser.add_argument('--log', help='file to write the log of the server to')
+    args = parser.parse_args()
+
+    address = ('127.0.0.1', args.port)
+    process = start_server(args.port, args.mode, args.workers, args.log)
+    try:
+        connections_per_second = measure_connections(address, args.connections,
+                                                     args.concurrency)
+        base_memory, base_threads = sample(process.pid)
+        sampler = Sampler(process.pid)
+        sampler.start()
+
+        start = time.monotonic()
+        broadcast, completion = [], []
+        failures = 0
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            futures = [executor.submit(play_game, address, args.players, args.delay, args.options)
+                       for _ in range(args.games)]
+            for future in futures:
+                try:
+                    game_broadcast, game_completion = latencies(future.result())
+                except (ConnectionError, OSError, ValueError) as error:
+                    print(f'Game failed: {error!r}', file=sys.stderr)
+                    failures += 1
+                    continue
+                broadcast.extend(game_broadcast)
+                completion.extend(game_completion)
+        elapsed = time.monotonic() - start
+        sampler.stop()
+    finally:
+        stop_server(process)
+
+    concurrent_games = min(args.concurrency, args.games)
+    print(f'server: {args.mode}, {args.workers} worker(s)')
+    print(f'connections/s: {connections_per_second:.0f}')
+    print(f'games/s: {(args.games - failures) / elapsed:.1f} '
+          f'({args.games - failures}/{args.games} games of {args.players} players '
+          f'in {elapsed:.2f}s)')
+    for name, values in (('broadcast latency', broadcast), ('round completion', completion)):
+        print(f'{name}: p50 {percentile(values, 50) * 1000:.2f}ms, '
+              f'p99 {percentile(values, 99) * 1000:.2f}ms')
+    print(f'memory: {base_memory / 1024:.1f}MiB idle, '
+          f'{(sampler.peak_memory - base_memory) / concurrent_games:.0f}KiB per game')
+    print(f'threads: {base_threads} idle, {sampler.peak_threads} peak')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Measures the round trip speed of the result encoding against pickle.
+
+Run from the server directory:
+    python -m benchmarks.schema
+"""
+
+import pickle
+import random
+import timeit
+from dependencies.modules.schema import (encode_round_result, decode_round_result,  # noqa
+                                         encode_game_result, decode_game_result)
+
+NUMBER: int = 20000
+
+
+def create_results(players: int) -> tuple[dict[str, tuple[float, int]], dict[str, int]]:
+    """
+    Creates the results of a round and of a game.
+    :param players: The number of players in the game.
+    :return: The round result and the game result.
+    """
+    usernames = [f'player{index}' for index in range(players)]
+    round_result = {username: (random.uniform(5, 20), random.randint(20, 120))
+                    for username in usernames}
+    game_result = {username: random.randint(100, 600) for username in usernames}
+    return round_result, game_result
+
+
+def measure(encoder, decoder, result) -> tuple[float, float, int]:
+    """
+    Measures an encoding.
+    :return: The microseconds to encode and to decode the result and
+        the size of the encoded result.
+    """
+    message = encoder(result)
+    encode_time = timeit.timeit(lambda: encoder(result), number=NUMBER)
+    decode_time = timeit.timeit(lambda: decoder(message), number=NUMBER)
+    return encode_time / NUMBER * 1e6, decode_time / NUMBER * 1e6, len(message)
+
+
+if __name__ == '__main__':
+    print(f'{"result":<16}{"encoding":<10}{"encode(us)":>12}{"decode(us)":>12}{"size(B)":>10}')
+    for player_count in (2, 10):
+        results = create_results(player_count)
+        for name, result, encoders in (
+                ('round', results[0], {'pickle': (pickle.dumps, pickle.loads),
+                                       'schema': (encode_round_result, decode_round_result)}),
+                ('game', results[1], {'pickle': (pickle.dumps, pickle.loads),
+                                      'schema': (encode_game_result, decode_game_result)})):
+            for encoding, (encode, decode) in encoders.items():
+                encode_us, decode_us, size = measure(encode, decode, result)
+                print(f'{f"{name}({player_count})":<16}{encoding:<10}'
+                      f'{encode_us:>12.2f}{decode_us:>12.2f}{size:>10}')
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Measures what the spectators of the games cost their players.
+
+The server is started on its own port, then the same games of bots are
+played twice, first without spectators and then with many spectators
+watching every game. The broadcast and round completion latencies of
+the players are compared between the two, along with how long after
+the players the spectators got the results of the rounds and how many
+of them saw the whole game.
+
+Run from the server directory:
+    python -m benchmarks.spectators --games 20 --players 4 --spectators 200
+"""
+
+import sys
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.bot import Bot  # noqa
+from benchmarks.load import start_server, stop_server, latencies, percentile  # noqa
+
+
+def watch_game(address: tuple[str, int], players: int, spectators: int,
+               options: str) -> tuple[list[Bot], list[Bot]]:
+    """
+    Hosts a game with a bot, fills it with more bots and has other bots
+    watch it, then plays it.
+    :return: The players and the spectators of the game.
+    """
+    bots = [Bot(address, f'bot{index}') for index in range(players)]
+    watchers = [Bot(address, f'spectator{index}') for index in range(spectators)]
+    try:
+        bots[0].connect()
+        game_id = bots[0].host(players, options)
+        # The spectators watch from the lobby so that they see every
+        # round.
+        for watcher in watchers:
+            watcher.connect()
+            if not watcher.spectate(game_id):
+                raise ConnectionRefusedError(f'Could not watch game {game_id}')
+        for bot in bots[1:]:
+            bot.connect()
+            if not bot.join(game_id):
+                raise ConnectionRefusedError(f'Could not join game {game_id}')
+        threads = [threading.Thread(target=watcher.watch, daemon=True) for watcher in watchers]
+        threads += [threading.Thread(target=bot.play, daemon=True) for bot in bots]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        for bot in [*bots, *watchers]:
+            bot.close()
+    return bots, watchers
+
+
+def lags(bots: list[Bot], watchers: list[Bot]) -> list[float]:
+    """
+    Works out how long after the last player every spectator got the
+    result of every round.
+    """
+    lag = []
+    for game_round in {event[1] for bot in bots for event in bot.events if event[0] == 'result'}:
+        last = max(at for bot in bots for event, _round, at in bot.events
+                   if event == 'result' and _round == game_round)
+        lag.extend(at - last for watcher in watchers for event, _round, at in watcher.events
+                   if event == 'result' and _round == game_round)
+    return lag
+
+
+def run_games(address: tuple[str, int], args: argparse.Namespace,
+              spectators: int) -> tuple[list[float], list[float], list[float], int, float]:
+    """
+    Plays the games of the benchmark.
+    :return: The broadcast latencies and the round completion latencies
+        of the players, the lags of the spectators, the spectators who
+        saw the whole game and the seconds taken.
+    """
+    broadcast, completion, lag, served = [], [], [], 0
+    start = time.monotonic()
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        futures = [executor.submit(watch_game, address, args.players, spectators, args.options)
+                   for _ in range(args.games)]
+        for future in futures:
+            try:
+                bots, watchers = future.result()
+                game_broadcast, game_completion = latencies(bots)
+            except (ConnectionError, OSError, ValueError) as error:
+                print(f'Game failed: {error!r}', file=sys.stderr)
+                continue
+            broadcast.extend(game_broadcast)
+            completion.extend(game_completion)
+            lag.extend(lags(bots, watchers))
+            served += sum(watcher.game_result is not None for watcher in watchers)
+    return broadcast, completion, lag, served, time.monotonic() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='TypeSpeed spectator benchmark')
+    parser.add_argument('--port', type=int, default=7072)
+    parser.add_argument('--mode', choices=('thread', 'asyncio'), default='thread')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--games', type=int, default=20)
+    parser.add_argument('--players', type=int, default=4, help='players of every game')
+    parser.add_argument('--spectators', type=int, default=200,
+                        help='spectators of every game')
+    parser.add_argument('--concurrency', type=int, default=5,
+                        help='games played at the same time')
+    parser.add_argument('--options', default='rounds=3', help='options of the games')
+    parser.add_argument('--log', help='file to write the log of the server to')
+    args = parser.parse_args()
+
+    address = ('127.0.0.1', args.port)
+    process = start_server(args.port, args.mode, args.workers, args.log)
+    try:
+        runs = [(count, run_games(address, args, count)) for count in (0, args.spectators)]
+    finally:
+        stop_server(process)
+
+    print(f'server: {args.mode}, {args.workers} worker(s)')
+    for count, (broadcast, completion, lag, served, elapsed) in runs:
+        print(f'{count} spectators per game, {args.games} games of {args.players} players '
+              f'in {elapsed:.2f}s')
+        for name, values in (('broadcast latency', broadcast), ('round completion', completion),
+                             ('spectator lag', lag)):
+            if values:
+                print(f'  {name}: p50 {percentile(values, 50) * 1000:.2f}ms, '
+                      f'p99 {percentile(values, 99) * 1000:.2f}ms')
+        if count:
+            print(f'  spectators who saw the whole game: {served}/{count * args.games}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+This module accepts the connections of the threaded server and waits
+for their handshakes without blocking.
+
+A connection goes through three stages:
+1. It is accepted, unless its address has connected too often lately.
+2. Its handshake byte is waited for along with every other handshake,
+   until a deadline. Anything that is not a protocol version is closed
+   right away.
+3. It is handed to the menu on a thread of its own.
+A slow or malicious connection therefore never holds up the others, and
+the listener only wakes up when there is something to do.
+"""
+
+import time
+import heapq
+import socket
+import itertools
+import logging
+import selectors
+from typing import Callable
+from dependencies.modules.communicator import set_version, PROTOCOL_VERSIONS, ENCODING  # noqa
+from dependencies.modules import metrics  # noqa
+
+# Seconds a connection has to send its handshake
+HANDSHAKE_TIMEOUT: float = 10
+# Connections the kernel queues before they are accepted
+BACKLOG: int = 128
+# Connections per second an address can make, and how many it can make
+# at once after having been idle
+RATE: float = 10
+BURST: int = 20
+# Addresses kept by the rate limiter before the idle ones are forgotten
+MAX_ADDRESSES: int = 10000
+
+
+class RateLimiter:
+    """
+    It limits the connections of every address with a token bucket.
+    A limiter with a rate of 0 allows every connection.
+    """
+
+    rate: float
+    burst: int
+    # tokens of every address and the time they were last counted
+    buckets: dict[str, list[float]]
+
+    def __init__(self, rate: float = RATE, burst: int = BURST):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+
+    def allow(self, address: str) -> bool:
+        """Takes a token of an address if it has one."""
+        if not self.rate:
+            return True
+        now = time.monotonic()
+        bucket = self.buckets.get(address)
+        if bucket is None:
+            if len(self.buckets) >= MAX_ADDRESSES:
+                self._forget(now)
+            bucket = self.buckets[address] = [self.burst, now]
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+    def _forget(self, now: float) -> None:
+        # Addresses whose bucket has filled up again are the same as new
+        # ones.
+        for address, (tokens, last) in list(self.buckets.items()):
+            if tokens + (now - last) * self.rate >= self.burst:
+                del self.buckets[address]
+
+
+class Acceptor:
+    """It runs the accept and handshake stages on a single selector."""
+
+    server: socket.socket
+    # called with the socket and the address of every client that has
+    # completed its handshake
+    on_client: Callable[[socket.socket, tuple[str, int]], None]
+    limiter: RateLimiter
+    timeout: float
+
+    def __init__(self, server: socket.socket,
+                 on_client: Callable[[socket.socket, tuple[str, int]], None],
+                 limiter: RateLimiter | None = None, timeout: float = HANDSHAKE_TIMEOUT):
+        self.server = server
+        self.on_client = on_client
+        self.limiter = limiter or RateLimiter()
+        self.timeout = timeout
+        self._selector = selectors.DefaultSelector()
+        # deadlines of the handshakes, in the order they were accepted
+        self._deadlines: list[tuple[float, int, socket.socket]] = []
+        self._counter = itertools.count()
+
+    def run(self) -> None:
+        """Accepts connections until the server is closed."""
+        self.server.setblocking(False)
+        self._selector.register(self.server, selectors.EVENT_READ)
+        while True:
+            timeout = (max(0, self._deadlines[0][0] - time.monotonic())
+                       if self._deadlines else None)
+            for key, _ in self._selector.select(timeout):
+                if key.fileobj is self.server:
+                    self._accept()
+                else:
+                    self._handshake(key.fileobj, key.data)
+            self._expire()
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                connection, address = self.server.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as error:
+                # Out of file descriptors and the like, the connections
+                # are accepted again on the next wake up.
+                logging.warning('main: Accept failed(%s)', error)
+                return
+            metrics.accepts.inc()
+            if not self.limiter.allow(address[0]):
+                metrics.rate_limited.inc()
+                connection.close()
+                continue
+            connection.setblocking(False)
+            self._selector.register(connection, selectors.EVENT_READ, address)
+            heapq.heappush(self._deadlines, (time.monotonic() + self.timeout,
+                                             next(self._counter), connection))
+
+    def _handshake(self, connection: socket.socket, address: tuple[str, int]) -> None:
+        self._selector.unregister(connection)
+        try:
+            # The client sends the protocol version it wants to use,
+            # anything else is not a client.
+            version = connection.recv(1).decode(ENCODING)
+            if version not in PROTOCOL_VERSIONS:
+                raise ConnectionResetError
+            connection.setblocking(True)
+            if version != '1':
+                # Clients of version 1 do not expect an acknowledgement.
+                connection.send(version.encode(ENCODING))
+        except (UnicodeDecodeError, OSError):
+            metrics.handshakes.inc(version='rejected')
+            connection.close()
+            return
+        metrics.handshakes.inc(version=version)
+        set_version(connection, version)
+        logging.info('main: Connection accepted(%s, v%s)', address, version)
+        self.on_client(connection, address)
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, _, connection = heapq.heappop(self._deadlines)
+            try:
+                self._selector.unregister(connection)
+            # The connection has completed its handshake already.
+            except (KeyError, ValueError):
+                continue
+            metrics.handshakes.inc(version='rejected')
+            connection.close()
@@ -0,0 +1,417 @@
+# -*- coding: utf-8 -*-
+"""
+Each game of the asyncio server is handled by a separate instance of
+the AsyncGame class.
+
+It follows the same flow as Game but all the clients of all the games
+share a single event loop instead of a thread each. The event loop is
+the only owner of the state of the games, so it needs no lock: a check
+and the change that depends on it are made without awaiting in between,
+so that no other client can be handled in the middle.
+"""
+
+import time
+import asyncio
+import logging
+import contextlib
+from dependencies.modules.communicator import async_receive, frame, get_version, ENCODING  # noqa
+from dependencies.modules.schema import (encode_round_result, encode_game_result,  # noqa
+                                         encode_session, encode_resume)
+from dependencies.modules.audience import async_broadcaster  # noqa
+from dependencies.modules.runner import AsyncGameRunner  # noqa
+from dependencies.modules.keystrokes import is_keystrokes, is_ready  # noqa
+from dependencies.modules.ranking import leaderboards  # noqa
+from dependencies.modules.base_game import BaseGame, progress_interval  # noqa
+from dependencies.modules import heartbeat, metrics  # noqa
+
+# Maximum number of bytes waiting to be sent to a client
+MAX_BUFFER: int = 65536
+
+
+class AsyncGame(BaseGame):
+    """
+    It represents a game of TypSpeed on the asyncio server.
+    Clients are identified by their stream writer, the matching
+    reader is kept in readers.
+    """
+
+    host: asyncio.StreamWriter
+    clients: list[asyncio.StreamWriter]
+    readers: dict[asyncio.StreamWriter, asyncio.StreamReader]
+    # the messages received from every player with the time.monotonic_ns()
+    # they were received at, None once disconnected
+    inboxes: dict[asyncio.StreamWriter, asyncio.Queue]
+
+    # The event loop is the only owner of the state of the game.
+    lock = contextlib.nullcontext()
+    broadcaster = async_broadcaster
+    # what plays the games once they start, the task that starts a game
+    # plays it if there is none
+    runner: AsyncGameRunner | None = None
+
+    def __init__(self, reader: asyncio.StreamReader, host: asyncio.StreamWriter,
+                 username: str, player_count: int, game_id: str,
+                 options: dict[str, str] | None = None):
+        super().__init__(host, username, player_count, game_id, options)
+        self.readers = {host: reader}
+        self.inboxes = {host: asyncio.Queue()}
+        self._loop = asyncio.get_running_loop()
+        # the tasks receiving the times of the round and the players
+        # they are for, and an event set when one is added or a player
+        # can start typing
+        self._collectors: dict[asyncio.Task, asyncio.StreamWriter] = {}
+        self._changed = asyncio.Event()
+
+    async def start(self, announce: bool = True) -> None:
+        """
+        Tells the host the id of the game and starts checking if the
+        clients are active.
+        :param announce: Whether to tell the host the id, a host matched
+            by the matchmaker has been told already.
+        """
+        if announce:
+            await self._send(self.game_id, self.host)
+            # Tell that only one player is currently in the game
+            await self._send('1', self.host)
+        await self._open_session(self.host)
+
+        asyncio.create_task(self.check_clients_active())
+        asyncio.create_task(self.read_messages(self.host))
+
+        logging.info('game(%s): Game activated(%s, %s, %s, %s)',
+                     self.game_id, self.host.get_extra_info('peername'),
+                     self.players[self.host], self.player_count, self.options)
+        await self.check_start()
+
+    def expire(self) -> None:
+        """
+        Closes the game while it is waiting for players.
+        It can be called from any thread, the players are removed once
+        their connections are closed.
+        """
+        def _expire():
+            for client in self.clients:
+                client.close()
+
+        self._loop.call_soon_threadsafe(_expire)
+
+    async def add_player(self, reader: asyncio.StreamReader, client: asyncio.StreamWriter,
+                         username: str, acknowledge: bool = False) -> str:
+        """
+        Adds a player to the game if it can still take them.
+        The player takes their place before anything is awaited, so two
+        players can neither take the same username nor the last place
+        of the game.
+        :param reader: The stream to receive from the player.
+        :param client: The stream to send to the player.
+        :param username: The username of the player.
+        :param acknowledge: Whether to send '1' to the player before
+            the number of players, if they are added.
+        :return: '1' if the player has been added, '0' if the username
+            is taken and '2' if the game has started or is full, the
+            player is left to the caller if not added. Clients of
+            version 1 can only join games of the classic rules.
+        """
+        if (not self.active or self.game_started or len(self.clients) >= self.player_count or
+                (get_version(client) == '1' and not self.rules.classic)):
+            return '2'
+        if username in self.usernames:
+            return '0'
+        self.players[client] = username
+        self.usernames.add(username)
+        self.clients.append(client)
+        self.readers[client] = reader
+        self.inboxes[client] = asyncio.Queue()
+        asyncio.create_task(self.read_messages(client))
+
+        if acknowledge:
+            await self._send('1', client)
+        await self._send(str(self.player_count), client)
+        await self._open_session(client)
+        await self._broadcast(str(len(self.clients)))
+
+        logging.info('game(%s): Player added(%s, %s)',
+                     self.game_id, client.get_extra_info('peername'), username)
+        await self.check_start()
+        return '1'
+
+    async def remove_player(self, client: asyncio.StreamWriter) -> None:
+        """
+        Removes a player from the game.
+        If the game has already started, the player's score is also
+        removed from the game result, unless the player can reconnect,
+        in which case it is only removed if they have not within
+        RESUME_GRACE.
+        """
+        if client in self.clients:
+            self._remove(client)
+
+        if not self.game_started:
+            if len(self.clients):
+                await self._broadcast(str(len(self.clients)))
+            elif self.active:
+                logging.warning('game(%s): No players left.', self.game_id)
+                self.deactivate()
+
+    async def resume(self, reader: asyncio.StreamReader, client: asyncio.StreamWriter,
+                     token: str) -> bool:
+        """
+        Gives a player who has reconnected their place in the game back.
+        :param reader: The new stream to receive from the player.
+        :param client: The new stream to send to the player.
+        :param token: The token of the player's session.
+        :return: Whether the player has been given their place back,
+            the streams are left to the caller if not.
+        """
+        if not self.active or not self.game_started:
+            return False
+        found = self.sessions.resume(token)
+        if found is None:
+            return False
+        username, previous = found
+        if previous is None:
+            # The player reconnected before the previous connection was
+            # noticed to have dropped.
+            previous = next((connection for connection, name in self.players.items()
+                             if name == username), None)
+            if previous is None:
+                return False
+            self._detach(previous)
+            previous.close()
+        self._take_over(previous, client)
+
+        self.players[client] = username
+        self.clients.append(client)
+        self.readers[client] = reader
+        self.inboxes[client] = asyncio.Queue()
+        asyncio.create_task(self.read_messages(client))
+        await self._send('1', client)
+        await self._send(encode_resume(self.round, self.descriptor if self.collecting else None,
+                                       client in self.time_taken), client, encode=False)
+        if self.collecting and client not in self.time_taken and self._plays(client):
+            self._collectors[asyncio.create_task(self._collect(client))] = client
+            self._changed.set()
+        logging.info('game(%s): Player reconnected(%s, %s)',
+                     self.game_id, client.get_extra_info('peername'), username)
+        return True
+
+    async def main(self) -> None:
+        """
+        The main game loop.
+        It runs for the rounds of the rules, or until a single player is
+        left in sudden death, and then determines the results for each
+        round and the game.
+        """
+
+        try:
+            self.game_started = True
+            # Tell the clients that the game has started
+            await self._broadcast('0')
+
+            for client in self.clients:
+                self.game_result[self.players[client]] = 0
+
+            for _ in range(self.rules.rounds):
+                if not self.next_round():
+                    break
+                round_start = time.perf_counter()
+                # The times start being collected as the sentence is
+                # sent, so a player who reconnects is told the sentence
+                # on resuming.
+                self.collecting = True
+                await self._broadcast_round()
+                self.delivered = time.monotonic_ns()
+
+                await self.collect_times()
+                self.collecting = False
+
+                self.determine_results()
+                await self._broadcast_result(self.round_result, encode_round_result)
+                # The rankings might still be loading from the database.
+                await asyncio.to_thread(leaderboards.update, self.round_result)
+                if self.store:
+                    self.store.record_round(self.game_id, self.sentence_id, self.round_result)
+                metrics.round_duration.observe(time.perf_counter() - round_start)
+
+            await self._broadcast_result(self.rules.standings(self.game_result, self.eliminated),
+                                         encode_game_result)
+        finally:
+            # The game is over even if it failed, so that it is evicted
+            # and its clients are let go.
+            self.deactivate()
+            # Close the connections once the clients have got the
+            # result.
+            for client in self.clients:
+                client.close()
+
+    async def check_start(self) -> None:
+        """
+        Checks if the game can start and then starts the game if
+        possible.
+        """
+        if self.game_started or len(self.clients) != self.player_count:
+            return
+        self.game_started = True
+        if self.runner:
+            self.runner.submit(self)
+        else:
+            await self.main()
+
+    async def check_clients_active(self) -> None:
+        """Checks if the clients are still connected to the game."""
+        while True:
+            # The pings of the games are jittered to spread them out.
+            await asyncio.sleep(heartbeat.delay())
+            if not self.active or self.game_started:
+                break
+            for client in list(self.clients):
+                client_rtt = heartbeat.rtt(client.get_extra_info('socket'))
+                if client_rtt is not None:
+                    self.rtt[client] = client_rtt
+            await self._broadcast('-1')
+
+    async def read_messages(self, client: asyncio.StreamWriter) -> None:
+        """
+        Receives the messages of a client into its inbox for as long
+        as it is connected.
+        """
+        inbox = self.inboxes[client]
+        try:
+            while True:
+                try:
+                    message = await async_receive(self.readers[client])
+                except UnicodeDecodeError:
+                    # A message that is not text is no valid time.
+                    message = ''
+                inbox.put_nowait((message, time.monotonic_ns()))
+        except (ConnectionError, KeyError):
+            inbox.put_nowait(None)
+            # The connections are closed by the game once it is over.
+            if self.active:
+                await self._close(client)
+
+    async def collect_times(self) -> None:
+        """
+        Receives the time taken from every client.
+        The clients are waited for together, until all of them have
+        sent their time or the round times out, in which case the
+        remaining clients did not finish.
+        """
+        async def _tick(interval: float) -> None:
+            # The changes since the last tick are sent together.
+            while True:
+                await asyncio.sleep(interval)
+                if self.progress_changed:
+                    await self._broadcast_progress()
+
+        # The players who have been eliminated watch the round.
+        self._collectors = {asyncio.create_task(self._collect(client)): client
+                            for client in self.clients if self._plays(client)}
+        self.progress_changed = False
+        ticker = asyncio.create_task(_tick(progress_interval(len(self._collectors))))
+        # The players who reconnect during the round add a task and the
+        # ones who can start typing move the deadline, either wakes the
+        # wait up.
+        while (((pending := [task for task in self._collectors if not task.done()]) or
+                self._awaiting_suspended()) and
+               (timeout := self.deadline([self._collectors[task] for task in pending])
+                - time.monotonic()) > 0):
+            self._changed.clear()
+            changed = asyncio.create_task(self._changed.wait())
+            await asyncio.wait([*pending, changed], timeout=timeout,
+                               return_when=asyncio.FIRST_COMPLETED)
+            changed.cancel()
+        ticker.cancel()
+        for task, client in self._collectors.items():
+            if task.done():
+                continue
+            task.cancel()
+            if client in self.clients:
+                logging.info('game(%s): Time not received(%s)', self.game_id, self.players[client])
+                self.late.add(client)
+                self.time_taken[client] = 0
+        self._collectors = {}
+
+    async def _collect(self, client: asyncio.StreamWriter) -> None:
+        # Receives the time of a client, following its keystrokes.
+        inbox = self.inboxes[client]
+        while (item := await inbox.get()) is not None:
+            if is_keystrokes(item[0]):
+                # Keystrokes of a round that is over are skipped.
+                if client not in self.late:
+                    self.record_keystrokes(client, item[0])
+            elif is_ready(item[0]):
+                self.record_ready(client, *item)
+                self._changed.set()
+            elif client in self.late:
+                self.late.discard(client)
+            else:
+                self.record_time(client, *item)
+                return
+
+    async def _broadcast(self, message: str | bytes, encode=True) -> None:
+        # The same frame is written to every client of a version.
+        if encode:
+            message = message.encode(ENCODING)
+        with metrics.fanout_duration.time():
+            for client, message_frame in self._framed(lambda _version: message):
+                await self._write(message_frame, client)
+
+    async def _broadcast_result(self, result: dict, encoder) -> None:
+        with metrics.fanout_duration.time():
+            for client, message_frame in self._framed(self._result_message(result, encoder),
+                                                      spectators=True):
+                await self._write(message_frame, client)
+
+    async def _broadcast_round(self) -> None:
+        with metrics.fanout_duration.time():
+            for client, message_frame in self._framed(self._round_message, spectators=True):
+                await self._write(message_frame, client)
+
+    async def _broadcast_progress(self) -> None:
+        with metrics.fanout_duration.time():
+            message_frame = self._progress_frame()
+            for client in list(self.clients):
+                if get_version(client) != '1':
+                    await self._write(message_frame, client)
+        self.broadcaster.publish(self.audience, message_frame)
+
+    async def _send(self, message: str | bytes, connection: asyncio.StreamWriter,
+                    encode=True) -> None:
+        if encode:
+            message = message.encode(ENCODING)
+        await self._write(frame(message, get_version(connection)), connection)
+
+    async def _write(self, message_frame: bytes, connection: asyncio.StreamWriter) -> None:
+        # The transport buffers whatever the socket cannot take, a
+        # client that lets too much pile up is disconnected instead of
+        # being waited for.
+        if (connection.is_closing() or connection.transport.get_write_buffer_size()
+                + len(message_frame) > MAX_BUFFER):
+            await self._close(connection)
+            return
+        metrics.bytes_sent.inc(len(message_frame))
+        connection.write(message_frame)
+
+    async def _open_session(self, client: asyncio.StreamWriter) -> None:
+        # Clients of version 1 cannot reconnect.
+        if get_version(client) != '1':
+            await self._send(encode_session(self.sessions.issue(self.game_id,
+                                                                self.players[client])),
+                             client, encode=False)
+
+    def _detach(self, client: asyncio.StreamWriter) -> str:
+        del self.inboxes[client]
+        return super()._detach(client)
+
+    async def _close(self, connection: asyncio.StreamWriter) -> None:
+        await self.remove_player(connection)
+        logging.info('game(%s): Connection closed(%s)', self.game_id, connection)
+        connection.close()
+
+    def _call_later(self, delay: float, callback, *args) -> None:
+        self._loop.call_later(delay, callback, *args)
+
+    @staticmethod
+    def _address(connection: asyncio.StreamWriter) -> tuple:
+        return connection.get_extra_info('peername')
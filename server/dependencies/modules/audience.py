@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+This module sends the messages of the games to their spectators.
+
+Spectators only receive: the descriptors of the rounds, the progress of
+the players and the results. A game hands every message to the
+broadcast tier once, framed for version 2, and the tier writes that one
+frame to every spectator of the game, on its own thread or in a later
+callback of the event loop. A game's players are never held up by its
+spectators, however many there are, and a spectator that falls behind
+is disconnected like a player that does.
+"""
+
+import queue
+import asyncio
+import logging
+import threading
+from dependencies.modules.fanout import fanout  # noqa
+from dependencies.modules import metrics  # noqa
+
+# Spectators of a game at most
+MAX_SPECTATORS: int = 1000
+# Maximum number of bytes waiting to be sent to a spectator on the
+# asyncio server
+MAX_BUFFER: int = 65536
+
+
+class Audience:
+    """
+    It holds the spectators of a game.
+    The spectators are kept in a tuple that is replaced on every change,
+    so the tier can go through it without a lock while spectators come
+    and go. A spectator is admitted first, which takes its place, and
+    added by the tier once it has been told where the game is, so that
+    it gets no frame from before that.
+    """
+
+    max_spectators: int
+    # the connections of the spectators
+    spectators: tuple
+    # whether the game is over, no spectator can be admitted then
+    closed: bool
+
+    def __init__(self, max_spectators: int = MAX_SPECTATORS):
+        self.max_spectators = max_spectators
+        self.spectators = ()
+        self.closed = False
+        # the places taken, by the spectators and the ones admitted
+        self._places = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._places
+
+    def admit(self) -> bool:
+        """
+        Takes the place of a spectator.
+        :return: Whether there was one, False if the audience is full
+            or the game is over.
+        """
+        with self._lock:
+            if self.closed or self._places >= self.max_spectators:
+                return False
+            self._places += 1
+            return True
+
+    def add(self, connection) -> None:
+        """Adds a spectator that has been admitted."""
+        with self._lock:
+            if not self.closed:
+                self.spectators = (*self.spectators, connection)
+
+    def discard(self, connection) -> None:
+        """Removes a spectator, freeing its place."""
+        with self._lock:
+            if self.closed:
+                return
+            self._places -= 1
+            self.spectators = tuple(spectator for spectator in self.spectators
+                                    if spectator is not connection)
+
+    def close(self) -> tuple:
+        """
+        Closes the audience to new spectators.
+        :return: The spectators, who are removed.
+        """
+        with self._lock:
+            spectators, self.spectators = self.spectators, ()
+            self._places = 0
+            self.closed = True
+            return spectators
+
+
+class BroadcastTier:
+    """
+    It sends the frames of the games to their spectators through the
+    fan-out on a single thread, which is started when first needed.
+    """
+
+    def __init__(self):
+        # the audiences and what to do with them: a frame to send, a
+        # spectator to add or None to close them
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def attach(self, audience: Audience, connection, greeting: list[bytes]) -> bool:
+        """
+        Adds a spectator to an audience.
+        It should be called in order with the frames published to the
+        audience, like them under the lock of the game.
+        :param audience: The audience of the game.
+        :param connection: The socket of the spectator.
+        :param greeting: The frames to send the spectator first, the
+            ones published afterward follow them.
+        :return: Whether it was added, the socket is left to the caller
+            if not.
+        """
+        if not audience.admit():
+            return False
+        fanout.register(connection, lambda _connection: self._drop(audience, _connection))
+        for message_frame in greeting:
+            fanout.send(message_frame, connection)
+        self._put(audience, connection)
+        return True
+
+    def publish(self, audience: Audience, message_frame: bytes) -> None:
+        """Queues a frame for every spectator of an audience."""
+        if len(audience):
+            self._put(audience, message_frame)
+
+    def close(self, audience: Audience) -> None:
+        """
+        Closes the connections of the spectators of an audience once
+        the frames queued for them have been sent.
+        """
+        if len(audience):
+            self._put(audience, None)
+
+    def _put(self, audience: Audience, item) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._queue.put((audience, item))
+
+    def _run(self) -> None:
+        while True:
+            audience, item = self._queue.get()
+            if item is None:
+                for spectator in audience.close():
+                    fanout.close(spectator)
+            elif isinstance(item, bytes):
+                with metrics.spectator_fanout_duration.time():
+                    for spectator in audience.spectators:
+                        fanout.send(item, spectator)
+            # The spectator may have been dropped while it was greeted.
+            elif item in fanout.outboxes:
+                audience.add(item)
+
+    @staticmethod
+    def _drop(audience: Audience, connection) -> None:
+        # The spectator fell behind or its connection was broken.
+        audience.discard(connection)
+        logging.info('audience: Spectator dropped(%s)', connection)
+        connection.close()
+
+
+class AsyncBroadcastTier:
+    """
+    It writes the frames of the games to their spectators on the event
+    loop, in a callback scheduled after the game has written to its
+    players.
+    It should only be used from the event loop.
+    """
+
+    def attach(self, audience: Audience, connection: asyncio.StreamWriter,
+               greeting: list[bytes]) -> bool:
+        """
+        Adds a spectator to an audience.
+        :param audience: The audience of the game.
+        :param connection: The stream to send to the spectator.
+        :param greeting: The frames to send the spectator first, the
+            ones published afterward follow them.
+        :return: Whether it was added, the stream is left to the caller
+            if not.
+        """
+        if not audience.admit():
+            return False
+        for message_frame in greeting:
+            metrics.bytes_sent.inc(len(message_frame))
+            connection.write(message_frame)
+        # The frames already scheduled are written before it is added.
+        asyncio.get_running_loop().call_soon(audience.add, connection)
+        return True
+
+    def publish(self, audience: Audience, message_frame: bytes) -> None:
+        """Schedules a frame to be written to every spectator of an audience."""
+        if len(audience):
+            asyncio.get_running_loop().call_soon(self._write, audience, message_frame)
+
+    def close(self, audience: Audience) -> None:
+        """
+        Closes the connections of the spectators of an audience once
+        the frames scheduled for them have been written.
+        """
+        if len(audience):
+            asyncio.get_running_loop().call_soon(self._close, audience)
+
+    @staticmethod
+    def _write(audience: Audience, message_frame: bytes) -> None:
+        with metrics.spectator_fanout_duration.time():
+            for spectator in audience.spectators:
+                # A spectator that lets too much pile up is disconnected.
+                if (spectator.is_closing() or spectator.transport.get_write_buffer_size()
+                        + len(message_frame) > MAX_BUFFER):
+                    audience.discard(spectator)
+                    spectator.close()
+                    continue
+                metrics.bytes_sent.inc(len(message_frame))
+                spectator.write(message_frame)
+
+    @staticmethod
+    def _close(audience: Audience) -> None:
+        for spectator in audience.close():
+            spectator.close()
+
+
+# The broadcast tiers shared by every game of the server
+broadcaster: BroadcastTier = BroadcastTier()
+async_broadcaster: AsyncBroadcastTier = AsyncBroadcastTier()
@@ -0,0 +1,550 @@
+# -*- coding: utf-8 -*-
+"""
+The state and the rules of a game, shared by the servers.
+
+BaseGame keeps who plays a game, its rounds and its results, whatever
+serves it. Game and AsyncGame only add how the clients are read from
+and written to: on threads under the lock of the game, or on the event
+loop that owns it.
+"""
+
+import abc
+import math
+import time
+import pickle
+import logging
+from typing import Any, Callable, Iterator
+from contextlib import AbstractContextManager
+from dependencies.modules.communicator import frame, get_version, ENCODING  # noqa
+from dependencies.modules.schema import encode_round_start, encode_progress  # noqa
+from dependencies.modules.session import Sessions, RESUME_GRACE  # noqa
+from dependencies.modules.audience import Audience, BroadcastTier, AsyncBroadcastTier  # noqa
+from dependencies.modules.store import ResultStore  # noqa
+from dependencies.modules.keystrokes import KeystrokeValidator, decode_ready  # noqa
+from dependencies.modules.rounds import Rules, create_rules  # noqa
+from dependencies.modules.sentence_generator import Deck  # noqa
+from dependencies.modules.sentence_generator.features import select  # noqa
+
+# Seconds the client shows the sentence for before the player can type
+COUNTDOWN: float = 8
+# Seconds the client can keep showing the start of the game or the
+# result of the previous round for before it shows the sentence
+DISPLAY_DELAY: float = 10
+# Seconds to wait for the times of the clients beyond the time they have
+# to type, for slow connections
+ROUND_MARGIN: float = 2
+# Seconds a reported time can be below the time measured by the server
+TIMING_TOLERANCE: float = 0.25
+# Seconds between the progress updates of a game of two players, larger
+# games are updated less often so that the bytes sent stay bounded.
+PROGRESS_TICK: float = 0.1
+
+
+def sort_dict(dictionary: dict, reverse: bool = False) -> dict:
+    """
+    Sorts a dictionary by its values.
+    :param dictionary: The dictionary to sort.
+    :param reverse: Whether to sort in reverse order.
+    :return: The sorted dictionary.
+    """
+    return {k: v for k, v in sorted(dictionary.items(), key=lambda item: item[1], reverse=reverse)}
+
+
+def parse_options(message: str) -> tuple[int, dict[str, str]]:
+    """
+    Parses the message a host sends to create a game: the number of
+    players optionally followed by options like difficulty=hard.
+    Options that are not like that are ignored.
+    :param message: The message.
+    :return: The number of players and the options.
+    :raises ValueError: If the number of players is missing or invalid.
+    """
+    player_count, *options = message.split()
+    return int(player_count), dict(option.split('=', 1) for option in options if '=' in option)
+
+
+def create_deck(options: dict[str, str]) -> Deck:
+    """
+    Creates the deck of a game from the options of the host.
+    Options that are not understood are ignored, so that a host can
+    always create a game.
+    :param options: The options, difficulty is one of DIFFICULTIES and
+        length is the range of lengths like 20-60.
+    :return: The deck.
+    """
+    try:
+        length = options.get('length')
+        if length:
+            low, high = length.split('-')
+            length = int(low), int(high)
+        return select(options.get('difficulty'), length or None)
+    except ValueError:
+        return Deck()
+
+
+def reconcile_time(reported: float, measured: float, exact: bool) -> float:
+    """
+    Checks the time a client reports against the time the server
+    measured.
+    :param reported: The time taken reported by the client.
+    :param measured: The seconds the server measured.
+    :param exact: Whether the time was measured from when the client
+        told that the player could start typing, the reported time is
+        then kept no more than TIMING_TOLERANCE below it. Otherwise the
+        player may have started up to DISPLAY_DELAY after the countdown,
+        so the measured time is the most the player can have taken and
+        DISPLAY_DELAY less is the least.
+    :return: The time taken, 0 if it was sent before the player could
+        have typed the sentence or is less than the player can have
+        taken.
+    """
+    if exact:
+        # A client telling it late only makes the measured time shorter,
+        # so it is never taken below the reported time.
+        return max(reported, measured - TIMING_TOLERANCE)
+    if measured <= 0 or reported < measured - DISPLAY_DELAY - TIMING_TOLERANCE:
+        return 0
+    return min(reported, measured)
+
+
+def round_timeout(rules: Rules, ready: bool) -> float:
+    """
+    Returns the seconds to wait for the time of a client.
+    :param rules: The rules of the game.
+    :param ready: Whether the client has told that its player can start
+        typing, the seconds are from then instead of from sending the
+        sentence of the round.
+    """
+    if ready:
+        return rules.time_limit + ROUND_MARGIN
+    return DISPLAY_DELAY + COUNTDOWN + rules.time_limit + ROUND_MARGIN
+
+
+def progress_interval(players: int) -> float:
+    """
+    Returns the seconds between the progress updates of a game.
+    Every update goes to every player and lists every player, so the
+    interval grows with the number of players to keep the bytes sent per
+    second growing linearly instead of quadratically.
+    """
+    return PROGRESS_TICK * max(1, players / 2)
+
+
+class BaseGame(abc.ABC):
+    """
+    It represents a game of TypSpeed, apart from its connections.
+    A client is identified by its connection, a socket or a stream
+    depending on the server. Every method expects the state of the game
+    to be held by the caller, the ones that are called on their own
+    take the lock.
+    """
+
+    host: Any
+    player_count: int
+    game_id: str
+    # dictionary of player's connection and their username
+    players: dict[Any, str]
+    # the usernames of the players, including the ones who can reconnect
+    usernames: set[str]
+    clients: list
+    readers: dict
+    # held while the state of the game is changed
+    lock: AbstractContextManager
+
+    active: bool
+    game_started: bool
+    # time.monotonic() when the game was created
+    created: float
+    # the sentences of the game and the index of the current one
+    deck: Deck
+    # the options the host created the game with
+    options: dict[str, str] | None
+    rules: Rules
+    # the sentence of the round, -1 for the text of a timed round
+    sentence_id: int | None
+    sentence: str | None
+    # the round being played, from 1, 0 before the game starts
+    round: int
+    # the descriptor of the round sent to the clients
+    descriptor: dict | None
+    # the players who play the round and the round every player who
+    # has been eliminated was eliminated in
+    playing: set[str]
+    eliminated: dict[str, int]
+    # whether the times of the round are being received
+    collecting: bool
+    # dictionary of player's connection and their time taken
+    time_taken: dict[Any, float]
+    # players whose time for the last round arrived too late, it is
+    # skipped when it does arrive
+    late: set
+    # time.monotonic_ns() when the sentence of the round was sent
+    delivered: int
+    # time.monotonic_ns() when it was sent again to the players who
+    # reconnected during the round
+    resent: dict[Any, int]
+    # time.monotonic_ns() when every client told that its player could
+    # start typing the round
+    started: dict[Any, int]
+    # the keystrokes of every player in the round
+    keystrokes: dict[Any, KeystrokeValidator]
+    # whether the progress has changed since it was last sent
+    progress_changed: bool
+    # dictionary of player's connection and their round trip time in
+    # seconds measured while waiting for the game to start
+    rtt: dict[Any, float]
+
+    round_result: dict[str, tuple[float, int]]
+    game_result: dict[str, int]
+    # the tokens of the players, to reconnect with
+    sessions: Sessions
+    # the spectators, who are sent the rounds, the progress and the
+    # results by the broadcast tier
+    audience: Audience
+
+    # whether the times are checked against the times measured by the
+    # server instead of being trusted
+    authoritative_timing: bool = False
+    # where the results of the rounds are kept, if anywhere
+    store: ResultStore | None = None
+    # what sends the messages of the games to their spectators
+    broadcaster: BroadcastTier | AsyncBroadcastTier
+
+    def __init__(self, host, username: str, player_count: int, game_id: str,
+                 options: dict[str, str] | None = None):
+        self.host = host
+        self.player_count = player_count
+        self.game_id = game_id
+        self.players = {host: username}
+        self.usernames = {username}
+        self.clients = [self.host]
+
+        self.active = True
+        self.game_started = False
+        self.created = time.monotonic()
+        self.deck = create_deck(options or {})
+        # Clients of version 1 only know the rules of a classic game.
+        self.rules = create_rules(options or {}) if get_version(host) != '1' else Rules()
+        self.sentence_id = None
+        self.sentence = None
+        self.round = 0
+        self.descriptor = None
+        self.playing = set()
+        self.eliminated = {}
+        self.collecting = False
+        self.time_taken = {}
+        self.late = set()
+        self.delivered = 0
+        self.started = {}
+        self.resent = {}
+        self.keystrokes = {}
+        self.progress_changed = False
+        self.rtt = {}
+        self.round_result = {}
+        self.game_result = {}
+        self.sessions = Sessions()
+        self.audience = Audience()
+        self.options = options
+
+    def deactivate(self) -> None:
+        """Deactivates the game."""
+        self.active = False
+        # The spectators are let go once they have got the last result.
+        self.broadcaster.close(self.audience)
+        logging.info('game(%s): Game deactivated.', self.game_id)
+
+    def add_spectator(self, client) -> str:
+        """
+        Adds a spectator to the game, who is sent the round in progress
+        and from then on the rounds, the progress and the results.
+        :param client: The connection of the spectator.
+        :return: '1' if the spectator has been added and '2' if the game
+            is over or has too many spectators, or the client is of
+            version 1, the connection is left to the caller if not added.
+        """
+        with self.lock:
+            if not self.active or get_version(client) == '1':
+                return '2'
+            greeting = [frame(b'1', '2')]
+            if self.collecting:
+                greeting.append(frame(encode_round_start(self.descriptor), '2'))
+            if not self.broadcaster.attach(self.audience, client, greeting):
+                return '2'
+            logging.info('game(%s): Spectator added(%s)', self.game_id, self._address(client))
+        return '1'
+
+    def next_round(self) -> bool:
+        """
+        Draws the sentence of the next round and starts following the
+        keystrokes of the players who play it.
+        :return: Whether there is a round to play, there is none once a
+            single player is left in sudden death.
+        """
+        self.playing = {username for username in self.game_result
+                        if username not in self.eliminated}
+        if self.rules.mode == 'sudden' and len(self.playing) <= 1:
+            return False
+        self.round += 1
+        self.time_taken.clear()
+        self.round_result.clear()
+        self.started.clear()
+        self.resent.clear()
+
+        self.sentence_id, self.sentence = self.rules.draw(self.deck)
+        self.descriptor = self.rules.describe(self.round, self.sentence, sorted(self.playing))
+        # The players who might reconnect during the round are followed
+        # too, their next connection takes over. Clients of version 1
+        # cannot stream their keystrokes, their reports are trusted.
+        self.keystrokes = {client: KeystrokeValidator(self.sentence)
+                           for client in [*self.clients, *self._suspended()]
+                           if self._plays(client) and get_version(client) != '1'}
+        return True
+
+    def record_time(self, client, time_taken: str, received: int | None = None) -> None:
+        """
+        Records the time taken by a client.
+        :param client: The connection of the client.
+        :param time_taken: The time as sent by the client, or the number
+            of characters typed correctly in a timed round.
+        :param received: time.monotonic_ns() when the time was received.
+        """
+        try:
+            reported = float(time_taken)
+        except ValueError:
+            reported = 0
+        # Infinities and NaN are no time, the player did not finish.
+        if not math.isfinite(reported):
+            reported = 0
+        reported = self.rules.check(reported, self.keystrokes.get(client))
+        # Incorrect sentences and cheats are sent as 0 and -1. A timed
+        # round takes everyone the same time, there is none to check.
+        # The time of a player who reconnected during the round is not
+        # measured, unless they started typing after reconnecting, as
+        # how long they were disconnected for is not known.
+        exact = self._ready(client)
+        if (self.authoritative_timing and received is not None and reported > 0 and
+                self.rules.mode != 'timed' and (exact or client not in self.resent)):
+            if exact:
+                # The ready message and the time both take half a round
+                # trip, so it cancels out.
+                measured = (received - self.started[client]) / 1e9
+            else:
+                # The client may have shown the sentence long after it
+                # was sent, which is not known.
+                measured = ((received - self.delivered) / 1e9 - self.rtt.get(client, 0) -
+                            COUNTDOWN)
+            checked = reconcile_time(reported, measured, exact)
+            if abs(checked - reported) > TIMING_TOLERANCE:
+                logging.info('game(%s): Time corrected(%s, %.3f, %.3f)',
+                             self.game_id, self.players[client], reported, checked)
+            reported = checked
+        self.time_taken[client] = reported
+        self.progress_changed = True
+
+    def record_ready(self, client, message: str, received: int) -> None:
+        """
+        Records when a client told that its player could start typing.
+        A player who reconnects during the round tells it again, and the
+        round is measured from the last time.
+        The countdown cannot have ended before it was shown, and the
+        client shows it at most DISPLAY_DELAY after it got the sentence,
+        so an earlier message is taken as received then and a later one
+        is ignored.
+        :param client: The connection of the client.
+        :param message: The message, of the round being played or else
+            it is skipped.
+        :param received: time.monotonic_ns() when it was received.
+        """
+        try:
+            if decode_ready(message) != self.round:
+                return
+        except ValueError:
+            return
+        sent, rtt = self._sent(client), self.rtt.get(client, 0)
+        if received > sent + (DISPLAY_DELAY + COUNTDOWN + rtt + TIMING_TOLERANCE) * 1e9:
+            logging.info('game(%s): Ready ignored(%s)', self.game_id, self.players.get(client))
+            return
+        self.started[client] = max(received, sent + int((COUNTDOWN - rtt) * 1e9))
+
+    def deadline(self, waiting) -> float:
+        """
+        Returns the time.monotonic() until which the times of the round
+        are waited for.
+        A client is waited for from when its player could start typing,
+        or from when the sentence was sent until it says so.
+        :param waiting: The connections of the clients whose time is
+            waited for, the players who might reconnect are waited for
+            too.
+        """
+        suspended = [connection for username, (connection, _) in self.sessions.suspended.items()
+                     if connection not in self.time_taken and username in self.playing]
+        return max(((self.started[connection] if self._ready(connection) else
+                     self._sent(connection)) / 1e9 +
+                    round_timeout(self.rules, self._ready(connection))
+                    for connection in [*waiting, *suspended]), default=0)
+
+    def record_keystrokes(self, client, message: str) -> None:
+        """Follows a batch of keystrokes of a client."""
+        try:
+            self.keystrokes[client].feed(message)
+        except (KeyError, ValueError):
+            return
+        self.progress_changed = True
+
+    def progress(self) -> dict[str, float]:
+        """
+        Returns how much of the sentence every player of the round has
+        typed, a player who has sent a correct sentence has typed all
+        of it.
+        """
+        return {self.players[client]: self.rules.progress(self.sentence,
+                                                          self.time_taken.get(client, 0),
+                                                          self.keystrokes.get(client))
+                for client in self.clients if self._plays(client)}
+
+    def determine_results(self) -> None:
+        """
+        Determines the results of the round, and who is eliminated by
+        them in sudden death.
+        """
+        # The most characters come first in a timed round, the least
+        # time in any other.
+        self.time_taken = sort_dict(self.time_taken, reverse=self.rules.mode == 'timed')
+        # The players who sent their time before disconnecting are in
+        # the result too.
+        usernames = {connection: username
+                     for username, (connection, _) in self.sessions.suspended.items()}
+        usernames.update(self.players)
+        for client in self.time_taken:
+            try:
+                time_taken, wpm = self.rules.score(self.sentence, self.time_taken[client],
+                                                   self.keystrokes.get(client))
+                self.round_result[usernames[client]] = (time_taken, wpm)
+                self.game_result[usernames[client]] += wpm
+            except KeyError:
+                pass
+        for username in self.rules.eliminate(self.round_result):
+            self.eliminated[username] = self.round
+            logging.info('game(%s): Player eliminated(%s)', self.game_id, username)
+
+    def _framed(self, encode: Callable[[str], bytes],
+                spectators: bool = False) -> Iterator[tuple[Any, bytes]]:
+        # Yields every client with the frame to send them. The message
+        # is encoded and framed once for each protocol version, and the
+        # version 2 frame is handed to the broadcast tier once every
+        # client has been yielded, if the spectators get it.
+        frames = {}
+        for client in list(self.clients):
+            version = get_version(client)
+            if version not in frames:
+                frames[version] = frame(encode(version), version)
+            yield client, frames[version]
+        if spectators and self.audience:
+            self.broadcaster.publish(self.audience, frames.get('2') or frame(encode('2'), '2'))
+
+    def _round_message(self, version: str) -> bytes:
+        # Clients of version 1 are sent the sentence, they play by the
+        # classic rules.
+        if version == '1':
+            return self.sentence.encode(ENCODING)
+        return encode_round_start(self.descriptor)
+
+    @staticmethod
+    def _result_message(result: dict, encoder: Callable[[dict], bytes]) -> Callable[[str], bytes]:
+        # Clients of version 1 can only decode pickles.
+        return lambda version: pickle.dumps(result) if version == '1' else encoder(result)
+
+    def _progress_frame(self) -> bytes:
+        # The progress is encoded once for the whole game. Clients of
+        # version 1 do not expect it during a round.
+        self.progress_changed = False
+        return frame(encode_progress(self.progress()), '2')
+
+    def _remove(self, client) -> None:
+        # Removes a player who has left. Once the game has started, the
+        # player can reconnect for a while and their score is kept until
+        # then.
+        username = self._detach(client)
+        if self.game_started and self.active and get_version(client) != '1':
+            since = self.sessions.suspend(username, client)
+            self._call_later(RESUME_GRACE, self._expire_session, username, since)
+            logging.warning('game(%s): Player disconnected(%s)', self.game_id, username)
+        else:
+            self.usernames.discard(username)
+            self.keystrokes.pop(client, None)
+            self.started.pop(client, None)
+            self.resent.pop(client, None)
+            self.game_result.pop(username, None)
+            logging.warning('game(%s): Player removed(%s)', self.game_id, username)
+
+    def _take_over(self, previous, client) -> None:
+        # The time a player sent before dropping still counts, and the
+        # keystrokes they typed are still checked against it.
+        for state in (self.time_taken, self.keystrokes, self.started, self.resent):
+            if previous in state:
+                state[client] = state.pop(previous)
+        # A player who has not sent their time is sent the round again.
+        if self.collecting and client not in self.time_taken:
+            self.resent[client] = time.monotonic_ns()
+        # A player who has not sent their time yet sends every keystroke
+        # of the round again, as some may have been lost with the
+        # connection.
+        if client in self.keystrokes and client not in self.time_taken:
+            self.keystrokes[client] = KeystrokeValidator(self.sentence)
+
+    def _ready(self, client) -> bool:
+        # Whether a client told that its player could start typing since
+        # it was last sent the round.
+        return self.started.get(client, 0) > self.resent.get(client, 0)
+
+    def _sent(self, client) -> int:
+        # When the sentence of the round was sent to a client.
+        return self.resent.get(client, self.delivered)
+
+    def _detach(self, client) -> str:
+        # Forgets the connection of a player, but not their score or the
+        # keystrokes of the round, which their next connection takes over.
+        self.clients.remove(client)
+        self.rtt.pop(client, None)
+        self.late.discard(client)
+        del self.readers[client]
+        return self.players.pop(client)
+
+    def _expire_session(self, username: str, since: float) -> None:
+        with self.lock:
+            if self.sessions.expire(username, since) and self.active:
+                self.usernames.discard(username)
+                self.game_result.pop(username, None)
+                logging.warning('game(%s): Player removed(%s)', self.game_id, username)
+
+    def _suspended(self) -> list:
+        # The connections of the players who might still reconnect.
+        return [connection for connection, _ in self.sessions.suspended.values()]
+
+    def _plays(self, connection) -> bool:
+        # Whether the player of a connection, which may have dropped,
+        # plays the round.
+        username = self.players.get(connection)
+        if username is None:
+            username = next((name for name, (suspended, _) in self.sessions.suspended.items()
+                             if suspended is connection), None)
+        return username in self.playing
+
+    def _awaiting_suspended(self) -> bool:
+        # Whether a disconnected player might still reconnect and send
+        # their time for the round.
+        with self.lock:
+            return any(connection not in self.time_taken and username in self.playing
+                       for username, (connection, _) in self.sessions.suspended.items())
+
+    @abc.abstractmethod
+    def _call_later(self, delay: float, callback: Callable, *args) -> None:
+        # Calls a callback after a delay, with the state of the game
+        # not held.
+        ...
+
+    @staticmethod
+    @abc.abstractmethod
+    def _address(connection) -> Any:
+        # The address of the client of a connection, for the log.
+        ...
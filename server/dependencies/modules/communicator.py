@@ -2,12 +2,70 @@
 """
 This module contains the functions for sending and receiving messages
 between two sockets.
+
+Two framings are supported, chosen per connection during the handshake:
+1. The length of the message as a 64 byte space padded string.
+2. The length of the message as a four byte unsigned integer.
 """
 
 import socket
+import struct
+import asyncio
+import weakref
+from dependencies.modules.metrics import bytes_sent, bytes_received  # noqa
 
 HEADER: int = 64
 ENCODING: str = 'utf-8'
+# The protocol versions a client can ask for during the handshake
+PROTOCOL_VERSIONS: tuple[str, ...] = ('1', '2')
+FRAME_HEADER: struct.Struct = struct.Struct('!I')
+# Length of a message at most, far above the longest a client sends (a
+# batch of keystrokes or the keystrokes of a whole round)
+MAX_FRAME: int = 1 << 20
+# Bytes received at once at most while a message is read
+CHUNK: int = 65536
+
+# The protocol version of every connection that is not using version 1
+_versions: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def set_version(connection: socket.socket | asyncio.StreamReader | asyncio.StreamWriter,
+                version: str) -> None:
+    """
+    Sets the protocol version negotiated for the given connection.
+    :param connection: The connection.
+    :param version: One of PROTOCOL_VERSIONS.
+    """
+    _versions[connection] = version
+
+
+def get_version(connection: socket.socket | asyncio.StreamReader |
+                asyncio.StreamWriter) -> str:
+    """Returns the protocol version of the given connection."""
+    return _versions.get(connection, '1')
+
+
+def header(length: int, version: str = '1') -> bytes:
+    """
+    Creates the header of a message.
+    :param length: The length of the encoded message.
+    :param version: The protocol version of the connection.
+    :return: The header.
+    """
+    if version == '1':
+        message_length = str(length).encode(ENCODING)
+        return message_length + b' ' * (HEADER - len(message_length))
+    return FRAME_HEADER.pack(length)
+
+
+def frame(message: bytes, version: str = '1') -> bytes:
+    """
+    Frames an encoded message so that it can be written as it is.
+    :param message: The encoded message.
+    :param version: The protocol version of the connection.
+    :return: The header followed by the message.
+    """
+    return header(len(message), version) + message
 
 
 def send(message: str | bytes, connection: socket.socket, encode=True):
@@ -16,42 +74,168 @@ def send(message: str | bytes, connection: socket.socket, encode=True):
     It is important to note that the message is sent in two parts:
     1. The length of the message.
     2. The message itself.
+    Both parts are written with a single system call where possible.
     :param message: The message to send.
     :param connection: Connection to send the message to
     :param encode: Whether to encode the message or not.
     """
-    message_length = len(message)
-    message_length = str(message_length).encode(ENCODING)
-    message_length += b' ' * (HEADER - len(message_length))
-    connection.send(message_length)
     if encode:
         message = message.encode(ENCODING)
-    connection.send(message)
+    _sendall(connection, header(len(message), get_version(connection)), message)
 
 
-def _recv(connection: socket.socket, *args, **kwargs) -> str | bytes:
-    data = connection.recv(*args, **kwargs)
-    if not data:
-        raise ConnectionResetError
-    return data
+def _sendall(connection: socket.socket, message_header: bytes, message: bytes) -> None:
+    bytes_sent.inc(len(message_header) + len(message))
+    if not hasattr(connection, 'sendmsg'):
+        connection.sendall(message_header + message)
+        return
+    sent = connection.sendmsg([message_header, message])
+    if sent < len(message_header) + len(message):
+        connection.sendall(memoryview(message_header + message)[sent:])
+
+
+def _check_length(length: int) -> int:
+    # A longer message is not from a client, the connection is closed
+    # before any of it is received.
+    if length > MAX_FRAME:
+        raise ConnectionResetError(f'Message too long({length})')
+    return length
+
+
+def _recv_into(connection: socket.socket, length: int) -> bytearray:
+    # The buffer grows as the message arrives instead of being allocated
+    # for the length the header claims.
+    buffer = bytearray()
+    while len(buffer) < length:
+        data = connection.recv(min(length - len(buffer), CHUNK))
+        if not data:
+            raise ConnectionResetError
+        buffer += data
+    bytes_received.inc(length)
+    return buffer
 
 
-def receive(connection: socket.socket, decode=True) -> str | bytes:
+def receive(connection: socket.socket, decode=True) -> str | bytearray:
     """
     Receives a message from the given connection.
     :param connection: Connection to receive the message from.
     :param decode: Whether to decode the message or not.
     :return: The message that was received.
+    :raises ConnectionResetError: If the connection is closed or the
+        message is longer than MAX_FRAME.
+    """
+    if get_version(connection) != '1':
+        message_length = _check_length(
+            FRAME_HEADER.unpack(_recv_into(connection, FRAME_HEADER.size))[0])
+        message = _recv_into(connection, message_length)
+        return message.decode(ENCODING) if decode else message
+    while True:
+        try:
+            message_length = _check_length(int(_recv_into(connection, HEADER).decode(ENCODING)))
+            message = _recv_into(connection, message_length)
+            if decode:
+                message = message.decode(ENCODING)
+            return message
+        except ValueError:
+            pass
+
+
+class FrameReader:
+    """
+    It reassembles the messages of a connection from whatever data has
+    been received, so that the connection can be read without blocking.
+    """
+
+    connection: socket.socket
+    version: str
+
+    def __init__(self, connection: socket.socket):
+        self.connection = connection
+        self.version = get_version(connection)
+        self._buffer = bytearray()
+
+    def read(self) -> list[bytearray]:
+        """
+        Receives the data that is available without blocking.
+        :return: The messages that have been received completely.
+        :raises ConnectionResetError: If the connection is closed or a
+            message is longer than MAX_FRAME.
+        """
+        try:
+            data = self.connection.recv(65536, getattr(socket, 'MSG_DONTWAIT', 0))
+        except BlockingIOError:
+            return []
+        if not data:
+            raise ConnectionResetError
+        bytes_received.inc(len(data))
+        self._buffer += data
+
+        messages = []
+        header_size = HEADER if self.version == '1' else FRAME_HEADER.size
+        while len(self._buffer) >= header_size:
+            try:
+                if self.version == '1':
+                    message_length = int(self._buffer[:header_size].decode(ENCODING))
+                else:
+                    message_length = FRAME_HEADER.unpack_from(self._buffer)[0]
+            except ValueError:
+                # Skip invalid headers like receive does.
+                del self._buffer[:header_size]
+                continue
+            _check_length(message_length)
+            if len(self._buffer) < header_size + message_length:
+                break
+            messages.append(self._buffer[header_size:header_size + message_length])
+            del self._buffer[:header_size + message_length]
+        return messages
+
+
+async def async_send(message: str | bytes, writer: asyncio.StreamWriter, encode=True):
+    """
+    Sends a message to the given stream.
+    The message is framed exactly like send so that the clients cannot
+    tell a stream apart from a socket.
+    :param message: The message to send.
+    :param writer: Stream to send the message to.
+    :param encode: Whether to encode the message or not.
     :raises ConnectionResetError: If the connection is closed.
     """
+    if encode:
+        message = message.encode(ENCODING)
+    message_header = header(len(message), get_version(writer))
+    bytes_sent.inc(len(message_header) + len(message))
+    writer.writelines([message_header, message])
+    await writer.drain()
+
+
+async def _async_recv(reader: asyncio.StreamReader, length: int) -> bytes:
+    try:
+        data = await reader.readexactly(length)
+    except asyncio.IncompleteReadError as error:
+        raise ConnectionResetError from error
+    bytes_received.inc(length)
+    return data
+
+
+async def async_receive(reader: asyncio.StreamReader, decode=True) -> str | bytes:
+    """
+    Receives a message from the given stream.
+    :param reader: Stream to receive the message from.
+    :param decode: Whether to decode the message or not.
+    :return: The message that was received.
+    :raises ConnectionResetError: If the connection is closed or the
+        message is longer than MAX_FRAME.
+    """
+    if get_version(reader) != '1':
+        message_length = _check_length(
+            FRAME_HEADER.unpack(await _async_recv(reader, FRAME_HEADER.size))[0])
+        message = await _async_recv(reader, message_length)
+        return message.decode(ENCODING) if decode else message
     while True:
         try:
-            message_length = int(_recv(connection, HEADER).decode(ENCODING))
-            length_received = 0
-            message = b''
-            while length_received < message_length:
-                message += _recv(connection, message_length - length_received)
-                length_received = len(message)
+            message_length = _check_length(
+                int((await _async_recv(reader, HEADER)).decode(ENCODING)))
+            message = await _async_recv(reader, message_length)
             if decode:
                 message = message.decode(ENCODING)
             return message
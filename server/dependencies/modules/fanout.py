@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+This module sends the messages of the games without blocking them on a
+slow client.
+
+Every client has a bounded queue of frames (framed messages). A frame
+is written right away if the queue is empty and the socket can take it
+without blocking, otherwise it is queued and written by a single writer
+thread once the socket becomes writable. A client whose queue overflows
+is disconnected so that it cannot hold up the rest of its game.
+"""
+
+import socket
+import logging
+import selectors
+import threading
+from collections import deque
+from typing import Callable
+from dependencies.modules.metrics import bytes_sent  # noqa
+
+# Maximum number of frames queued for a client
+MAX_FRAMES: int = 64
+# Sends that fail instead of blocking, the sockets themselves stay in
+# blocking mode as they are also received from.
+SEND_FLAGS: int = getattr(socket, 'MSG_DONTWAIT', 0)
+
+
+class Outbox:
+    """It represents the queue of frames of a client."""
+
+    connection: socket.socket
+    fd: int
+    # called with the connection when it has to be closed
+    on_close: Callable[[socket.socket], None]
+    frames: deque[memoryview]
+    lock: threading.Lock
+    # whether the writer thread is waiting for the socket to be writable
+    waiting: bool
+    # whether the connection should be closed once the queue is empty
+    closing: bool
+
+    def __init__(self, connection: socket.socket, on_close: Callable[[socket.socket], None]):
+        self.connection = connection
+        self.fd = connection.fileno()
+        self.on_close = on_close
+        self.frames = deque()
+        self.lock = threading.Lock()
+        self.waiting = False
+        self.closing = False
+
+    def write(self) -> bool:
+        """
+        Writes as many frames as the socket can take without blocking.
+        :return: Whether the queue is empty.
+        :raises OSError: If the connection is broken.
+        """
+        while self.frames:
+            frame = self.frames[0]
+            try:
+                sent = self.connection.send(frame, SEND_FLAGS)
+            except BlockingIOError:
+                return False
+            bytes_sent.inc(sent)
+            if sent < len(frame):
+                self.frames[0] = frame[sent:]
+            else:
+                self.frames.popleft()
+        return True
+
+
+class Fanout:
+    """
+    It holds the outboxes of the clients and the writer thread that
+    flushes them.
+    """
+
+    max_frames: int
+    outboxes: dict[socket.socket, Outbox]
+
+    def __init__(self, max_frames: int = MAX_FRAMES):
+        self.max_frames = max_frames
+        self.outboxes = {}
+        self._selector = selectors.DefaultSelector()
+        # The writer thread is woken up to (un)register outboxes.
+        self._wakeup, self._waker = socket.socketpair()
+        self._wakeup.setblocking(False)
+        self._selector.register(self._wakeup, selectors.EVENT_READ)
+        self._changes: deque[tuple[int, Outbox | None]] = deque()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def register(self, connection: socket.socket,
+                 on_close: Callable[[socket.socket], None]) -> None:
+        """
+        Creates the outbox of a client.
+        :param connection: The socket of the client.
+        :param on_close: Called with the socket if the client has to be
+            disconnected, from whichever thread notices it.
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self.outboxes[connection] = Outbox(connection, on_close)
+
+    def discard(self, connection: socket.socket) -> None:
+        """
+        Drops the outbox of a client along with its queued frames.
+        It should be called before the socket is closed.
+        """
+        outbox = self.outboxes.pop(connection, None)
+        if outbox:
+            with outbox.lock:
+                outbox.frames.clear()
+                if outbox.waiting:
+                    outbox.waiting = False
+                    self._change(outbox.fd, None)
+
+    def close(self, connection: socket.socket) -> None:
+        """Closes the connection of a client once its queue is empty."""
+        outbox = self.outboxes.get(connection)
+        if not outbox:
+            return
+        with outbox.lock:
+            outbox.closing = True
+            if outbox.waiting:
+                return
+        self.discard(connection)
+        connection.close()
+
+    def send(self, frame: bytes, connection: socket.socket) -> None:
+        """
+        Queues a frame for a client.
+        The same frame can be queued for any number of clients.
+        :param frame: The framed message.
+        :param connection: The socket of the client.
+        """
+        outbox = self.outboxes.get(connection)
+        if not outbox:
+            return
+        with outbox.lock:
+            overflow = len(outbox.frames) >= self.max_frames
+            if not overflow:
+                outbox.frames.append(memoryview(frame))
+                if outbox.waiting:
+                    return
+                try:
+                    if outbox.write():
+                        return
+                except OSError:
+                    overflow = True
+                else:
+                    outbox.waiting = True
+                    self._change(outbox.fd, outbox)
+        if overflow:
+            self._drop(outbox)
+
+    def _drop(self, outbox: Outbox) -> None:
+        if self.outboxes.get(outbox.connection) is not outbox:
+            return
+        logging.warning('fanout: Client dropped(%s)', outbox.fd)
+        self.discard(outbox.connection)
+        outbox.on_close(outbox.connection)
+
+    def _change(self, fd: int, outbox: Outbox | None) -> None:
+        # Registers the outbox with the writer thread, or unregisters
+        # the fd if there is no outbox.
+        self._changes.append((fd, outbox))
+        try:
+            self._waker.send(b'\0', SEND_FLAGS)
+        except BlockingIOError:
+            pass
+
+    def _run(self) -> None:
+        while True:
+            for key, _ in self._selector.select():
+                if key.data is None:
+                    try:
+                        self._wakeup.recv(4096)
+                    except BlockingIOError:
+                        pass
+                    continue
+                self._flush(key.data)
+
+            while self._changes:
+                fd, outbox = self._changes.popleft()
+                try:
+                    if outbox:
+                        self._selector.register(fd, selectors.EVENT_WRITE, outbox)
+                    else:
+                        self._selector.unregister(fd)
+                # The socket was closed before it was registered, its
+                # unregistration is still to come.
+                except (KeyError, OSError):
+                    pass
+
+    def _flush(self, outbox: Outbox) -> None:
+        with outbox.lock:
+            if not outbox.waiting:
+                return
+            try:
+                if not outbox.write():
+                    return
+            except OSError:
+                dropped = True
+            else:
+                dropped = False
+                outbox.waiting = False
+                self._selector.unregister(outbox.fd)
+                if not outbox.closing:
+                    return
+        if dropped:
+            self._drop(outbox)
+        else:
+            self.discard(outbox.connection)
+            outbox.connection.close()
+
+
+# The fan-out shared by every game of the server
+fanout: Fanout = Fanout()
@@ -1,227 +1,409 @@
 # -*- coding: utf-8 -*-
 """
 Each game is handled by a separate instance of the Game class.
+
+A game is changed from several threads: the one that plays it, the ones
+of the clients that join or reconnect to it, the heartbeat and the
+fan-out. Every change is made while holding the lock of the game, which
+is never held while waiting for the clients, only while changing the
+state and queueing the messages that go with the change.
 """
 
 import time
-import pickle
 import socket
-import threading
 import logging
-from dependencies.modules.communicator import send, receive  # noqa
-from dependencies.modules.sentence_generator import generate_sentence  # noqa
-
-
-def sort_dict(dictionary: dict, reverse: bool = False) -> dict:
-    """
-    Sorts a dictionary by its values.
-    :param dictionary: The dictionary to sort.
-    :param reverse: Whether to sort in reverse order.
-    :return: The sorted dictionary.
-    """
-    return {k: v for k, v in sorted(dictionary.items(), key=lambda item: item[1], reverse=reverse)}
-
-
-class Game:
+import selectors
+from dependencies.modules.communicator import FrameReader, frame, get_version, ENCODING  # noqa
+from dependencies.modules.fanout import fanout  # noqa
+from dependencies.modules import heartbeat, metrics  # noqa
+from dependencies.modules.locks import TimedLock  # noqa
+from dependencies.modules.schema import (encode_round_result, encode_game_result,  # noqa
+                                         encode_session, encode_resume)
+from dependencies.modules.audience import broadcaster  # noqa
+from dependencies.modules.scheduler import scheduler  # noqa
+from dependencies.modules.runner import GameRunner  # noqa
+from dependencies.modules.keystrokes import is_keystrokes, is_ready  # noqa
+from dependencies.modules.ranking import leaderboards  # noqa
+from dependencies.modules.base_game import BaseGame, progress_interval  # noqa
+
+
+class Game(BaseGame):
     """
     It represents a game of TypSpeed.
-    It handles the game logic and the communication between the clients
-    during the game.
+    It handles the communication between the clients during the game,
+    on the threads of the server.
     """
 
     host: socket.socket
-    player_count: int
-    game_id: str
-    # dictionary of player's socket and their username
-    players: dict[socket.socket, str]
     clients: list[socket.socket]
+    readers: dict[socket.socket, FrameReader]
+    lock: TimedLock
 
-    active: bool
-    game_started: bool
-    sentence: str | None
-    # list of threads for receiving time from clients
-    threads: list[threading.Thread]
-    # dictionary of player's socket and their time taken
-    time_taken: dict[socket.socket, float]
-
-    round_result: dict[str, tuple[float, int]]
-    game_result: dict[str, int]
-
-    def __init__(self, host: socket.socket, username: str, player_count: int, game_id: str):
-        self.host = host
-        self.player_count = player_count
-        self.game_id = game_id
-        self.players = {host: username}
-        self.clients = [self.host]
-
-        self._send(self.game_id, self.host)
-        # Tell that only one player is currently in the game
-        self._send('1', self.host)
-
-        self.active = True
-        self.game_started = False
-        self.sentence = None
-        self.threads = []
-        self.time_taken = {}
-        self.round_result = {}
-        self.game_result = {}
-
-        threading.Thread(target=self.check_clients_active, daemon=True).start()
-
-        logging.info('game(%s): Game activated(%s, %s, %s)',
-                     game_id, host.getpeername(), username, player_count)
-        self.check_start()
+    broadcaster = broadcaster
+    # what plays the games once they start, the thread that starts a
+    # game plays it if there is none
+    runner: GameRunner | None = None
 
-    def deactivate(self) -> None:
-        """Deactivates the game."""
-        self.active = False
-        logging.info('game(%s): Game deactivated.', self.game_id)
+    def __init__(self, host: socket.socket, username: str, player_count: int, game_id: str,
+                 options: dict[str, str] | None = None):
+        super().__init__(host, username, player_count, game_id, options)
+        self.readers = {host: FrameReader(host)}
+        self.lock = TimedLock(metrics.game_lock_wait, metrics.game_lock_held)
 
-    def add_player(self, client: socket.socket, username: str) -> None:
+    def start(self, announce: bool = True) -> None:
         """
-         Adds a player to the game.
-        :param username: The username of the player.
-        :param client: The socket of the player.
-        Note
-            A player should only be added if the game has not yet
-            started, this should be checked before calling this
-            method.
+        Tells the host the id of the game and starts checking if the
+        clients are active.
+        It should be called once the game can be found by its id.
+        :param announce: Whether to tell the host the id, a host matched
+            by the matchmaker has been told already.
         """
-        self.players[client] = username
-        self.clients.append(client)
+        with self.lock:
+            fanout.register(self.host, self._close)
+            if announce:
+                self._send(self.game_id, self.host)
+                # Tell that only one player is currently in the game
+                self._send('1', self.host)
+            self._open_session(self.host)
+            logging.info('game(%s): Game activated(%s, %s, %s, %s)',
+                         self.game_id, self.host.getpeername(), self.players[self.host],
+                         self.player_count, self.options)
+
+        heartbeat.start(self)
+        self.check_start()
 
-        self._send(str(self.player_count), client)
-        self._broadcast(str(len(self.clients)))
+    def expire(self) -> None:
+        """Closes the game while it is waiting for players."""
+        with self.lock:
+            for client in list(self.clients):
+                self._close(client)
 
-        logging.info('game(%s): Player added(%s, %s)',
-                     self.game_id, client.getpeername(), username)
+    def add_player(self, client: socket.socket, username: str,
+                   acknowledge: bool = False) -> str:
+        """
+        Adds a player to the game if it can still take them.
+        The checks and the addition are made under the lock of the game,
+        so two players can neither take the same username nor the last
+        place of the game.
+        :param client: The socket of the player.
+        :param username: The username of the player.
+        :param acknowledge: Whether to send '1' to the player before
+            the number of players, if they are added.
+        :return: '1' if the player has been added, '0' if the username
+            is taken and '2' if the game has started or is full, the
+            player is left to the caller if not added. Clients of
+            version 1 can only join games of the classic rules.
+        """
+        with self.lock:
+            if (not self.active or self.game_started or
+                    len(self.clients) >= self.player_count or
+                    (get_version(client) == '1' and not self.rules.classic)):
+                return '2'
+            if username in self.usernames:
+                return '0'
+            self.players[client] = username
+            self.usernames.add(username)
+            self.clients.append(client)
+            self.readers[client] = FrameReader(client)
+
+            fanout.register(client, self._close)
+            if acknowledge:
+                self._send('1', client)
+            self._send(str(self.player_count), client)
+            self._open_session(client)
+            self._broadcast(str(len(self.clients)))
+
+            logging.info('game(%s): Player added(%s, %s)',
+                         self.game_id, client.getpeername(), username)
         self.check_start()
+        return '1'
 
     def remove_player(self, client: socket.socket) -> None:
         """
         Removes a player from the game.
         If the game has already started, the player's score is also
-        removed from the game result.
-        """
-        if client in self.clients:
-            self.clients.remove(client)
-            if self.players[client] in self.game_result:
-                del self.game_result[self.players[client]]
-            logging.warning('game(%s): Player removed(%s)', self.game_id, self.players[client])
-            del self.players[client]
-
-        # If the game has not started, send the new player count to
-        # the players if there are any.
-        if not self.game_started:
-            if len(self.clients):
-                self._broadcast(str(len(self.clients)))
-            else:
-                logging.warning('game(%s): No players left.', self.game_id)
-                self.deactivate()
+        removed from the game result, unless the player can reconnect,
+        in which case it is only removed if they have not within
+        RESUME_GRACE.
+        """
+        with self.lock:
+            if client in self.clients:
+                self._remove(client)
+
+            # If the game has not started, send the new player count to
+            # the players if there are any.
+            if not self.game_started:
+                if len(self.clients):
+                    self._broadcast(str(len(self.clients)))
+                elif self.active:
+                    logging.warning('game(%s): No players left.', self.game_id)
+                    self.deactivate()
+
+    def resume(self, client: socket.socket, token: str) -> bool:
+        """
+        Gives a player who has reconnected their place in the game back.
+        The player is told where the game is, and can still send their
+        time if the round is in progress.
+        :param client: The new socket of the player.
+        :param token: The token of the player's session.
+        :return: Whether the player has been given their place back,
+            the socket is left to the caller if not.
+        """
+        with self.lock:
+            if not self.active or not self.game_started:
+                return False
+            found = self.sessions.resume(token)
+            if found is None:
+                return False
+            username, previous = found
+            if previous is None:
+                # The player reconnected before the previous connection
+                # was noticed to have dropped.
+                previous = next((connection for connection, name in self.players.items()
+                                 if name == username), None)
+                if previous is None:
+                    return False
+                self._detach(previous)
+                fanout.discard(previous)
+                previous.close()
+            self._take_over(previous, client)
+
+            self.players[client] = username
+            self.clients.append(client)
+            self.readers[client] = FrameReader(client)
+            fanout.register(client, self._close)
+            self._send('1', client)
+            self._send(encode_resume(self.round, self.descriptor if self.collecting else None,
+                                     client in self.time_taken), client, encode=False)
+            logging.info('game(%s): Player reconnected(%s, %s)',
+                         self.game_id, client.getpeername(), username)
+            return True
 
     def main(self) -> None:
         """
         The main game loop.
-        It runs for five rounds and then determines the results for
-        each round and the game.
+        It runs for the rounds of the rules, or until a single player is
+        left in sudden death, and then determines the results for each
+        round and the game.
         """
 
-        self.game_started = True
-        # Tell the clients that the game has started
-        self._broadcast('0')
-
-        # Initialize the game result by setting the score of each
-        # player to 0.
-        for client in self.clients:
-            self.game_result[self.players[client]] = 0
-
-        for _ in range(5):
-            self.threads.clear()
-            self.round_result.clear()
-
-            self.sentence = generate_sentence()
-            self._broadcast(self.sentence)
-
-            # Receive the time taken from each client in a separate
-            # thread.
-            for client in self.clients:
-                thread = threading.Thread(target=self.receive_time, args=(client,), daemon=True)
-                self.threads.append(thread)
-                thread.start()
-            for thread in self.threads:
-                thread.join()
-
-            # Calculate the results for the round and broadcast them
-            # to the clients.
-            self.determine_results()
-            self._broadcast(pickle.dumps(self.round_result), encode=False)
-
-        # Determine the game result and broadcast it to the clients.
-        self._broadcast(pickle.dumps(sort_dict(self.game_result, reverse=True)), encode=False)
-        self.deactivate()
+        try:
+            with self.lock:
+                self.game_started = True
+                # Tell the clients that the game has started
+                self._broadcast('0')
+
+                # Initialize the game result by setting the score of
+                # each player to 0.
+                for client in self.clients:
+                    self.game_result[self.players[client]] = 0
+
+            for _ in range(self.rules.rounds):
+                # The sentence is sent and the times start being
+                # collected at once, so a player who reconnects is
+                # either sent the sentence along with the others or told
+                # it on resuming.
+                with self.lock:
+                    if not self.next_round():
+                        break
+                    round_start = time.perf_counter()
+                    self._broadcast_round()
+                    self.delivered = time.monotonic_ns()
+                    self.collecting = True
+
+                self.collect_times()
+
+                # Calculate the results for the round and broadcast them
+                # to the clients.
+                with self.lock:
+                    self.collecting = False
+                    self.determine_results()
+                    self._broadcast_result(self.round_result, encode_round_result)
+                leaderboards.update(self.round_result)
+                if self.store:
+                    self.store.record_round(self.game_id, self.sentence_id, self.round_result)
+                metrics.round_duration.observe(time.perf_counter() - round_start)
+
+            # Determine the game result and broadcast it to the clients.
+            with self.lock:
+                self._broadcast_result(self.rules.standings(self.game_result, self.eliminated),
+                                       encode_game_result)
+        finally:
+            # The game is over even if it failed, so that it is evicted
+            # and its clients are let go.
+            with self.lock:
+                self.deactivate()
+                # Close the connections once the clients have got the
+                # result.
+                for client in self.clients:
+                    fanout.close(client)
 
     def check_start(self) -> None:
         """
         Checks if the game can start and then starts the game if
         possible.
+        Only the thread that finds the game full starts it, and the game
+        is played by the runner instead of that thread.
         """
-        if len(self.clients) == self.player_count:
+        with self.lock:
+            if self.game_started or len(self.clients) != self.player_count:
+                return
+            self.game_started = True
+        if self.runner:
+            self.runner.submit(self)
+        else:
             self.main()
 
-    def check_clients_active(self) -> None:
-        """Checks if the clients are still connected to the game."""
-        while not self.game_started:
+    def heartbeat(self) -> None:
+        """
+        Checks if the clients are still connected to the game.
+        It is called by the heartbeat scheduler until the game starts.
+        """
+        with self.lock:
+            # The game may have started since the heartbeat checked, a
+            # ping would then be read as the sentence by a client of
+            # version 1.
+            if self.game_started:
+                return
+            for client in list(self.clients):
+                if not heartbeat.is_alive(client):
+                    self._close(client)
+                    continue
+                client_rtt = heartbeat.rtt(client)
+                if client_rtt is not None:
+                    self.rtt[client] = client_rtt
             # Send a ping to the clients to check if they are still
             # connected.
-            time.sleep(1)
-            for client in self.clients:
-                self._send('-1', client)
-
-    def receive_time(self, client: socket.socket) -> None:
-        """Receives the time taken from a client."""
-        time_taken = self._receive(client)
-        if time_taken:
-            self.time_taken[client] = float(time_taken)
-
-    def determine_results(self) -> None:
-        """Determines the results of the game."""
-        self.time_taken = sort_dict(self.time_taken)
-        for client in self.time_taken:
-            try:
-                # If the sentence was incorrect
-                if self.time_taken[client] == 0:
-                    wpm = 0
-                # If the client cheated by copying and pasting the sentence
-                elif self.time_taken[client] == -1:
-                    wpm = -50
-                else:
-                    wpm = round((len(self.sentence) / 5) / (self.time_taken[client] / 60))
-                self.round_result[self.players[client]] = (self.time_taken[client], wpm)
-                self.game_result[self.players[client]] += wpm
-            except KeyError:
-                pass
-
-    def _broadcast(self, *args, **kwargs):
-        for client in self.clients:
-            self._send(*args, **kwargs, connection=client)
-
-    def _send(self, *args, **kwargs):
-        try:
-            send(*args, **kwargs)
-        except ConnectionResetError:
-            try:
-                connection = args[1]
-            except IndexError:
-                connection = kwargs['connection']
-            self._close(connection)
+            self._broadcast('-1')
 
-    def _receive(self, *args, **kwargs):
+    def collect_times(self) -> None:
+        """
+        Receives the time taken from every client.
+        The clients are waited for together, until all of them have
+        sent their time or the round times out, in which case the
+        remaining clients did not finish.
+        """
+        with self.lock:
+            # The players who have been eliminated watch the round.
+            waiting = {client for client in self.clients if self._plays(client)}
+            interval = progress_interval(len(waiting))
+            deadline = self.deadline(waiting)
+            self.progress_changed = False
+        next_tick = time.monotonic() + interval
+        with selectors.DefaultSelector() as selector:
+            for client in waiting:
+                selector.register(client, selectors.EVENT_READ)
+            while ((waiting or self._awaiting_suspended()) and
+                   (timeout := deadline - time.monotonic()) > 0):
+                # The messages are read without the lock and handled
+                # with it.
+                batches = [(key.fileobj, time.monotonic_ns(), self._read(key.fileobj))
+                           for key, _ in selector.select(
+                               min(timeout, max(0, next_tick - time.monotonic())))]
+                with self.lock:
+                    for client, received, messages in batches:
+                        for message in messages:
+                            try:
+                                message = message.decode(ENCODING)
+                            except UnicodeDecodeError:
+                                # A message that is not text is no valid
+                                # time.
+                                message = ''
+                            if is_keystrokes(message):
+                                # Keystrokes of a round that is over are
+                                # skipped.
+                                if client in waiting and client not in self.late:
+                                    self.record_keystrokes(client, message)
+                            elif is_ready(message):
+                                self.record_ready(client, message, received)
+                            elif client in self.late:
+                                self.late.discard(client)
+                            elif client in waiting:
+                                self.record_time(client, message, received)
+                                waiting.discard(client)
+                    # Stop waiting for the clients that have left the
+                    # game or have sent their time.
+                    for key in list(selector.get_map().values()):
+                        if key.fileobj not in waiting or key.fileobj not in self.clients:
+                            waiting.discard(key.fileobj)
+                            selector.unregister(key.fileobj)
+                    # The players who have reconnected during the round
+                    # are waited for too.
+                    for client in self.clients:
+                        if (client not in self.time_taken and client not in selector.get_map()
+                                and self._plays(client)):
+                            waiting.add(client)
+                            selector.register(client, selectors.EVENT_READ)
+                    deadline = self.deadline(waiting)
+                    # The changes since the last tick are sent together.
+                    if time.monotonic() >= next_tick:
+                        if self.progress_changed and waiting:
+                            self._broadcast_progress()
+                        next_tick = time.monotonic() + interval
+
+        with self.lock:
+            for client in waiting.intersection(self.clients):
+                logging.info('game(%s): Time not received(%s)',
+                             self.game_id, self.players[client])
+                self.late.add(client)
+                self.time_taken[client] = 0
+
+    def _broadcast(self, message: str | bytes, encode=True) -> None:
+        # The same frame is queued for every client of a version.
+        if encode:
+            message = message.encode(ENCODING)
+        with metrics.fanout_duration.time():
+            for client, message_frame in self._framed(lambda _version: message):
+                fanout.send(message_frame, client)
+
+    def _broadcast_result(self, result: dict, encoder) -> None:
+        with metrics.fanout_duration.time():
+            for client, message_frame in self._framed(self._result_message(result, encoder),
+                                                      spectators=True):
+                fanout.send(message_frame, client)
+
+    def _broadcast_round(self) -> None:
+        with metrics.fanout_duration.time():
+            for client, message_frame in self._framed(self._round_message, spectators=True):
+                fanout.send(message_frame, client)
+
+    def _broadcast_progress(self) -> None:
+        with metrics.fanout_duration.time():
+            message_frame = self._progress_frame()
+            for client in list(self.clients):
+                if get_version(client) != '1':
+                    fanout.send(message_frame, client)
+        self.broadcaster.publish(self.audience, message_frame)
+
+    def _open_session(self, client: socket.socket) -> None:
+        # Clients of version 1 cannot reconnect.
+        if get_version(client) != '1':
+            self._send(encode_session(self.sessions.issue(self.game_id, self.players[client])),
+                       client, encode=False)
+
+    def _send(self, message: str | bytes, connection: socket.socket, encode=True) -> None:
+        if encode:
+            message = message.encode(ENCODING)
+        fanout.send(frame(message, get_version(connection)), connection)
+
+    def _read(self, connection: socket.socket) -> list[bytearray]:
         try:
-            return receive(*args, **kwargs)
-        except ConnectionResetError:
-            self._close(args[0])
+            return self.readers[connection].read()
+        # The connection may also have been closed by the fan-out.
+        except (OSError, KeyError):
+            self._close(connection)
+            return []
 
     def _close(self, connection: socket.socket) -> None:
-        self.remove_player(connection)
-        logging.info('game(%s): Connection closed(%s)', self.game_id, connection)
-        connection.close()
+        with self.lock:
+            fanout.discard(connection)
+            self.remove_player(connection)
+            logging.info('game(%s): Connection closed(%s)', self.game_id, connection)
+            connection.close()
+
+    def _call_later(self, delay: float, callback, *args) -> None:
+        scheduler.call_later(delay, lambda: callback(*args))
+
+    @staticmethod
+    def _address(connection: socket.socket) -> tuple:
+        return connection.getpeername()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+This module checks that the clients of the games waiting for players
+are still connected.
+
+Every waiting game is pinged about once a second from the scheduler
+thread. The pings are jittered so that the pings of all the games are
+spread out instead of being sent in bursts.
+"""
+
+import socket
+import random
+import struct
+from dependencies.modules.scheduler import scheduler  # noqa
+
+# Seconds between the pings of a game
+INTERVAL: float = 1
+# Maximum seconds a ping is moved by
+JITTER: float = 0.25
+# Offset of the smoothed round trip time in struct tcp_info
+TCP_INFO_RTT: int = 68
+PEEK_FLAGS: int = socket.MSG_PEEK | getattr(socket, 'MSG_DONTWAIT', 0)
+
+
+def delay() -> float:
+    """Returns the seconds until the next ping of a game."""
+    return INTERVAL + random.uniform(-JITTER, JITTER)
+
+
+def start(game) -> None:
+    """
+    Starts pinging the clients of a game until it has started or has
+    been deactivated.
+    :param game: The game, which is pinged with its heartbeat method.
+    """
+    def _beat():
+        if game.active and not game.game_started:
+            game.heartbeat()
+            scheduler.call_later(delay(), _beat)
+
+    scheduler.call_later(delay(), _beat)
+
+
+def is_alive(connection: socket.socket) -> bool:
+    """
+    Checks if a connection has been closed by the client.
+    It should only be used while the client is not expected to send
+    anything.
+    """
+    try:
+        return connection.recv(1, PEEK_FLAGS) != b''
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+
+
+def rtt(connection: socket.socket) -> float | None:
+    """
+    Returns the round trip time of a connection in seconds, as measured
+    by the kernel from the acknowledgements of the pings.
+    :return: The round trip time, None if it is not available.
+    """
+    try:
+        info = connection.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, TCP_INFO_RTT + 4)
+        return struct.unpack_from('I', info, TCP_INFO_RTT)[0] / 1e6
+    except (AttributeError, OSError, struct.error):
+        return None
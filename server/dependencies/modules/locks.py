@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+This module holds the lock that guards the state of a game on the
+threaded server.
+
+A game is changed by the thread that plays it, the threads of the
+clients that join it, the heartbeat and the fan-out, so every change
+is made while holding the lock of the game. The lock is reentrant as
+removing a player can broadcast, and a broadcast can remove a player
+whose queue overflows. How long the lock is waited for and held is
+recorded, from the outermost acquire to the matching release, so that
+contention shows up in the metrics.
+"""
+
+import time
+import threading
+from dependencies.modules.metrics import Histogram  # noqa
+
+
+class TimedLock:
+    """It is a reentrant lock that records how long it is waited for and held."""
+
+    # the histograms the times are recorded into
+    waited: Histogram
+    held: Histogram
+
+    def __init__(self, waited: Histogram, held: Histogram):
+        self.waited = waited
+        self.held = held
+        self._lock = threading.RLock()
+        # how many times the owner has acquired the lock, and when it
+        # first did
+        self._depth = 0
+        self._acquired = 0.0
+
+    def __enter__(self) -> 'TimedLock':
+        start = time.perf_counter()
+        self._lock.acquire()
+        # Only the owner of the lock gets here, so the depth is not
+        # changed by another thread.
+        if not self._depth:
+            self._acquired = time.perf_counter()
+            self.waited.observe(self._acquired - start)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *_) -> None:
+        self._depth -= 1
+        if not self._depth:
+            self.held.observe(time.perf_counter() - self._acquired)
+        self._lock.release()
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+This module puts the players that ask for a quick match in a queue and
+groups them into games.
+
+The players are queued by skill, in buckets of their recent speed, each
+bucket being a heap ordered by the time the player was queued. On every
+tick a bucket with enough players for a full game is made into games,
+and once the player who has waited the longest in a bucket has waited
+for long enough, the bucket is made into a game along with the players
+of the closest buckets. Players with the same username are never put
+in the same game. Queueing and grouping players only takes the
+lock of the queue for as long as it takes to push and pop the heaps,
+the players are told about their game after it has been released.
+"""
+
+import time
+import heapq
+import itertools
+import threading
+from typing import Callable
+from dependencies.modules.metrics import matchmaking_queued  # noqa
+
+# Seconds between the ticks of the matchmaker
+MATCH_INTERVAL: float = 0.5
+# Seconds a player waits before being matched with fewer players or
+# players of other buckets
+MATCH_WAIT: float = 10
+# Players of a game made by the matchmaker
+MIN_PLAYERS: int = 2
+MAX_PLAYERS: int = 10
+# Words per minute of every skill bucket, and of the players without a
+# history
+BUCKET_WIDTH: int = 20
+MAX_BUCKET: int = 7
+DEFAULT_WPM: float = 40
+
+
+def bucket(wpm: float | None) -> int:
+    """Returns the skill bucket of a player's recent speed."""
+    return min(int((DEFAULT_WPM if wpm is None else max(wpm, 0)) // BUCKET_WIDTH), MAX_BUCKET)
+
+
+class Ticket:
+    """It represents a player waiting for a quick match."""
+
+    __slots__ = ('client', 'username', 'bucket', 'queued', 'cancelled')
+
+    # the connection of the player, whatever the server uses for it
+    client: object
+    username: str
+    bucket: int
+    # time.monotonic() when the player was first queued
+    queued: float
+    cancelled: bool
+
+    def __init__(self, client, username: str, _bucket: int):
+        self.client = client
+        self.username = username
+        self.bucket = _bucket
+        self.queued = time.monotonic()
+        self.cancelled = False
+
+
+class Matchmaker:
+    """
+    It holds the queue of every skill bucket.
+    Tickets that are cancelled are left in their heap and skipped when
+    they reach the top, so cancelling does not search the heap.
+    """
+
+    wait: float
+    # tickets of every bucket, as (queued, counter, ticket)
+    buckets: list[list[tuple[float, int, Ticket]]]
+    # tickets that are queued and not cancelled
+    tickets: set[Ticket]
+
+    def __init__(self, wait: float = MATCH_WAIT):
+        self.wait = wait
+        self.buckets = [[] for _ in range(MAX_BUCKET + 1)]
+        self.tickets = set()
+        # tickets that are not cancelled in every bucket
+        self._live = [0] * (MAX_BUCKET + 1)
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        matchmaking_queued.set_function(lambda: len(self.tickets))
+
+    def __len__(self) -> int:
+        return len(self.tickets)
+
+    def enqueue(self, client, username: str, wpm: float | None) -> Ticket:
+        """
+        Queues a player.
+        :param client: The connection of the player.
+        :param username: The username of the player.
+        :param wpm: The recent speed of the player, None if unknown.
+        :return: The ticket of the player.
+        """
+        ticket = Ticket(client, username, bucket(wpm))
+        with self._lock:
+            self._push(ticket)
+        return ticket
+
+    def requeue(self, ticket: Ticket) -> None:
+        """Queues a player again, keeping their place in the queue."""
+        with self._lock:
+            if not ticket.cancelled and ticket not in self.tickets:
+                self._push(ticket)
+
+    def cancel(self, ticket: Ticket) -> None:
+        """Removes a player from the queue."""
+        with self._lock:
+            if ticket in self.tickets:
+                ticket.cancelled = True
+                self.tickets.remove(ticket)
+                self._live[ticket.bucket] -= 1
+
+    def sweep(self, is_alive: Callable[[object], bool]) -> list[Ticket]:
+        """
+        Removes the players whose connection has been closed.
+        :param is_alive: Checks the connection of a player, it is called
+            without holding the lock.
+        :return: The tickets removed.
+        """
+        with self._lock:
+            tickets = list(self.tickets)
+        dead = [ticket for ticket in tickets if not is_alive(ticket.client)]
+        for ticket in dead:
+            self.cancel(ticket)
+        return dead
+
+    def match(self) -> list[list[Ticket]]:
+        """
+        Groups the players that can be matched.
+        :return: The players of every game, the player who has waited
+            the longest first.
+        """
+        now = time.monotonic()
+        groups = []
+        with self._lock:
+            for index, heap in enumerate(self.buckets):
+                while self._live[index] >= MAX_PLAYERS:
+                    group = self._pop(index, MAX_PLAYERS, [])
+                    if len(group) < MAX_PLAYERS:
+                        # The rest of the bucket shares usernames with
+                        # the group, it waits like a smaller bucket.
+                        self._push_all(group)
+                        break
+                    groups.append(group)
+                self._skip_cancelled(heap)
+                if not heap or now - heap[0][0] < self.wait:
+                    continue
+                group = self._pop(index, MAX_PLAYERS, [])
+                # The closest buckets are drawn from, the lower first
+                # on a tie.
+                for distance in range(1, MAX_BUCKET + 1):
+                    for other in (index - distance, index + distance):
+                        if 0 <= other <= MAX_BUCKET:
+                            self._pop(other, MAX_PLAYERS, group)
+                if len(group) >= MIN_PLAYERS:
+                    groups.append(group)
+                else:
+                    self._push_all(group)
+        return groups
+
+    def start(self, scheduler, on_match: Callable[[list[Ticket]], None],
+              is_alive: Callable[[object], bool], close: Callable[[object], None]) -> None:
+        """
+        Matches the players every MATCH_INTERVAL on a scheduler.
+        :param scheduler: The scheduler to run on, with a call_later
+            method like the scheduler of the server or an event loop.
+        :param on_match: Called with the players of every game, it
+            should not block.
+        :param is_alive: Checks the connection of a player without
+            blocking, the players whose connection has been closed are
+            removed on every tick.
+        :param close: Closes the connection of a player removed.
+        """
+        def _tick():
+            for ticket in self.sweep(is_alive):
+                close(ticket.client)
+            for group in self.match():
+                on_match(group)
+            scheduler.call_later(MATCH_INTERVAL, _tick)
+
+        scheduler.call_later(MATCH_INTERVAL, _tick)
+
+    def _push(self, ticket: Ticket) -> None:
+        heapq.heappush(self.buckets[ticket.bucket], (ticket.queued, next(self._counter), ticket))
+        self.tickets.add(ticket)
+        self._live[ticket.bucket] += 1
+
+    def _push_all(self, tickets: list[Ticket]) -> None:
+        for ticket in tickets:
+            self._push(ticket)
+
+    def _skip_cancelled(self, heap: list) -> None:
+        while heap and heap[0][2].cancelled:
+            heapq.heappop(heap)
+
+    def _pop(self, index: int, count: int, group: list[Ticket]) -> list[Ticket]:
+        # Adds the players of a bucket to a group until it has count
+        # players, the players whose username is in the group already
+        # are left in the bucket.
+        heap = self.buckets[index]
+        usernames = {ticket.username for ticket in group}
+        skipped = []
+        while len(group) < count:
+            self._skip_cancelled(heap)
+            if not heap:
+                break
+            ticket = heapq.heappop(heap)[2]
+            self.tickets.remove(ticket)
+            self._live[index] -= 1
+            if ticket.username in usernames:
+                skipped.append(ticket)
+                continue
+            usernames.add(ticket.username)
+            group.append(ticket)
+        self._push_all(skipped)
+        return group
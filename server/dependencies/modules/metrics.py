@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+This module holds the metrics of the server and serves them over HTTP
+in the Prometheus text format, along with a sampling profiler.
+
+The metrics are only served when the server is run with
+--metrics-port, they are always recorded as recording them is cheap.
+The endpoint is bound to localhost:
+    GET /metrics                   the metrics
+    GET /profile?seconds=10        the stacks of every thread, sampled
+                                   for the given seconds and collapsed
+                                   one per line with their count
+"""
+
+import sys
+import time
+import logging
+import threading
+import traceback
+from bisect import bisect_left
+from collections import Counter as _Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from typing import Callable
+
+# Upper bounds of the buckets of the histograms in seconds
+BUCKETS: tuple[float, ...] = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                              0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Upper bounds of the buckets of the histograms of locks, which are held
+# for microseconds
+LOCK_BUCKETS: tuple[float, ...] = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+# Seconds between the samples of the profiler
+PROFILE_INTERVAL: float = 0.005
+MAX_PROFILE_SECONDS: float = 60
+
+# Every metric in the order they are served
+_metrics: list = []
+
+
+def _labels(labels: tuple[tuple[str, str], ...]) -> str:
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}' if labels else ''
+
+
+class Counter:
+    """It represents a value that only goes up, optionally per label."""
+
+    name: str
+    description: str
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._values: dict[tuple[tuple[str, str], ...], float] = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Increases the value of the labels by the amount."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        """Returns the lines of the metric in the text format."""
+        with self._lock:
+            values = list(self._values.items()) or [((), 0)]
+        return [f'{self.name}{_labels(key)} {value}' for key, value in values]
+
+
+class Gauge:
+    """
+    It represents a value that goes up and down. Its value can also be
+    read from a function whenever it is served.
+    """
+
+    name: str
+    description: str
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self.function: Callable[[], float] | None = None
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount: float = 1) -> None:
+        """Increases the value by the amount."""
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        """Decreases the value by the amount."""
+        self.inc(-amount)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Reads the value from the function instead."""
+        self.function = function
+
+    def render(self) -> list[str]:
+        """Returns the lines of the metric in the text format."""
+        return [f'{self.name} {self.function() if self.function else self.value}']
+
+
+class Histogram:
+    """It represents the distribution of durations in seconds."""
+
+    name: str
+    description: str
+    buckets: tuple[float, ...]
+
+    def __init__(self, name: str, description: str, buckets: tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        # the count of every bucket, the last one is for the values
+        # above every bound
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value: float) -> None:
+        """Records a value."""
+        with self._lock:
+            self._counts[bisect_left(self.buckets, value)] += 1
+            self._sum += value
+
+    def time(self) -> 'Timer':
+        """Returns a context manager that records the time it is entered for."""
+        return Timer(self)
+
+    def render(self) -> list[str]:
+        """Returns the lines of the metric in the text format."""
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        lines, cumulative = [], 0
+        for bound, count in zip((*self.buckets, '+Inf'), counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_sum {total}')
+        lines.append(f'{self.name}_count {cumulative}')
+        return lines
+
+
+class Timer:
+    """It records the time spent in a with block into a histogram."""
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self.start = 0
+
+    def __enter__(self) -> 'Timer':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+accepts = Counter('typespeed_accepts_total', 'Connections accepted.')
+handshakes = Counter('typespeed_handshakes_total', 'Handshakes by protocol version or failure.')
+rate_limited = Counter('typespeed_rate_limited_total',
+                       'Connections closed as their address connected too often.')
+games_created = Counter('typespeed_games_created_total', 'Games created.')
+games = Gauge('typespeed_games', 'Games that are active.')
+games_running = Gauge('typespeed_games_running', 'Games being played.')
+games_waiting = Gauge('typespeed_games_waiting', 'Games that have started and wait to be played.')
+games_refused = Counter('typespeed_games_refused_total',
+                        'Games refused as too many were waiting for players or to be played.')
+game_queue_duration = Histogram('typespeed_game_queue_duration_seconds',
+                                'Seconds a game that has started waited to be played.')
+players = Gauge('typespeed_players', 'Players in the active games.')
+spectators = Gauge('typespeed_spectators', 'Spectators of the active games.')
+bytes_sent = Counter('typespeed_bytes_sent_total', 'Bytes sent to the clients.')
+bytes_received = Counter('typespeed_bytes_received_total', 'Bytes received from the clients.')
+round_duration = Histogram('typespeed_round_duration_seconds',
+                           'Seconds from sending the sentence to sending the round result.')
+fanout_duration = Histogram('typespeed_fanout_duration_seconds',
+                            'Seconds taken to queue a broadcast for every client of a game.')
+spectator_fanout_duration = Histogram('typespeed_spectator_fanout_duration_seconds',
+                                      'Seconds taken to send a frame to every spectator '
+                                      'of a game.')
+results_written = Counter('typespeed_results_written_total',
+                          'Round results written to the database.')
+results_dropped = Counter('typespeed_results_dropped_total',
+                          'Round results dropped as the database could not keep up.')
+results_queued = Gauge('typespeed_results_queued',
+                       'Round results waiting to be written to the database.')
+matchmaking_queued = Gauge('typespeed_matchmaking_queued', 'Players waiting for a quick match.')
+commit_duration = Histogram('typespeed_results_commit_duration_seconds',
+                            'Seconds taken to write a batch of round results.')
+game_lock_wait = Histogram('typespeed_game_lock_wait_seconds',
+                           'Seconds waited for the lock of a game.', LOCK_BUCKETS)
+game_lock_held = Histogram('typespeed_game_lock_held_seconds',
+                           'Seconds the lock of a game was held for.', LOCK_BUCKETS)
+
+
+def render() -> str:
+    """Returns every metric in the Prometheus text format."""
+    lines = []
+    for metric in _metrics:
+        kind = type(metric).__name__.lower()
+        lines.append(f'# HELP {metric.name} {metric.description}')
+        lines.append(f'# TYPE {metric.name} {kind}')
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def profile(seconds: float, interval: float = PROFILE_INTERVAL) -> str:
+    """
+    Samples the stacks of every other thread.
+    :param seconds: For how long to sample.
+    :param interval: The seconds between the samples.
+    :return: The stacks from the outermost frame, one per line in the
+        collapsed format of flame graphs followed by their count, the
+        most frequent first.
+    """
+    stacks = _Counter()
+    current = threading.get_ident()
+    deadline = time.monotonic() + min(seconds, MAX_PROFILE_SECONDS)
+    while time.monotonic() < deadline:
+        for thread, frame in sys._current_frames().items():  # noqa
+            if thread != current:
+                stacks[';'.join(f'{entry.name} ({entry.filename}:{entry.lineno})'
+                                for entry in traceback.extract_stack(frame))] += 1
+        time.sleep(interval)
+    return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:  # noqa
+        url = urlsplit(self.path)
+        if url.path == '/metrics':
+            body = render()
+        elif url.path == '/profile':
+            try:
+                body = profile(float(parse_qs(url.query).get('seconds', ['5'])[0]))
+            except ValueError:
+                self.send_error(400)
+                return
+        else:
+            self.send_error(404)
+            return
+        body = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_) -> None:
+        pass
+
+
+def serve(port: int) -> None:
+    """
+    Serves the metrics and the profiler on a thread.
+    :param port: The port to listen on, on localhost only.
+    """
+    http_server = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+    http_server.daemon_threads = True
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    logging.info('metrics: Serving metrics on port %s', port)
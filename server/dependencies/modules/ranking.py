@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+This module ranks the players by their best speed, all time and today,
+in memory.
+
+Every ranking is an indexable skip list: the players are linked in the
+order of their best speed, and every link also holds how many players
+it skips, so both the position of a player and the players at the top
+are found in logarithmic time, and a new best only moves one player
+instead of sorting everyone again. The rankings are updated with the
+result of every round, and are loaded from the database once, when the
+server starts. Shards also follow the rounds the other shards write to
+the database, as every shard only plays its own games.
+"""
+
+import time
+import random
+import datetime
+import threading
+from typing import Iterator
+
+# Levels of the skip lists, enough for 2 ** MAX_LEVEL players
+MAX_LEVEL: int = 24
+# Windows of the leaderboards
+WINDOWS: tuple[str, ...] = ('all', 'today')
+# Players in a leaderboard at most
+MAX_LEADERBOARD: int = 100
+# Seconds between reads of the rounds other processes write
+FOLLOW_INTERVAL: float = 1.0
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key: tuple | None, level: int):
+        self.key = key
+        self.next: list[_Node | None] = [None] * level
+        # the number of positions every link moves forward
+        self.width = [1] * level
+
+
+class SkipList:
+    """It holds unique keys in order, indexed by their position."""
+
+    def __init__(self):
+        self.head = _Node(None, MAX_LEVEL)
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[tuple]:
+        node = self.head.next[0]
+        while node is not None:
+            yield node.key
+            node = node.next[0]
+
+    def _find(self, key: tuple) -> tuple[list[_Node], list[int]]:
+        # The last node before the key at every level and its position.
+        chain = [self.head] * MAX_LEVEL
+        positions = [0] * MAX_LEVEL
+        node, position = self.head, 0
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+            positions[level] = position
+        return chain, positions
+
+    def insert(self, key: tuple) -> None:
+        """Inserts a key that is not in the list."""
+        chain, positions = self._find(key)
+        level = 1
+        while level < MAX_LEVEL and random.random() < 0.5:
+            level += 1
+        node = _Node(key, level)
+        for i in range(level):
+            previous = chain[i]
+            # The positions skipped from the previous node at this level
+            # to the new node.
+            skipped = positions[0] - positions[i]
+            node.next[i] = previous.next[i]
+            previous.next[i] = node
+            node.width[i] = previous.width[i] - skipped
+            previous.width[i] = skipped + 1
+        for i in range(level, MAX_LEVEL):
+            chain[i].width[i] += 1
+        self.size += 1
+
+    def remove(self, key: tuple) -> None:
+        """
+        Removes a key.
+        :raises KeyError: If the key is not in the list.
+        """
+        chain, _ = self._find(key)
+        node = chain[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        for i in range(len(node.next)):
+            chain[i].width[i] += node.width[i] - 1
+            chain[i].next[i] = node.next[i]
+        for i in range(len(node.next), MAX_LEVEL):
+            chain[i].width[i] -= 1
+        self.size -= 1
+
+    def index(self, key: tuple) -> int:
+        """
+        Returns the position of a key, from 0.
+        :raises KeyError: If the key is not in the list.
+        """
+        chain, positions = self._find(key)
+        node = chain[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        return positions[0]
+
+    def first(self, count: int) -> list[tuple]:
+        """Returns the first keys."""
+        keys = []
+        node = self.head.next[0]
+        while node is not None and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+class Ranking:
+    """It ranks players by their best speed, ties by username."""
+
+    # best speed of every player
+    best: dict[str, int]
+    ranks: SkipList
+
+    def __init__(self):
+        self.best = {}
+        self.ranks = SkipList()
+
+    def update(self, username: str, wpm: int) -> None:
+        """Records the speed of a player if it is their best."""
+        best = self.best.get(username)
+        if best is not None:
+            if wpm <= best:
+                return
+            self.ranks.remove((-best, username))
+        self.best[username] = wpm
+        self.ranks.insert((-wpm, username))
+
+    def top(self, count: int) -> list[tuple[str, int]]:
+        """Returns the username and best speed of the fastest players."""
+        return [(username, -wpm) for wpm, username in self.ranks.first(count)]
+
+    def rank(self, username: str) -> tuple[int, int] | None:
+        """
+        Returns the position of a player, from 1, and their best speed,
+        None if the player has no speed.
+        """
+        best = self.best.get(username)
+        if best is None:
+            return None
+        return self.ranks.index((-best, username)) + 1, best
+
+
+class Leaderboards:
+    """
+    It holds the rankings of every window.
+    The database is read once, by load or by whatever uses the
+    rankings first, the results recorded before then are added to what
+    it holds. From then on it is only read by follow, if it runs.
+    """
+
+    # where the rankings are loaded from, if anywhere
+    store: object | None
+    rankings: dict[str, Ranking]
+    # the day the ranking of today is for
+    day: datetime.date
+
+    def __init__(self, store=None):
+        self.store = store
+        self.rankings = {window: Ranking() for window in WINDOWS}
+        self.day = datetime.date.today()
+        self._loaded = False
+        # the id of the last round read from the database
+        self._last = 0
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        """Loads the rankings from the database if they are not yet."""
+        with self._lock:
+            self._refresh()
+
+    def follow(self, interval: float = FOLLOW_INTERVAL) -> None:
+        """
+        Loads the rankings and then ranks the rounds written to the
+        database every interval seconds, forever, so that the rounds of
+        other processes are ranked too.
+        It should run in a separate thread.
+        :param interval: The seconds between reads of the database.
+        """
+        self.load()
+        while True:
+            time.sleep(interval)
+            # The database is read without holding the rankings, the
+            # rounds of this process already ranked do not change them.
+            rounds = self.store.rounds_after(self._last)
+            if not rounds:
+                continue
+            with self._lock:
+                self._refresh()
+                start_of_day = datetime.datetime.combine(self.day, datetime.time()).timestamp()
+                for _, finished, username, time_taken, wpm in rounds:
+                    if time_taken > 0:
+                        self.rankings['all'].update(username, wpm)
+                        if finished >= start_of_day:
+                            self.rankings['today'].update(username, wpm)
+                self._last = rounds[-1][0]
+
+    def update(self, round_result: dict[str, tuple[float, int]]) -> None:
+        """
+        Ranks the players of a round.
+        :param round_result: The time taken and the speed of every
+            player, only the rounds that were finished are ranked.
+        """
+        with self._lock:
+            self._refresh()
+            for username, (time_taken, wpm) in round_result.items():
+                if time_taken > 0:
+                    for ranking in self.rankings.values():
+                        ranking.update(username, wpm)
+
+    def query(self, window: str, count: int = 10,
+              username: str | None = None) -> tuple[list[tuple[str, int]], tuple[int, int] | None]:
+        """
+        Returns a leaderboard.
+        :param window: The window of the leaderboard, one of WINDOWS.
+        :param count: The number of players, at most MAX_LEADERBOARD.
+        :param username: The player to find the position of, if any.
+        :return: The username and best speed of the fastest players,
+            and the position and best speed of the player.
+        :raises KeyError: If the window does not exist.
+        """
+        with self._lock:
+            self._refresh()
+            ranking = self.rankings[window]
+            return (ranking.top(min(count, MAX_LEADERBOARD)),
+                    ranking.rank(username) if username else None)
+
+    def _refresh(self) -> None:
+        if self.day != datetime.date.today():
+            self.day = datetime.date.today()
+            self.rankings['today'] = Ranking()
+        if self._loaded:
+            return
+        self._loaded = True
+        if self.store is None:
+            return
+        # The rounds written while the bests are read are read again by
+        # follow.
+        self._last = self.store.last_round()
+        start_of_day = datetime.datetime.combine(self.day, datetime.time()).timestamp()
+        for window, since in (('all', None), ('today', start_of_day)):
+            for username, wpm in self.store.bests(since):
+                self.rankings[window].update(username, wpm)
+
+
+# The leaderboards of the whole server
+leaderboards: Leaderboards = Leaderboards()
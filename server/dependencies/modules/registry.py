@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+This module keeps the games of the server by their id.
+
+The free ids are kept in a shuffled queue, so an id is created and
+recycled in constant time however many games there are, and a recycled
+id is only reused after every other free id. Games that have been
+deactivated are evicted and their id recycled by a reaper, which also
+closes the lobbies that have been waiting for players for too long.
+"""
+
+import time
+import random
+import logging
+import threading
+from collections import deque
+from typing import Iterable
+from dependencies.modules.scheduler import scheduler  # noqa
+
+# Seconds between the runs of the reaper
+REAP_INTERVAL: float = 5
+# Seconds a game can wait for players before it is closed
+LOBBY_TTL: float = 600
+# Games that can be waiting for players at the same time
+MAX_LOBBIES: int = 1000
+
+
+class Registry:
+    """
+    It holds the games of the server and the ids that are free.
+    A game is any object with game_id, active, game_started and created
+    attributes and an expire method that closes it, which can be called
+    from any thread.
+    """
+
+    games: dict[str, object]
+    # ids that are not used by any game
+    free_ids: deque[str]
+    lobby_ttl: float
+    max_lobbies: int
+
+    def __init__(self, ids: Iterable[int], lobby_ttl: float = LOBBY_TTL,
+                 max_lobbies: int = MAX_LOBBIES):
+        self.games = {}
+        ids = [str(_id) for _id in ids]
+        random.shuffle(ids)
+        self.free_ids = deque(ids)
+        self.lobby_ttl = lobby_ttl
+        self.max_lobbies = max_lobbies
+        # The lobbies as of the last reap plus the games added since, so
+        # that the cap is checked without going through the games.
+        self._lobbies = 0
+        # ids taken for games that have not been added yet
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, game_id: str) -> bool:
+        return game_id in self.games
+
+    def get(self, game_id: str):
+        """Returns the game of an id, None if there is none."""
+        return self.games.get(game_id)
+
+    def __len__(self) -> int:
+        return len(self.games)
+
+    def values(self) -> list:
+        """Returns the games."""
+        return list(self.games.values())
+
+    def create_id(self) -> str | None:
+        """
+        Takes a free id for a new game, which should then be added with
+        add or given back with release.
+        :return: The id, None if there are too many lobbies or no free
+            ids.
+        """
+        with self._lock:
+            if not self.free_ids or self._lobbies + self._pending >= self.max_lobbies:
+                return None
+            self._pending += 1
+            return self.free_ids.popleft()
+
+    def add(self, game) -> None:
+        """Adds a game with an id taken from create_id."""
+        with self._lock:
+            self.games[game.game_id] = game
+            self._pending -= 1
+            self._lobbies += 1
+
+    def release(self, game_id: str) -> None:
+        """Gives back an id taken from create_id for a game not added."""
+        with self._lock:
+            self.free_ids.append(game_id)
+            self._pending -= 1
+
+    def start(self) -> None:
+        """Runs the reaper every REAP_INTERVAL on the scheduler."""
+        def _reap():
+            self.reap()
+            scheduler.call_later(REAP_INTERVAL, _reap)
+
+        scheduler.call_later(REAP_INTERVAL, _reap)
+
+    def reap(self) -> None:
+        """
+        Evicts the games that have been deactivated and expires the
+        lobbies that are older than the TTL.
+        """
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            self._lobbies = 0
+            for game in list(self.games.values()):
+                if not game.active:
+                    del self.games[game.game_id]
+                    self.free_ids.append(game.game_id)
+                elif not game.game_started:
+                    if now - game.created > self.lobby_ttl:
+                        expired.append(game)
+                    else:
+                        self._lobbies += 1
+        # Closing the connections of a lobby does not need the lock.
+        for game in expired:
+            logging.info('registry: Lobby expired(%s)', game.game_id)
+            game.expire()
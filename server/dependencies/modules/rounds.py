@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+This module holds the rules of a game, which the host chooses when
+creating it, and works out the rounds from them.
+
+The host adds options to the number of players like rounds=3 mode=timed,
+options that are not understood are ignored:
+    rounds=N           rounds of the game, from 1 to MAX_ROUNDS
+    mode=classic       every player types the sentence, the fastest wins
+    mode=timed         every player types as much of a long text as they
+                       can within the time limit
+    mode=sudden        like classic, but after every round the slowest
+                       player and the players who did not finish are
+                       eliminated, until one is left
+    time=S             seconds the players have to type, from MIN_TIME
+                       to MAX_TIME
+    scoring=speed      the score of a round is the words per minute
+    scoring=accuracy   the words per minute are weighted by the fraction
+                       of the keystrokes that were correct
+Every round is described to the clients by a round descriptor, so that
+they follow the rules of the game instead of their own.
+"""
+
+from dependencies.modules.keystrokes import KeystrokeValidator  # noqa
+from dependencies.modules.sentence_generator import Deck, sentences  # noqa
+
+MODES: tuple[str, ...] = ('classic', 'timed', 'sudden')
+SCORINGS: tuple[str, ...] = ('speed', 'accuracy')
+DEFAULT_ROUNDS: int = 5
+MAX_ROUNDS: int = 20
+# Seconds the players have to type, by default in a timed round and in
+# any other round
+TYPING_TIME: float = 20
+TIMED_TIME: float = 60
+MIN_TIME: float = 5
+MAX_TIME: float = 120
+# Words per minute the text of a timed round is long enough for
+TIMED_WPM: int = 200
+# Sentences in the text of a timed round at most
+MAX_TIMED_SENTENCES: int = 50
+
+
+def calculate_wpm(sentence: str, time_taken: float) -> int:
+    """
+    Calculates the words per minute of a player for a round.
+    :param sentence: The sentence of the round.
+    :param time_taken: The time taken by the player, 0 if the sentence
+        was incorrect and -1 if the player cheated.
+    :return: The words per minute.
+    """
+    # If the sentence was incorrect
+    if time_taken == 0:
+        return 0
+    # If the client cheated by copying and pasting the sentence
+    if time_taken == -1:
+        return -50
+    return round((len(sentence) / 5) / (time_taken / 60))
+
+
+class Rules:
+    """It represents the rules of a game."""
+
+    __slots__ = ('rounds', 'mode', 'time_limit', 'scoring')
+
+    rounds: int
+    mode: str
+    # seconds the players have to type in a round
+    time_limit: float
+    scoring: str
+
+    def __init__(self, rounds: int = DEFAULT_ROUNDS, mode: str = 'classic',
+                 time_limit: float | None = None, scoring: str = 'speed'):
+        self.rounds = rounds
+        self.mode = mode
+        self.time_limit = time_limit or (TIMED_TIME if mode == 'timed' else TYPING_TIME)
+        self.scoring = scoring
+
+    @property
+    def classic(self) -> bool:
+        """Whether the rules are the ones clients of version 1 play by."""
+        return (self.rounds == DEFAULT_ROUNDS and self.mode == 'classic' and
+                self.time_limit == TYPING_TIME and self.scoring == 'speed')
+
+    def draw(self, deck: Deck) -> tuple[int, str]:
+        """
+        Draws the text of a round.
+        :param deck: The deck of the game.
+        :return: The id of the sentence, -1 for the text of a timed
+            round which is made of several, and the text.
+        """
+        if self.mode != 'timed':
+            sentence_id = deck.draw()
+            return sentence_id, sentences[sentence_id]
+        # The text is long enough for the fastest players not to finish.
+        length = TIMED_WPM * 5 * self.time_limit / 60
+        text = sentences[deck.draw()]
+        for _ in range(MAX_TIMED_SENTENCES - 1):
+            if len(text) >= length:
+                break
+            text += ' ' + sentences[deck.draw()]
+        return -1, text
+
+    def check(self, reported: float, validator: KeystrokeValidator | None) -> float:
+        """
+        Checks what a client reports against its keystrokes.
+        :param reported: The time taken, or in a timed round the number
+            of characters typed correctly, 0 if the sentence was
+            incorrect and -1 if the player cheated.
+        :param validator: The keystrokes of the player, None for a
+            client of version 1, which cannot stream them.
+        :return: What is kept of the report.
+        """
+        if validator is None:
+            return reported
+        if self.mode == 'timed':
+            return validator.check_typed(int(reported))
+        return validator.check(reported)
+
+    def score(self, text: str, reported: float,
+              validator: KeystrokeValidator | None) -> tuple[float, int]:
+        """
+        Works out the result of a player in a round.
+        :param text: The text of the round.
+        :param reported: What was kept of the report of the player.
+        :param validator: The keystrokes of the player, if any.
+        :return: The time taken, 0 if the player did not finish and -1
+            if the player cheated, and the words per minute.
+        """
+        if reported <= 0:
+            return reported, calculate_wpm(text, reported)
+        if self.mode == 'timed':
+            # The characters typed make up the sentence the speed is of.
+            time_taken = self.time_limit
+            wpm = calculate_wpm(text[:int(reported)], self.time_limit)
+        else:
+            time_taken = reported
+            wpm = calculate_wpm(text, reported)
+        if self.scoring == 'accuracy' and validator is not None and validator.keys:
+            wpm = round(wpm * validator.accuracy)
+        return time_taken, wpm
+
+    def progress(self, text: str, reported: float,
+                 validator: KeystrokeValidator | None) -> float:
+        """
+        Works out how much of the text a player has typed.
+        :param text: The text of the round.
+        :param reported: What was kept of the report of the player, 0
+            if they have not sent it.
+        :param validator: The keystrokes of the player, if any.
+        :return: The fraction of the text typed correctly so far.
+        """
+        if reported > 0:
+            return min(reported / (len(text) or 1), 1) if self.mode == 'timed' else 1
+        return validator.progress if validator else 0
+
+    def eliminate(self, round_result: dict[str, tuple[float, int]]) -> list[str]:
+        """
+        Works out who is eliminated after a round of sudden death.
+        :param round_result: The result of the players still in the
+            game.
+        :return: The players who did not finish and the slowest one who
+            did, nobody if nobody finished, as there would be nobody
+            left, or if the game is not sudden death.
+        """
+        if self.mode != 'sudden':
+            return []
+        finished = [username for username, (time_taken, _) in round_result.items()
+                    if time_taken > 0]
+        if not finished:
+            return []
+        eliminated = [username for username in round_result if username not in finished]
+        if len(finished) > 1:
+            eliminated.append(min(finished, key=lambda username: round_result[username][1]))
+        return eliminated
+
+    def standings(self, game_result: dict[str, int],
+                  eliminated: dict[str, int]) -> dict[str, int]:
+        """
+        Orders the players by their score, the players who were
+        eliminated later coming before the ones eliminated earlier.
+        :param game_result: The score of every player.
+        :param eliminated: The round every eliminated player was
+            eliminated in.
+        :return: The score of every player in order.
+        """
+        return dict(sorted(game_result.items(), reverse=True,
+                           key=lambda item: (eliminated.get(item[0], self.rounds + 1),
+                                             item[1])))
+
+    def describe(self, game_round: int, text: str, players: list[str]) -> dict:
+        """
+        Describes a round to the clients.
+        :param game_round: The round, from 1.
+        :param text: The text to type.
+        :param players: The players who play the round, the others
+            have been eliminated.
+        :return: The fields of the round descriptor.
+        """
+        return {'round': game_round, 'rounds': self.rounds, 'mode': self.mode,
+                'time': self.time_limit, 'scoring': self.scoring, 'text': text,
+                'players': players}
+
+
+def create_rules(options: dict[str, str]) -> Rules:
+    """
+    Creates the rules of a game from the options of the host.
+    Options that are not understood are ignored, so that a host can
+    always create a game.
+    :param options: The options, see the module.
+    :return: The rules.
+    """
+    rounds, time_limit = DEFAULT_ROUNDS, None
+    try:
+        rounds = min(max(int(options.get('rounds', rounds)), 1), MAX_ROUNDS)
+    except ValueError:
+        pass
+    try:
+        if 'time' in options:
+            time_limit = min(max(float(options['time']), MIN_TIME), MAX_TIME)
+    except ValueError:
+        pass
+    mode = options.get('mode') if options.get('mode') in MODES else 'classic'
+    scoring = options.get('scoring') if options.get('scoring') in SCORINGS else 'speed'
+    return Rules(rounds, mode, time_limit, scoring)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+This module plays the games that have started on a bounded number of
+threads, or tasks of the event loop, instead of on whichever client
+connection completed them.
+
+At most max_running games are played at once, the games that start
+while all of them are busy wait in a queue, oldest first. New games are
+only admitted while fewer than max_waiting games are waiting, so once
+the server cannot keep up it refuses new games and holds up quick
+matches, like it does when there are too many lobbies, instead of
+starting threads until it runs out of them. Games that are already
+waiting for players are still played once they start.
+"""
+
+import time
+import queue
+import asyncio
+import logging
+import threading
+from dependencies.modules.metrics import (games_running, games_waiting,  # noqa
+                                          game_queue_duration)
+
+# Games played at the same time
+MAX_RUNNING: int = 256
+# Games that have started and wait to be played before new games are
+# refused
+MAX_WAITING: int = 64
+
+
+class Runner:
+    """It counts the games that are played and that wait to be."""
+
+    max_running: int
+    max_waiting: int
+    running: int
+    waiting: int
+
+    def __init__(self, max_running: int = MAX_RUNNING, max_waiting: int = MAX_WAITING):
+        self.max_running = max_running
+        self.max_waiting = max_waiting
+        self.running = 0
+        self.waiting = 0
+        games_running.set_function(lambda: self.running)
+        games_waiting.set_function(lambda: self.waiting)
+
+    def admits(self) -> bool:
+        """Returns whether a new game can be created."""
+        return self.waiting < self.max_waiting
+
+
+class GameRunner(Runner):
+    """
+    It plays the games on a pool of threads, which is grown as the
+    games need up to max_running threads.
+    """
+
+    def __init__(self, max_running: int = MAX_RUNNING, max_waiting: int = MAX_WAITING):
+        super().__init__(max_running, max_waiting)
+        # the games to play and time.monotonic() when they were queued
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._threads = 0
+        self._lock = threading.Lock()
+
+    def submit(self, game) -> None:
+        """
+        Queues a game that has started to be played.
+        :param game: The game, its main method plays it.
+        """
+        with self._lock:
+            self.waiting += 1
+            if self._threads < min(self.max_running, self.running + self.waiting):
+                self._threads += 1
+                threading.Thread(target=self._run, daemon=True).start()
+        self._queue.put((game, time.monotonic()))
+
+    def _run(self) -> None:
+        while True:
+            game, queued = self._queue.get()
+            with self._lock:
+                self.waiting -= 1
+                self.running += 1
+            game_queue_duration.observe(time.monotonic() - queued)
+            try:
+                game.main()
+            except Exception as error:
+                logging.exception(error)
+            finally:
+                with self._lock:
+                    self.running -= 1
+
+
+class AsyncGameRunner(Runner):
+    """
+    It plays the games as tasks of the event loop, at most max_running
+    of them at once.
+    It should only be used from the event loop.
+    """
+
+    def __init__(self, max_running: int = MAX_RUNNING, max_waiting: int = MAX_WAITING):
+        super().__init__(max_running, max_waiting)
+        self._slots = asyncio.Semaphore(max_running)
+        # the tasks of the games, kept until they are done
+        self._tasks: set[asyncio.Task] = set()
+
+    def submit(self, game) -> None:
+        """
+        Queues a game that has started to be played.
+        :param game: The game, its main coroutine plays it.
+        """
+        self.waiting += 1
+        task = asyncio.ensure_future(self._run(game, time.monotonic()))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, game, queued: float) -> None:
+        async with self._slots:
+            self.waiting -= 1
+            self.running += 1
+            game_queue_duration.observe(time.monotonic() - queued)
+            try:
+                await game.main()
+            except Exception as error:
+                logging.exception(error)
+            finally:
+                self.running -= 1
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+This module runs the delayed calls of the whole server on a single
+thread instead of a sleeping thread for each of them.
+The calls are kept in a heap ordered by the time they are due.
+"""
+
+import time
+import heapq
+import logging
+import itertools
+import threading
+from typing import Callable
+
+
+class Scheduler:
+    """It holds the calls that are due in the future."""
+
+    def __init__(self):
+        # heap of the time a call is due, a counter to keep the calls
+        # in order and the call itself
+        self._calls: list[tuple[float, int, Callable[[], None]]] = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread: threading.Thread | None = None
+
+    def call_later(self, delay: float, callback: Callable[[], None]) -> None:
+        """
+        Calls the callback on the scheduler thread after the delay.
+        The callback should not block as it holds up every other call.
+        :param delay: The delay in seconds.
+        :param callback: The function to call.
+        """
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            heapq.heappush(self._calls, (time.monotonic() + delay, next(self._counter), callback))
+            self._condition.notify()
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._calls or self._calls[0][0] > time.monotonic():
+                    self._condition.wait(self._calls[0][0] - time.monotonic()
+                                         if self._calls else None)
+                _, _, callback = heapq.heappop(self._calls)
+            try:
+                callback()
+            except Exception as error:
+                logging.exception(error)
+
+
+# The scheduler shared by the whole server
+scheduler: Scheduler = Scheduler()
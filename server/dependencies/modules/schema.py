@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+This module defines the structured messages sent by the server.
+
+The messages are compact JSON documents which, unlike pickle, are safe
+to decode when received from an untrusted peer. Every document has the
+version of the schema and its type:
+    round: {"v": 1, "type": "round", "results": [[username, time_taken, wpm], ...]}
+    game: {"v": 1, "type": "game", "results": [[username, score], ...]}
+    progress: {"v": 1, "type": "progress", "progress": [[username, percent], ...]}
+    leaderboard: {"v": 1, "type": "leaderboard", "window": window,
+                  "results": [[username, wpm], ...], "rank": [rank, wpm] | null}
+    session: {"v": 1, "type": "session", "token": token}
+    start: {"v": 1, "type": "start", "round": round, "rounds": rounds, "mode": mode,
+            "time": seconds, "scoring": scoring, "text": text, "players": [username, ...]}
+    resume: {"v": 1, "type": "resume", "round": round, "start": {"round": round, ...} | null,
+             "submitted": submitted}
+The results are listed in the order they should be displayed, progress
+is sent during a round with how much of the sentence every player has
+typed, and a leaderboard has the position of the player who asked
+for it, if they have one. A start describes a round, which only the
+players listed play, by the rules it carries. A session is sent to a
+player who joins a game, and a resume to a player who reconnects to it
+with the token of their session, with the fields of the start of the
+round if it is in progress.
+"""
+
+import json
+
+SCHEMA_VERSION: int = 1
+ENCODING: str = 'utf-8'
+
+_encoder: json.JSONEncoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False)
+
+
+def encode(message_type: str, **fields) -> bytes:
+    """
+    Encodes a message.
+    :param message_type: The type of the message.
+    :param fields: The fields of the message.
+    :return: The encoded message.
+    """
+    return _encoder.encode({'v': SCHEMA_VERSION, 'type': message_type, **fields}).encode(ENCODING)
+
+
+def decode(message: str | bytes, message_type: str) -> dict:
+    """
+    Decodes a message.
+    :param message: The encoded message.
+    :param message_type: The type the message is expected to be.
+    :return: The fields of the message.
+    :raises ValueError: If the message is not a valid message of the
+        given type.
+    """
+    document = json.loads(message)
+    if not isinstance(document, dict) or document.get('v') != SCHEMA_VERSION:
+        raise ValueError('Unsupported message version')
+    if document.get('type') != message_type:
+        raise ValueError(f'Expected a {message_type} message')
+    return document
+
+
+def message_type(message: str | bytes) -> str | None:
+    """
+    Returns the type of a message, None if it is not a structured
+    message of this version.
+    """
+    try:
+        document = json.loads(message)
+    except ValueError:
+        return None
+    if not isinstance(document, dict) or document.get('v') != SCHEMA_VERSION:
+        return None
+    return document.get('type')
+
+
+def encode_round_result(round_result: dict[str, tuple[float, int]]) -> bytes:
+    """
+    Encodes the result of a round.
+    :param round_result: The time taken and the wpm of every player.
+    :return: The encoded result.
+    """
+    return encode('round', results=[[username, time_taken, wpm]
+                                     for username, (time_taken, wpm) in round_result.items()])
+
+
+def decode_round_result(message: str | bytes) -> dict[str, tuple[float, int]]:
+    """
+    Decodes the result of a round.
+    :param message: The encoded result.
+    :return: The time taken and the wpm of every player.
+    """
+    return {str(username): (float(time_taken), int(wpm))
+            for username, time_taken, wpm in decode(message, 'round')['results']}
+
+
+def encode_game_result(game_result: dict[str, int]) -> bytes:
+    """
+    Encodes the result of a game.
+    :param game_result: The score of every player.
+    :return: The encoded result.
+    """
+    return encode('game', results=[[username, score] for username, score in game_result.items()])
+
+
+def decode_game_result(message: str | bytes) -> dict[str, int]:
+    """
+    Decodes the result of a game.
+    :param message: The encoded result.
+    :return: The score of every player.
+    """
+    return {str(username): int(score) for username, score in decode(message, 'game')['results']}
+
+
+def encode_progress(progress: dict[str, float]) -> bytes:
+    """
+    Encodes the progress of the players in a round.
+    :param progress: The fraction of the sentence every player has typed.
+    :return: The encoded progress.
+    """
+    return encode('progress', progress=[[username, round(fraction * 100)]
+                                        for username, fraction in progress.items()])
+
+
+def decode_progress(message: str | bytes) -> dict[str, int]:
+    """
+    Decodes the progress of the players in a round.
+    :param message: The encoded progress.
+    :return: The percentage of the sentence every player has typed.
+    """
+    return {str(username): int(percent)
+            for username, percent in decode(message, 'progress')['progress']}
+
+
+def encode_leaderboard(window: str, results: list[tuple[str, int]],
+                       rank: tuple[int, int] | None) -> bytes:
+    """
+    Encodes a leaderboard.
+    :param window: The window of the leaderboard.
+    :param results: The username and best speed of the fastest players.
+    :param rank: The position and best speed of the player who asked
+        for the leaderboard, if any.
+    :return: The encoded leaderboard.
+    """
+    return encode('leaderboard', window=window, results=[list(result) for result in results],
+                  rank=list(rank) if rank else None)
+
+
+def decode_leaderboard(message: str | bytes) -> tuple[list[tuple[str, int]], tuple[int, int] | None]:
+    """
+    Decodes a leaderboard.
+    :param message: The encoded leaderboard.
+    :return: The username and best speed of the fastest players, and
+        the position and best speed of the player who asked for it.
+    """
+    document = decode(message, 'leaderboard')
+    rank = document.get('rank')
+    return ([(str(username), int(wpm)) for username, wpm in document['results']],
+            (int(rank[0]), int(rank[1])) if rank else None)
+
+
+def encode_session(token: str) -> bytes:
+    """Encodes the session token of a player."""
+    return encode('session', token=token)
+
+
+def decode_session(message: str | bytes) -> str:
+    """Decodes the session token of a player."""
+    return str(decode(message, 'session')['token'])
+
+
+def encode_round_start(descriptor: dict) -> bytes:
+    """
+    Encodes the descriptor of a round.
+    :param descriptor: The round and rounds of the game, its mode,
+        seconds to type and scoring, the text to type and the players
+        who play the round.
+    :return: The encoded descriptor.
+    """
+    return encode('start', **descriptor)
+
+
+def _round_start(document: dict) -> dict:
+    return {'round': int(document['round']), 'rounds': int(document['rounds']),
+            'mode': str(document['mode']), 'time': float(document['time']),
+            'scoring': str(document['scoring']), 'text': str(document['text']),
+            'players': [str(username) for username in document['players']]}
+
+
+def decode_round_start(message: str | bytes) -> dict:
+    """
+    Decodes the descriptor of a round.
+    :param message: The encoded descriptor.
+    :return: The fields of the descriptor.
+    """
+    return _round_start(decode(message, 'start'))
+
+
+def encode_resume(game_round: int, descriptor: dict | None, submitted: bool) -> bytes:
+    """
+    Encodes where a game is for a player who has reconnected.
+    :param game_round: The round of the game, from 1, 0 if it has not
+        started.
+    :param descriptor: The descriptor of the round if the times of the
+        players are still being received, None otherwise.
+    :param submitted: Whether the time of the player has been received.
+    :return: The encoded message.
+    """
+    return encode('resume', round=game_round, start=descriptor, submitted=submitted)
+
+
+def decode_resume(message: str | bytes) -> tuple[int, dict | None, bool]:
+    """
+    Decodes where a game is for a player who has reconnected.
+    :param message: The encoded message.
+    :return: The round, the descriptor of the round if it is in
+        progress and whether the time of the player has been received.
+    """
+    document = decode(message, 'resume')
+    start = document.get('start')
+    return (int(document['round']), None if start is None else _round_start(start),
+            bool(document['submitted']))
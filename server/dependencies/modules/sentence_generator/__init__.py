@@ -1,35 +1,172 @@
 # -*- coding: utf-8 -*-
-"""This module generates random sentences for the game."""
+"""
+This module generates random sentences for the game.
+
+The sentences are read from a memory mapped file with one sentence per
+line, and a sentence is only decoded when it is drawn. The offsets of
+the lines are indexed once and cached next to the file, so loading
+even a very large file takes constant time.
+
+Every game draws the sentences from its own Deck, so games never share
+state and a game never gets the same sentence twice until it has drawn
+every sentence.
+"""
 
 import os
+import re
+import mmap
 import random
+import struct
+import logging
+from array import array
+from typing import Sequence
+
+DATA_PATH: str = os.path.join(os.path.dirname(__file__), 'data', 'sentences.txt')
+# Header of the index file: its format, the size and the modification
+# time of the file it indexes.
+INDEX_HEADER: struct.Struct = struct.Struct('<8sQQ')
+INDEX_FORMAT: bytes = b'TSIDX001'
+ENCODING: str = 'utf-8'
+
+
+def write_cache(path: str, parts: Sequence[bytes | array]) -> None:
+    """
+    Writes a cache file whole or not at all: it is written to a file of
+    its own and then moved over the cache, so a crash while writing it
+    leaves the cache as it was.
+    :param path: The path of the cache.
+    :param parts: What to write, in order.
+    :raises OSError: If it could not be written.
+    """
+    temporary = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(temporary, 'wb') as file:
+            for part in parts:
+                file.write(part)
+        os.replace(temporary, path)
+    except OSError:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        raise
+
+
+class Corpus:
+    """
+    It represents the sentences of a file, one sentence per line.
+    Only the offsets of the sentences are kept in memory.
+    """
 
+    path: str
+    # the start of every sentence followed by the end of the file
+    offsets: array | memoryview
 
-def get_sentences(
-        data_path: str = os.path.join(os.path.dirname(__file__), 'data', 'sentences.txt')) -> list:
+    def __init__(self, path: str = DATA_PATH):
+        self.path = path
+        with open(path, 'rb') as file:
+            self._data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offsets = self._load_index() or self._build_index()
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('sentence index out of range')
+        return self._data[self.offsets[index]:self.offsets[index + 1]].decode(ENCODING).strip()
+
+    def _stat(self) -> tuple[int, int]:
+        stat = os.stat(self.path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def _load_index(self) -> memoryview | None:
+        # The cached index is memory mapped as well, so it is not read
+        # until it is used.
+        try:
+            with open(self.path + '.idx', 'rb') as file:
+                index = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        # An index cut short or of another file is built again.
+        if (len(index) < INDEX_HEADER.size + 8 or (len(index) - INDEX_HEADER.size) % 8 or
+                INDEX_HEADER.unpack_from(index) != (INDEX_FORMAT, *self._stat())):
+            return None
+        try:
+            offsets = memoryview(index)[INDEX_HEADER.size:].cast('Q')
+        except (ValueError, TypeError):
+            return None
+        return offsets if offsets[-1] == len(self._data) else None
+
+    def _build_index(self) -> array:
+        # Start of every line that is not blank
+        offsets = array('Q', (match.start() for match in
+                              re.finditer(rb'^[ \t]*[^\s]', self._data, re.MULTILINE)))
+        offsets.append(len(self._data))
+        try:
+            write_cache(self.path + '.idx', [INDEX_HEADER.pack(INDEX_FORMAT, *self._stat()),
+                                             offsets])
+        except OSError as error:
+            logging.warning('sentence_generator: Index not cached(%s)', error)
+        return offsets
+
+
+sentences: Corpus = Corpus()
+
+
+class Deck:
     """
-    Reads the sentences from the file and returns them as a list.
-    :param data_path: The path to the file containing the sentences.
-    :return: The list of sentences.
+    It represents the order in which a game draws the sentences.
+
+    The sentences are shuffled lazily with Fisher-Yates: only the
+    positions that have been swapped are stored, so drawing is O(1)
+    whatever the number of sentences. Once every sentence has been
+    drawn the deck is shuffled again.
     """
-    with open(data_path, encoding='utf-8') as file:
-        return file.readlines()
 
+    # indices of the sentences in the deck, all the sentences if None
+    ids: Sequence[int] | None
+    size: int
+    # position in the deck and the position it holds, if it was swapped
+    _swapped: dict[int, int]
+    _drawn: int
+
+    def __init__(self, ids: Sequence[int] | None = None):
+        self.ids = ids
+        self.size = len(sentences) if ids is None else len(ids)
+        self._swapped = {}
+        self._drawn = 0
 
-sentences: list = get_sentences()
+    def draw(self) -> int:
+        """
+        Draws the next sentence.
+        :return: The index of the sentence.
+        """
+        if self._drawn == self.size:
+            self._swapped.clear()
+            self._drawn = 0
+        position = random.randrange(self._drawn, self.size)
+        # Swap the drawn position with the first position left in the
+        # deck, which is not needed anymore.
+        first = self._swapped.pop(self._drawn, self._drawn)
+        if position == self._drawn:
+            index = first
+        else:
+            index = self._swapped.get(position, position)
+            self._swapped[position] = first
+        self._drawn += 1
+        return index if self.ids is None else self.ids[index]
 
 
-def generate_sentence() -> str:
+def generate_sentence(deck: Deck | None = None) -> str:
     """
     Generates a random sentence for the game.
+    :param deck: The deck to draw the sentence from.
     :return: The generated sentence.
     """
-    global sentences
-    if not sentences:
-        sentences = get_sentences()
-    sentence = random.choice(sentences)
-    sentences.remove(sentence)
-    return sentence.strip()
+    return sentences[(deck or Deck()).draw()]
 
 
 if __name__ == '__main__':
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+This module rates how hard the sentences are to type, so that a game
+can be played with sentences of a given difficulty or length.
+
+The features of every sentence are computed once and cached next to
+the sentences along with the indices of the sentences sorted by length
+and by difficulty, and of the sentences of every difficulty sorted by
+length. A difficulty, a range of lengths or both is then a slice of one
+of the sorted indices, so a deck of matching sentences is created
+without going through the sentences.
+"""
+
+import mmap
+import string
+import logging
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from dependencies.modules.sentence_generator import (Corpus, Deck, sentences,  # noqa
+                                                     INDEX_HEADER, write_cache)
+
+FEATURES_FORMAT: bytes = b'TSFEA002'
+# The difficulties a game can be played with, from the easiest third of
+# the sentences to the hardest third.
+DIFFICULTIES: tuple[str, ...] = ('easy', 'medium', 'hard')
+# Punctuation that is common enough not to be rare
+COMMON_PUNCTUATION: str = ".,'"
+# The rows of a QWERTY keyboard and the finger that types every column,
+# from the left little finger(0) to the right little finger(7).
+ROWS: tuple[str, ...] = ('1234567890-=', 'qwertyuiop[]', "asdfghjkl;'", 'zxcvbnm,./')
+COLUMN_FINGERS: tuple[int, ...] = (0, 1, 2, 3, 3, 4, 4, 5, 6, 7, 7, 7)
+KEYS: dict[str, tuple[int, int]] = {key: (row, COLUMN_FINGERS[column])
+                                    for row, keys in enumerate(ROWS)
+                                    for column, key in enumerate(keys)}
+# The columns of the cache, in order.
+COLUMNS: tuple[tuple[str, str], ...] = (('lengths', 'I'), ('punctuation', 'f'), ('rare', 'I'),
+                                        ('bigrams', 'f'), ('scores', 'f'),
+                                        ('by_length', 'I'), ('by_score', 'I'), ('banded', 'I'))
+
+
+def bigram_difficulty(sentence: str) -> float:
+    """
+    Rates the pairs of consecutive keys of a sentence. Typing two keys
+    with the same finger is the hardest, followed by jumping over a row
+    with the same hand, while alternating hands is the easiest.
+    :param sentence: The sentence.
+    :return: The mean difficulty of the pairs, from 0 to 1.
+    """
+    total = pairs = 0
+    previous = None
+    for character in sentence.lower():
+        key = KEYS.get(character)
+        if key and previous and character != previous[0]:
+            (row, finger), (previous_row, previous_finger) = key, previous[1]
+            if finger == previous_finger:
+                total += 1
+            elif (finger < 4) == (previous_finger < 4) and abs(row - previous_row) > 1:
+                total += 0.5
+            pairs += 1
+        previous = (character, key) if key else None
+    return total / pairs if pairs else 0
+
+
+def rate(sentence: str) -> tuple[int, float, int, float, float]:
+    """
+    Computes the features of a sentence.
+    :param sentence: The sentence.
+    :return: The length, the punctuation density, the number of rare
+        characters, the bigram difficulty and the difficulty score.
+    """
+    length = len(sentence)
+    punctuation = sum(character in string.punctuation for character in sentence) / (length or 1)
+    rare = sum(not (character.isascii() and (character.isalpha() or character == ' ')) and
+               character not in COMMON_PUNCTUATION for character in sentence)
+    bigrams = bigram_difficulty(sentence)
+    score = length / 40 + punctuation * 10 + rare * 0.5 + bigrams * 4
+    return length, punctuation, rare, bigrams, score
+
+
+class Features:
+    """It holds the features of the sentences of a corpus."""
+
+    corpus: Corpus
+    lengths: array | memoryview
+    punctuation: array | memoryview
+    rare: array | memoryview
+    bigrams: array | memoryview
+    scores: array | memoryview
+    # indices of the sentences sorted by length and by score
+    by_length: array | memoryview
+    by_score: array | memoryview
+    # indices of the sentences of every difficulty sorted by length, the
+    # difficulties in the order of by_score
+    banded: array | memoryview
+
+    def __init__(self, corpus: Corpus = sentences):
+        self.corpus = corpus
+        self.path = corpus.path + '.features'
+        if not self._load():
+            self._build()
+
+    def band(self, difficulty: str) -> memoryview:
+        """
+        Returns the indices of the sentences of a difficulty.
+        :param difficulty: One of DIFFICULTIES.
+        :raises ValueError: If the difficulty does not exist.
+        """
+        return memoryview(self.by_score)[slice(*self._bounds(difficulty))]
+
+    def length_range(self, low: int, high: int, difficulty: str | None = None) -> memoryview:
+        """
+        Returns the indices of the sentences from low to high characters
+        long, both included.
+        :param difficulty: One of DIFFICULTIES, any difficulty if None.
+        :raises ValueError: If the difficulty does not exist.
+        """
+        ids, (start, end) = self.by_length, (0, len(self.by_length))
+        if difficulty is not None:
+            ids, (start, end) = self.banded, self._bounds(difficulty)
+        start = bisect_left(ids, low, start, end, key=self.lengths.__getitem__)
+        end = bisect_right(ids, high, start, end, key=self.lengths.__getitem__)
+        return memoryview(ids)[start:end]
+
+    def _bounds(self, difficulty: str) -> tuple[int, int]:
+        # Where the sentences of a difficulty are in by_score and banded.
+        band = DIFFICULTIES.index(difficulty)
+        size = len(self.by_score)
+        return band * size // len(DIFFICULTIES), (band + 1) * size // len(DIFFICULTIES)
+
+    def _load(self) -> bool:
+        try:
+            with open(self.path, 'rb') as file:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+        if (len(data) < INDEX_HEADER.size or
+                INDEX_HEADER.unpack_from(data) != (FEATURES_FORMAT, *self.corpus._stat()) or
+                len(data) != INDEX_HEADER.size + len(COLUMNS) * 4 * len(self.corpus)):
+            return False
+        view = memoryview(data)[INDEX_HEADER.size:]
+        size = len(self.corpus) * 4
+        try:
+            columns = {name: view[column * size:(column + 1) * size].cast(typecode)
+                       for column, (name, typecode) in enumerate(COLUMNS)}
+        except (ValueError, TypeError):
+            return False
+        for name, column in columns.items():
+            setattr(self, name, column)
+        return True
+
+    def _build(self) -> None:
+        columns = {name: array(typecode) for name, typecode in COLUMNS[:5]}
+        for sentence in self.corpus:
+            for name, value in zip(columns, rate(sentence)):
+                columns[name].append(value)
+        columns['by_length'] = array('I', sorted(range(len(self.corpus)),
+                                                 key=columns['lengths'].__getitem__))
+        columns['by_score'] = array('I', sorted(range(len(self.corpus)),
+                                                key=columns['scores'].__getitem__))
+        for name, column in columns.items():
+            setattr(self, name, column)
+        self.banded = columns['banded'] = array('I')
+        for difficulty in DIFFICULTIES:
+            self.banded.extend(sorted(self.band(difficulty), key=self.lengths.__getitem__))
+        try:
+            write_cache(self.path, [INDEX_HEADER.pack(FEATURES_FORMAT, *self.corpus._stat()),
+                                    *(columns[name] for name, _ in COLUMNS)])
+        except OSError as error:
+            logging.warning('sentence_generator: Features not cached(%s)', error)
+
+
+_features: Features | None = None
+_lock: threading.Lock = threading.Lock()
+
+
+def features() -> Features:
+    """Returns the features of the sentences, loading them when first used."""
+    global _features
+    with _lock:
+        if _features is None:
+            _features = Features()
+        return _features
+
+
+def select(difficulty: str | None = None, length: tuple[int, int] | None = None) -> Deck:
+    """
+    Creates a deck of the sentences of a difficulty and a length.
+    :param difficulty: One of DIFFICULTIES, any difficulty if None.
+    :param length: The minimum and maximum number of characters, any
+        length if None.
+    :return: The deck, of every sentence if none match.
+    :raises ValueError: If the difficulty does not exist.
+    """
+    if difficulty is None and length is None:
+        return Deck()
+    if length is None:
+        ids = features().band(difficulty)
+    else:
+        ids = features().length_range(*length, difficulty)
+    return Deck(ids) if len(ids) else Deck()
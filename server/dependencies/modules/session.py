@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+This module keeps the sessions of the players of a game, so that a
+player whose connection drops during the game can reconnect to it.
+
+Every player is given a token when they join. If their connection drops
+once the game has started, their place and score are kept for a grace
+period instead of being removed, and a new connection that sends the
+token takes their place again. The token starts with the id of the game
+so that the server can find the game, and the shard it runs on.
+"""
+
+import time
+import secrets
+
+# Seconds the place of a disconnected player is kept for
+RESUME_GRACE: float = 30
+SEPARATOR: str = '-'
+
+
+def game_id_of(token: str) -> str:
+    """Returns the id of the game a session token is for."""
+    return token.partition(SEPARATOR)[0]
+
+
+class Sessions:
+    """It holds the tokens of the players of a game and who is disconnected."""
+
+    # username of every token
+    tokens: dict[str, str]
+    # the connection every disconnected player had and when it dropped
+    suspended: dict[str, tuple[object, float]]
+
+    def __init__(self):
+        self.tokens = {}
+        self.suspended = {}
+
+    def issue(self, game_id: str, username: str) -> str:
+        """Creates the token of a player."""
+        token = game_id + SEPARATOR + secrets.token_urlsafe(16)
+        self.tokens[token] = username
+        return token
+
+    def suspend(self, username: str, connection) -> float:
+        """
+        Keeps the place of a player whose connection has dropped.
+        :return: The time it dropped, which expire is called with.
+        """
+        since = time.monotonic()
+        self.suspended[username] = (connection, since)
+        return since
+
+    def resume(self, token: str) -> tuple[str, object | None] | None:
+        """
+        Finds the player of a token.
+        :return: The username of the player and the connection they had
+            if they were disconnected, None if the token is not valid.
+        """
+        username = self.tokens.get(token)
+        if username is None:
+            return None
+        connection, _ = self.suspended.pop(username, (None, 0))
+        return username, connection
+
+    def expire(self, username: str, since: float) -> bool:
+        """
+        Forgets a player who has not reconnected in time.
+        :param username: The username of the player.
+        :param since: When the player was suspended.
+        :return: Whether the player was forgotten, False if they have
+            reconnected since.
+        """
+        suspended = self.suspended.get(username)
+        if suspended is None or suspended[1] != since:
+            return False
+        del self.suspended[username]
+        self.tokens = {token: name for token, name in self.tokens.items() if name != username}
+        return True
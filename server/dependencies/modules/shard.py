@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+This module lets several server processes (shards) share one port.
+
+Every shard listens on the port with SO_REUSEPORT so the kernel spreads
+the connections across them. A game id encodes the shard that owns the
+game (the id modulo the number of shards), so the shards do not need to
+share a registry. A client that asks to join a game owned by another
+shard is handed over to that shard together with its socket. Quick
+matches are all made by one shard, so that its matchmaker sees every
+player looking for one.
+"""
+
+import os
+import json
+import socket
+import logging
+import threading
+from typing import Callable
+from dependencies.modules.communicator import set_version  # noqa
+
+# Characters of the game id, the token and the username handed over at
+# most, far above what a client sends
+MAX_FIELD: int = 64
+# Maximum size of a hand over message, enough for the fields even if
+# every character is escaped
+BUFFER: int = 4096
+# Index of the shard that makes the quick matches
+MATCHMAKER: int = 0
+
+
+class Shard:
+    """
+    It represents one of the worker processes of the server.
+    The channels are Unix datagram sockets created by the parent
+    process, one for each shard.
+    """
+
+    index: int
+    count: int
+    # channel to receive the clients handed over by the other shards
+    inbox: socket.socket
+    # channels to hand over clients to every shard
+    outboxes: list[socket.socket]
+
+    def __init__(self, index: int, inbox: socket.socket, outboxes: list[socket.socket]):
+        self.index = index
+        self.count = len(outboxes)
+        self.inbox = inbox
+        self.outboxes = outboxes
+
+    def owner(self, game_id: str) -> int:
+        """
+        Finds the shard that owns the game.
+        :param game_id: The id of the game.
+        :return: The index of the owning shard.
+        """
+        try:
+            return int(game_id) % self.count
+        except ValueError:
+            # Invalid ids are answered by whichever shard got them.
+            return self.index
+
+    def owns(self, game_id: str) -> bool:
+        """Checks if the game belongs to this shard."""
+        return self.owner(game_id) == self.index
+
+    def matches(self) -> bool:
+        """Checks if this shard makes the quick matches."""
+        return self.index == MATCHMAKER
+
+    def id_range(self) -> range:
+        """Returns the four-digit ids that belong to this shard."""
+        return range(1000 + (self.index - 1000) % self.count, 10000, self.count)
+
+    def hand_over(self, client: socket.socket, address: tuple[str, int], version: str,
+                  message: str, game_id: str | None = None, token: str | None = None,
+                  username: str | None = None) -> None:
+        """
+        Hands over a client that wants a game of another shard, or a
+        quick match if this shard does not make them.
+        The socket is duplicated into the other shard, so it should be
+        closed by the caller afterward. A client whose game id, token or
+        username is longer than MAX_FIELD is not handed over.
+        :param client: The socket of the client.
+        :param address: The address of the client.
+        :param version: The protocol version of the client.
+        :param message: The option the client chose in the menu.
+        :param game_id: The id of the game the client wants to join,
+            reconnect to or watch, None for a quick match.
+        :param token: The session token of the client, if it wants to
+            reconnect to the game.
+        :param username: The username of the client, if it wants a
+            quick match.
+        """
+        if any(field and len(field) > MAX_FIELD for field in (game_id, token, username)):
+            logging.warning('shard(%s): Client not handed over(%s, %s)', self.index, address,
+                            message)
+            return
+        owner = MATCHMAKER if game_id is None else self.owner(game_id)
+        handed = json.dumps({'address': address, 'version': version, 'message': message,
+                             'game_id': game_id, 'token': token, 'username': username}).encode()
+        socket.send_fds(self.outboxes[owner], [handed], [client.fileno()])
+        logging.info('shard(%s): Client handed over(%s, %s, %s)', self.index, address, message,
+                     game_id)
+
+    def listen(self, callback: Callable[[socket.socket, tuple[str, int], str, str | None,
+                                         str | None, str | None], None]) -> None:
+        """
+        Starts receiving the clients handed over by the other shards in
+        a separate thread.
+        :param callback: Called with the socket, the address, the option
+            chosen in the menu, the game id, the session token and the
+            username of every client that is received.
+        """
+        def _listen():
+            while True:
+                message, fds, flags, _ = socket.recv_fds(self.inbox, BUFFER, 1)
+                if not fds:
+                    continue
+                try:
+                    if flags & socket.MSG_TRUNC:
+                        raise ValueError('Hand over truncated')
+                    message = json.loads(message)
+                    version = message['version']
+                    request = (tuple(message['address']), message['message'],
+                               message['game_id'], message['token'], message['username'])
+                except (ValueError, KeyError, TypeError) as error:
+                    # A message that cannot be read only loses its client.
+                    logging.warning('shard(%s): Client not received(%s)', self.index, error)
+                    os.close(fds[0])
+                    continue
+                client = socket.socket(fileno=fds[0])
+                set_version(client, version)
+                callback(client, *request)
+
+        threading.Thread(target=_listen, daemon=True).start()
+
+
+def create_channels(count: int) -> tuple[list[socket.socket], list[socket.socket]]:
+    """
+    Creates the channels to hand over clients between the shards.
+    :param count: The number of shards.
+    :return: The inbox of every shard and the outbox to every shard.
+    """
+    inboxes, outboxes = [], []
+    for _ in range(count):
+        inbox, outbox = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        inboxes.append(inbox)
+        outboxes.append(outbox)
+    return inboxes, outboxes
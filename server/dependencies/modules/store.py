@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+This module keeps the result of every round in an SQLite database so
+that it outlives the game, and ranks the players on leaderboards.
+
+The games only queue their results. A single writer thread inserts
+whatever has been queued in one transaction, so a game never waits for
+the disk and the disk is synced once per batch instead of once per
+round. The best and total of every player are updated as the rounds
+are inserted, so the global leaderboard is read from an index instead
+of being worked out from every round, and the leaderboard of a
+sentence is read from an index of the rounds by sentence and speed.
+"""
+
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from dependencies.modules.metrics import (results_written, results_dropped,  # noqa
+                                          results_queued, commit_duration)
+
+# Seconds the writer waits for more results before committing a batch
+COMMIT_INTERVAL: float = 0.5
+# Rounds committed in a single transaction at most
+MAX_BATCH: int = 5000
+# Rounds queued before new ones are dropped, if the disk cannot keep up
+MAX_QUEUED: int = 100000
+# Seconds a connection waits for another process holding the database
+BUSY_TIMEOUT: float = 30
+# Finished rounds the recent speed of a player is the mean of
+RECENT_ROUNDS: int = 20
+
+SCHEMA: str = '''
+CREATE TABLE IF NOT EXISTS rounds (
+    id INTEGER PRIMARY KEY,
+    finished REAL NOT NULL,
+    game_id TEXT NOT NULL,
+    username TEXT NOT NULL,
+    sentence INTEGER NOT NULL,
+    time_taken REAL NOT NULL,
+    wpm INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rounds_by_sentence ON rounds (sentence, wpm DESC, time_taken);
+CREATE INDEX IF NOT EXISTS rounds_by_finished ON rounds (finished);
+CREATE INDEX IF NOT EXISTS rounds_by_username ON rounds (username, finished);
+CREATE TABLE IF NOT EXISTS players (
+    username TEXT PRIMARY KEY,
+    best_wpm INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    rounds INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS players_by_best ON players (best_wpm DESC);
+'''
+
+INSERT_ROUND: str = '''
+INSERT INTO rounds (finished, game_id, username, sentence, time_taken, wpm)
+VALUES (?, ?, ?, ?, ?, ?)
+'''
+# The best speed only counts the rounds that were finished, the score
+# adds up the speeds like the result of a game does.
+UPDATE_PLAYER: str = '''
+INSERT INTO players (username, best_wpm, score, rounds) VALUES (?, ?, ?, 1)
+ON CONFLICT (username) DO UPDATE SET
+    best_wpm = max(best_wpm, excluded.best_wpm),
+    score = score + excluded.score,
+    rounds = rounds + 1
+'''
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """Opens the database, creating its tables if they do not exist."""
+    connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+    # Readers do not block the writer and the writer does not block
+    # readers, a commit is only synced at checkpoints.
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.executescript(SCHEMA)
+    return connection
+
+
+class ResultStore:
+    """
+    It holds the queue of the results to write and the connections to
+    the database, one for the writer thread and one for the queries.
+    """
+
+    path: str
+    # rows of the rounds waiting to be written, None to stop the writer
+    pending: queue.Queue
+
+    def __init__(self, path: str):
+        self.path = path
+        self.pending = queue.Queue(MAX_QUEUED)
+        self._writer = connect(path)
+        self._reader = connect(path)
+        self._read_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        results_queued.set_function(self.pending.qsize)
+
+    def record_round(self, game_id: str, sentence_id: int,
+                     round_result: dict[str, tuple[float, int]]) -> None:
+        """
+        Queues the result of a round to be written, without waiting.
+        :param game_id: The id of the game.
+        :param sentence_id: The id of the sentence of the round.
+        :param round_result: The time taken and the speed of every
+            player, the time being 0 if the player did not finish and -1
+            if the player cheated.
+        """
+        finished = time.time()
+        for username, (time_taken, wpm) in round_result.items():
+            try:
+                self.pending.put_nowait((finished, game_id, username, sentence_id,
+                                         time_taken, wpm))
+            except queue.Full:
+                results_dropped.inc()
+
+    def leaderboard(self, limit: int = 10) -> list[tuple[str, int]]:
+        """
+        Returns the players with the best speed in a finished round.
+        :param limit: The number of players.
+        :return: The username and best speed of every player, fastest
+            first.
+        """
+        return self._query('SELECT username, best_wpm FROM players WHERE best_wpm > 0 '
+                           'ORDER BY best_wpm DESC LIMIT ?', (limit,))
+
+    def sentence_leaderboard(self, sentence_id: int,
+                             limit: int = 10) -> list[tuple[str, float, int]]:
+        """
+        Returns the fastest finished rounds of a sentence.
+        :param sentence_id: The id of the sentence.
+        :param limit: The number of rounds.
+        :return: The username, time taken and speed of every round,
+            fastest first.
+        """
+        return self._query('SELECT username, time_taken, wpm FROM rounds '
+                           'WHERE sentence = ? AND time_taken > 0 '
+                           'ORDER BY wpm DESC, time_taken LIMIT ?', (sentence_id, limit))
+
+    def bests(self, since: float | None = None) -> list[tuple[str, int]]:
+        """
+        Returns the best speed of every player in a finished round.
+        :param since: The time from which the rounds count, all of them
+            if None.
+        :return: The username and best speed of every player.
+        """
+        if since is None:
+            return self._query('SELECT username, best_wpm FROM players WHERE best_wpm > 0', ())
+        return self._query('SELECT username, max(wpm) FROM rounds '
+                           'WHERE finished >= ? AND time_taken > 0 GROUP BY username', (since,))
+
+    def last_round(self) -> int:
+        """Returns the id of the last round written, 0 if none is."""
+        return self._query('SELECT coalesce(max(id), 0) FROM rounds', ())[0][0]
+
+    def rounds_after(self, last: int) -> list[tuple[int, float, str, float, int]]:
+        """
+        Returns the rounds written after another, by this process or by
+        any other.
+        :param last: The id of the last round already read.
+        :return: The id, the time it was finished, the username, the
+            time taken and the speed of every round, in the order they
+            were written.
+        """
+        return self._query('SELECT id, finished, username, time_taken, wpm FROM rounds '
+                           'WHERE id > ? ORDER BY id', (last,))
+
+    def recent_wpm(self, username: str) -> float | None:
+        """
+        Returns the mean speed of the last RECENT_ROUNDS finished rounds
+        of a player, None if the player has not finished any.
+        """
+        return self._query('SELECT avg(wpm) FROM (SELECT wpm FROM rounds '
+                           'WHERE username = ? AND time_taken > 0 '
+                           'ORDER BY finished DESC LIMIT ?)', (username, RECENT_ROUNDS))[0][0]
+
+    def close(self) -> None:
+        """Writes the results that are queued and closes the database."""
+        self.pending.put(None)
+        self._thread.join()
+        self._writer.close()
+        self._reader.close()
+
+    def _query(self, sql: str, parameters: tuple) -> list[tuple]:
+        with self._read_lock:
+            return self._reader.execute(sql, parameters).fetchall()
+
+    def _run(self) -> None:
+        stopped = False
+        while not stopped:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + COMMIT_INTERVAL
+            # Wait a little for more results so that they are committed
+            # together.
+            while batch[-1] is not None and len(batch) < MAX_BATCH:
+                timeout = deadline - time.monotonic()
+                try:
+                    batch.append(self.pending.get(timeout=timeout) if timeout > 0
+                                 else self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                stopped = True
+                batch.pop()
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch: list[tuple]) -> None:
+        try:
+            with commit_duration.time(), self._writer:
+                self._writer.executemany(INSERT_ROUND, batch)
+                self._writer.executemany(UPDATE_PLAYER, (
+                    (username, wpm if time_taken > 0 else 0, wpm)
+                    for _, _, username, _, time_taken, wpm in batch))
+        except sqlite3.Error as error:
+            logging.error('store: Results not written(%s, %s)', len(batch), error)
+            results_dropped.inc(len(batch))
+            return
+        results_written.inc(len(batch))
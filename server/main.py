@@ -3,8 +3,14 @@
 This module is the server for TypsSpeed.
 It listens for incoming connections and handles them accordingly.
 
-Each game is run in a separate thread and has a four-digit
-unique id which can be used to join the game.
+Each game is played on one of a bounded pool of threads once it
+starts, and has a four-digit unique id which can be used to join the
+game.
+With --mode asyncio every connection and game is run on a single
+event loop instead, and with --workers the connections are spread
+across several processes that each own a share of the game ids.
+Spectators of a game are sent its messages by a broadcast tier of their
+own, so that they do not slow down its players.
 """
 
 __author__: str = 'Oldmacintosh'
@@ -12,80 +18,243 @@ __version__: list[str] = ['v1.1.0', 'v1.1.1']
 __date__: str = 'July 2024'
 __PROJECT__: str = 'TypeSpeed'
 
-import random
 import socket
+import asyncio
+import argparse
 import threading
 import logging
+import multiprocessing
 from dependencies.modules.game import Game
-from dependencies.modules.communicator import send, receive
+from dependencies.modules.base_game import parse_options
+from dependencies.modules.async_game import AsyncGame
+from dependencies.modules.shard import Shard, create_channels
+from dependencies.modules.store import ResultStore
+from dependencies.modules.sentence_generator.features import features
+from dependencies.modules.ranking import leaderboards, WINDOWS, MAX_LEADERBOARD
+from dependencies.modules.schema import encode_leaderboard
+from dependencies.modules.registry import Registry, LOBBY_TTL, MAX_LOBBIES
+from dependencies.modules.runner import (Runner, GameRunner, AsyncGameRunner, MAX_RUNNING,
+                                         MAX_WAITING)
+from dependencies.modules.session import game_id_of
+from dependencies.modules.matchmaker import Matchmaker, Ticket, MATCH_WAIT, MIN_PLAYERS
+from dependencies.modules.scheduler import scheduler
+from dependencies.modules import heartbeat
+from dependencies.modules.acceptor import Acceptor, RateLimiter, BACKLOG, RATE, HANDSHAKE_TIMEOUT
+from dependencies.modules import metrics
+from dependencies.modules.communicator import (send, receive, async_send, async_receive,
+                                               set_version, get_version, PROTOCOL_VERSIONS)
 
 SERVER: str = ''
 PORT: int = 6969
-# Create the socket for the server
-server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-server.bind((SERVER, PORT))
-server.listen()
-server.settimeout(1)
+server: socket.socket | None = None
+# The worker process this server is running as, if any
+shard: Shard | None = None
+limiter: RateLimiter = RateLimiter()
 
-games: dict[str, Game] = {}
+# The games of the server, created once the ids it owns are known
+games: Registry | None = None
+# The players waiting for a quick match
+matcher: Matchmaker = Matchmaker()
+# What plays the games once they start
+runner: Runner = Runner()
+metrics.games.set_function(lambda: sum(game.active for game in games.values()) if games else 0)
+metrics.players.set_function(lambda: sum(len(game.clients) for game in games.values()
+                                         if game.active) if games else 0)
+metrics.spectators.set_function(lambda: sum(len(game.audience) for game in games.values()
+                                            if game.active) if games else 0)
 
 logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s')
 logging.getLogger().setLevel(logging.INFO)
 
 
-def handle_client(client: socket.socket, address: tuple[str, int]) -> None:
+def create_server(backlog: int = BACKLOG) -> socket.socket:
+    """
+    Creates the socket for the server.
+    :param backlog: The connections the kernel queues until they are
+        accepted.
+    """
+    _server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    _server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if shard:
+        # Every shard listens on the same port.
+        _server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    _server.bind((SERVER, PORT))
+    _server.listen(backlog)
+    return _server
+
+
+def parse_leaderboard_request(message: str) -> tuple[str, int]:
+    """
+    Parses what leaderboard a client asks for.
+    :param message: The window and the number of players, like
+        "today 10".
+    :return: The window and the number of players.
+    :raises KeyError: If the window does not exist.
+    """
+    window, _, count = message.partition(' ')
+    count = int(count) if count.isdigit() else 10
+    if window not in WINDOWS:
+        raise KeyError(window)
+    return window, max(1, min(count, MAX_LEADERBOARD))
+
+
+def create_game_id() -> str | None:
+    """
+    Takes an id for a new game if the server can take another game.
+    :return: The id, None if too many games are waiting for players or
+        to be played.
+    """
+    game_id = games.create_id() if runner.admits() else None
+    if game_id is None:
+        metrics.games_refused.inc()
+    return game_id
+
+
+def handle_client(client: socket.socket, address: tuple[str, int], message: str | None = None,
+                  game_id: str | None = None, token: str | None = None,
+                  username: str | None = None) -> None:
     """
     Handles the client connection.
-    It allows the client to host or join a game.
+    It allows the client to host or join a game, to find a quick
+    match, to see a leaderboard, to reconnect to a game or to watch
+    one.
     :param client: The client socket.
     :param address: The address of the client.
+    :param message: The option the client has already chosen in the
+        menu, if it was handed over by another shard.
+    :param game_id: The id of the game the client has already asked to
+        join or watch, if it was handed over by another shard.
+    :param token: The session token the client has already sent to
+        reconnect, if it was handed over by another shard.
+    :param username: The username the client has already sent to find
+        a quick match, if it was handed over by another shard.
     """
     game: Game | None = None
     try:
-        message = receive(client)
+        message = message or receive(client)
         # Host a game
         if message == '0':
             # Get the number of players and the username and create
             # a game with the client as the host.
-            player_count = int(receive(client))
+            try:
+                player_count, options = parse_options(receive(client))
+            except ValueError:
+                logging.warning('main: Invalid game(%s)', address)
+                client.close()
+                return
             username = receive(client)
-            game = Game(client, username, player_count, create_id())
-            games[game.game_id] = game
+            game_id = create_game_id()
+            if game_id is None:
+                # Too many games are waiting for players or to be
+                # played, an empty id tells the client to try again
+                # later.
+                logging.warning('main: Game refused(%s)', address)
+                send('', client)
+                client.close()
+                return
+            metrics.games_created.inc()
+            game = Game(client, username, player_count, game_id, options)
+            games.add(game)
+            game.start()
         # Join a game
         elif message == '1':
             while True:
                 # Get the game id and check if the game exists and
                 # is active and then check if the game has not yet
                 # started and then join the game.
-                game_id = receive(client)
-                if game_id in games and games[game_id].active:
-                    if not games[game_id].game_started:
+                if game_id is None:
+                    game_id = receive(client)
+                if shard and not shard.owns(game_id):
+                    # The game belongs to another shard
+                    shard.hand_over(client, address, get_version(client), message, game_id)
+                    client.close()
+                    return
+                found = games.get(game_id)
+                if found and found.active:
+                    if not found.game_started:
                         # Game join able
                         send('1', client)
-                        game = games[game_id]
+                        game = found
                         break
                     # Game already started
                     send('2', client)
                 else:
                     # Game does not exist
                     send('0', client)
+                game_id = None
             while True:
-                # Get the username and check if it is unique and
-                # the game has not yet started and then
-                # add the player to the game.
+                # Get the username and add the player to the game if
+                # the username is unique and the game has not yet
+                # started, the game tells the client if it has joined.
                 username = receive(client)
-                if username not in game.players.values():
-                    if not game.game_started:
-                        # Game join successful
-                        send('1', client)
-                        game.add_player(client, username)
-                        break
-                    # Game already started
-                    send('2', client)
-                else:
-                    # Username not unique
-                    send('0', client)
+                reply = game.add_player(client, username, acknowledge=True)
+                if reply == '1':
+                    # Game join successful
+                    break
+                # Username not unique(0) or game already started(2)
+                send(reply, client)
+        # Show a leaderboard
+        elif message == '2':
+            # Get the leaderboard and the username of the client, whose
+            # position is sent along with the leaderboard.
+            try:
+                window, count = parse_leaderboard_request(receive(client))
+            except KeyError:
+                window, count = 'all', 10
+            username = receive(client)
+            results, rank = leaderboards.query(window, count, username)
+            send(encode_leaderboard(window, results, rank), client, encode=False)
+            client.close()
+        # Find a quick match
+        elif message == '3':
+            # Get the username and queue the client, the matchmaker
+            # tells it the id of its game once it has been matched.
+            username = username or receive(client)
+            if shard and not shard.matches():
+                # Another shard makes the quick matches
+                shard.hand_over(client, address, get_version(client), message,
+                                username=username)
+                client.close()
+                return
+            wpm = Game.store.recent_wpm(username) if Game.store else None
+            send('1', client)
+            matcher.enqueue(client, username, wpm)
+        # Reconnect to a game
+        elif message == '4':
+            # Get the session token, which the game the client was
+            # playing gives its place back for.
+            token = token or receive(client)
+            game_id = game_id_of(token)
+            if shard and not shard.owns(game_id):
+                # The game belongs to another shard
+                shard.hand_over(client, address, get_version(client), message, game_id, token)
+                client.close()
+                return
+            found = games.get(game_id)
+            if not (found and found.resume(client, token)):
+                # The game is over or the session has expired
+                send('0', client)
+                client.close()
+        # Watch a game
+        elif message == '5':
+            # Get the game id, the game sends the client the rounds, the
+            # progress and the results from then on if it can take
+            # another spectator.
+            game_id = game_id or receive(client)
+            if shard and not shard.owns(game_id):
+                # The game belongs to another shard
+                shard.hand_over(client, address, get_version(client), message, game_id)
+                client.close()
+                return
+            found = games.get(game_id)
+            if not found:
+                # Game does not exist
+                send('0', client)
+                client.close()
+            elif (reply := found.add_spectator(client)) != '1':
+                # The game is over or has too many spectators(2)
+                send(reply, client)
+                client.close()
 
     except ConnectionResetError:
         if game:
@@ -97,36 +266,370 @@ def handle_client(client: socket.socket, address: tuple[str, int]) -> None:
         logging.exception(_error)
 
 
-def create_id() -> str:
-    """Creates a random four digit unique id."""
-    while True:
-        _id = str(random.randint(1000, 9999))
-        if _id not in games:
-            return _id
-
+async def handle_client_async(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                              message: str | None = None, game_id: str | None = None,
+                              token: str | None = None, username: str | None = None) -> None:
+    """
+    Handles the client connection on the asyncio server.
+    It follows the same flow as handle_client.
+    :param reader: The stream to receive from the client.
+    :param writer: The stream to send to the client.
+    :param message: The option the client has already chosen in the
+        menu, if it was handed over by another shard.
+    :param game_id: The id of the game the client has already asked to
+        join or watch, if it was handed over by another shard.
+    :param token: The session token the client has already sent to
+        reconnect, if it was handed over by another shard.
+    :param username: The username the client has already sent to find
+        a quick match, if it was handed over by another shard.
+    """
+    address = writer.get_extra_info('peername')
+    if message is None:
+        metrics.accepts.inc()
+        if not limiter.allow(address[0]):
+            metrics.rate_limited.inc()
+            writer.close()
+            return
+        try:
+            # Ensure that the connection is by a client and not a
+            # random connection, the client sends the protocol version
+            # it wants to use.
+            version = (await asyncio.wait_for(reader.read(1), HANDSHAKE_TIMEOUT)).decode()
+            if version not in PROTOCOL_VERSIONS:
+                raise ConnectionResetError
+            if version != '1':
+                # Clients of version 1 do not expect an acknowledgement.
+                writer.write(version.encode())
+            set_version(reader, version)
+            set_version(writer, version)
+            metrics.handshakes.inc(version=version)
+        except (UnicodeDecodeError, ConnectionError, asyncio.TimeoutError):
+            metrics.handshakes.inc(version='rejected')
+            writer.close()
+            return
+        logging.info('main: Connection accepted(%s, v%s)', address, version)
 
-if __name__ == '__main__':
-    logging.info('main: Server is listening for connections...')
+    game: AsyncGame | None = None
     try:
-        while True:
-            connection = None
+        message = message or await async_receive(reader)
+        # Host a game
+        if message == '0':
             try:
-                connection = server.accept()
-                # Ensure that the connection is by a client and not a
-                # random connection.
-                connection[0].settimeout(30)
-                if connection[0].recv(64).decode() == '1':
-                    connection[0].settimeout(None)
+                player_count, options = parse_options(await async_receive(reader))
+            except ValueError:
+                logging.warning('main: Invalid game(%s)', address)
+                writer.close()
+                return
+            username = await async_receive(reader)
+            game_id = create_game_id()
+            if game_id is None:
+                logging.warning('main: Game refused(%s)', address)
+                await async_send('', writer)
+                writer.close()
+                return
+            metrics.games_created.inc()
+            game = AsyncGame(reader, writer, username, player_count, game_id, options)
+            games.add(game)
+            await game.start()
+        # Join a game
+        elif message == '1':
+            while True:
+                if game_id is None:
+                    game_id = await async_receive(reader)
+                if shard and not shard.owns(game_id):
+                    # The game belongs to another shard
+                    shard.hand_over(writer.get_extra_info('socket'), address,
+                                    get_version(writer), message, game_id)
+                    writer.close()
+                    return
+                found = games.get(game_id)
+                if found and found.active:
+                    if not found.game_started:
+                        # Game join able
+                        await async_send('1', writer)
+                        game = found
+                        break
+                    # Game already started
+                    await async_send('2', writer)
                 else:
-                    raise ConnectionResetError
-                threading.Thread(target=handle_client,
-                                 args=(connection[0], connection[1]),
-                                 daemon=True).start()
-                logging.info('main: Connection accepted(%s)', connection[1])
-            except (UnicodeDecodeError, ConnectionResetError, socket.timeout):
-                if connection:
-                    connection[0].close()
-                continue
+                    # Game does not exist
+                    await async_send('0', writer)
+                game_id = None
+            while True:
+                username = await async_receive(reader)
+                reply = await game.add_player(reader, writer, username, acknowledge=True)
+                if reply == '1':
+                    # Game join successful
+                    break
+                # Username not unique(0) or game already started(2)
+                await async_send(reply, writer)
+        # Show a leaderboard
+        elif message == '2':
+            try:
+                window, count = parse_leaderboard_request(await async_receive(reader))
+            except KeyError:
+                window, count = 'all', 10
+            username = await async_receive(reader)
+            # The rankings might still be loading from the database.
+            results, rank = await asyncio.to_thread(leaderboards.query, window, count, username)
+            await async_send(encode_leaderboard(window, results, rank), writer, encode=False)
+            writer.close()
+        # Find a quick match
+        elif message == '3':
+            username = username or await async_receive(reader)
+            if shard and not shard.matches():
+                # Another shard makes the quick matches
+                shard.hand_over(writer.get_extra_info('socket'), address,
+                                get_version(writer), message, username=username)
+                writer.close()
+                return
+            wpm = (await asyncio.to_thread(Game.store.recent_wpm, username)
+                   if Game.store else None)
+            await async_send('1', writer)
+            matcher.enqueue((reader, writer), username, wpm)
+        # Reconnect to a game
+        elif message == '4':
+            token = token or await async_receive(reader)
+            game_id = game_id_of(token)
+            if shard and not shard.owns(game_id):
+                # The game belongs to another shard
+                shard.hand_over(writer.get_extra_info('socket'), address,
+                                get_version(writer), message, game_id, token)
+                writer.close()
+                return
+            found = games.get(game_id)
+            if not (found and await found.resume(reader, writer, token)):
+                await async_send('0', writer)
+                writer.close()
+        # Watch a game
+        elif message == '5':
+            game_id = game_id or await async_receive(reader)
+            if shard and not shard.owns(game_id):
+                # The game belongs to another shard
+                shard.hand_over(writer.get_extra_info('socket'), address,
+                                get_version(writer), message, game_id)
+                writer.close()
+                return
+            found = games.get(game_id)
+            if not found:
+                await async_send('0', writer)
+                writer.close()
+            elif (reply := found.add_spectator(writer)) != '1':
+                await async_send(reply, writer)
+                writer.close()
+
+    except ConnectionError:
+        if game:
+            await game.remove_player(writer)
+        writer.close()
+        logging.info('main: Connection closed(%s)', address)
+
+    except Exception as _error:
+        logging.exception(_error)
+
+
+def start_match(tickets: list[Ticket]) -> None:
+    """
+    Makes a game of the players matched by the matchmaker, the player
+    who has waited the longest being the host.
+    Every player is told the id and the number of players of the game
+    and is then added to it like a player who joins, so it runs on a
+    thread of its own which plays the game once the last player is
+    added.
+    :param tickets: The players matched.
+    """
+    players = [ticket for ticket in tickets if heartbeat.is_alive(ticket.client)]
+    for ticket in tickets:
+        if ticket not in players:
+            ticket.client.close()
+    game_id = create_game_id() if len(players) >= MIN_PLAYERS else None
+    if game_id is None:
+        # The players are matched again on the next tick.
+        for ticket in players:
+            matcher.requeue(ticket)
+        return
+    joined = []
+    for ticket in players:
+        try:
+            send(game_id, ticket.client)
+            send(str(len(players)), ticket.client)
+            joined.append(ticket)
+        except OSError:
+            ticket.client.close()
+    if not joined:
+        games.release(game_id)
+        return
+    metrics.games_created.inc()
+    host = joined[0]
+    game = Game(host.client, host.username, len(joined), game_id)
+    games.add(game)
+    game.start(announce=False)
+    for ticket in joined[1:]:
+        game.add_player(ticket.client, ticket.username)
+
+
+async def start_match_async(tickets: list[Ticket]) -> None:
+    """
+    Makes a game of the players matched by the matchmaker on the
+    asyncio server, it follows the same flow as start_match.
+    :param tickets: The players matched.
+    """
+    players = [ticket for ticket in tickets if is_alive_async(ticket.client)]
+    for ticket in tickets:
+        if ticket not in players:
+            ticket.client[1].close()
+    game_id = create_game_id() if len(players) >= MIN_PLAYERS else None
+    if game_id is None:
+        for ticket in players:
+            matcher.requeue(ticket)
+        return
+    joined = []
+    for ticket in players:
+        try:
+            await async_send(game_id, ticket.client[1])
+            await async_send(str(len(players)), ticket.client[1])
+            joined.append(ticket)
+        except ConnectionError:
+            ticket.client[1].close()
+    if not joined:
+        games.release(game_id)
+        return
+    metrics.games_created.inc()
+    (reader, writer), username = joined[0].client, joined[0].username
+    game = AsyncGame(reader, writer, username, len(joined), game_id)
+    games.add(game)
+    await game.start(announce=False)
+    for ticket in joined[1:]:
+        await game.add_player(*ticket.client, ticket.username)
+
+
+def is_alive_async(client: tuple[asyncio.StreamReader, asyncio.StreamWriter]) -> bool:
+    """Checks if the connection of a queued client is still open."""
+    reader, writer = client
+    return not reader.at_eof() and not writer.is_closing()
+
+
+def serve() -> None:
+    """
+    Accepts connections and handles each client in a separate thread
+    once it has completed its handshake.
+    """
+    matcher.start(scheduler, lambda tickets: threading.Thread(
+        target=start_match, args=(tickets,), daemon=True).start(),
+                  heartbeat.is_alive, socket.socket.close)
+    Acceptor(server, lambda client, address: threading.Thread(
+        target=handle_client, args=(client, address), daemon=True).start(), limiter).run()
+
+
+async def serve_async(backlog: int = BACKLOG) -> None:
+    """
+    Accepts connections and handles every client on one event loop.
+    :param backlog: The connections the kernel queues until they are
+        accepted.
+    """
+    loop = asyncio.get_running_loop()
+    # the tasks started off the server, kept until they are done as the
+    # event loop only keeps weak references to them
+    tasks: set[asyncio.Task] = set()
+
+    def _spawn(coroutine) -> None:
+        task = asyncio.ensure_future(coroutine)
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    async def _handle_handed_over(client: socket.socket, message: str, game_id: str | None,
+                                  token: str | None, username: str | None) -> None:
+        reader, writer = await asyncio.open_connection(sock=client)
+        set_version(reader, get_version(client))
+        set_version(writer, get_version(client))
+        await handle_client_async(reader, writer, message, game_id, token, username)
+
+    if shard:
+        shard.listen(lambda client, address, *request:
+                     loop.call_soon_threadsafe(_spawn, _handle_handed_over(client, *request)))
+    # The matchmaker ticks on the event loop.
+    matcher.start(loop, lambda tickets: _spawn(start_match_async(tickets)),
+                  is_alive_async, lambda client: client[1].close())
+
+    async_server = await asyncio.start_server(handle_client_async, sock=server, backlog=backlog)
+    async with async_server:
+        await async_server.serve_forever()
+
+
+def run(mode: str, _shard: Shard | None = None, port: int = PORT,
+        metrics_port: int | None = None, lobby_ttl: float = LOBBY_TTL,
+        max_lobbies: int = MAX_LOBBIES, backlog: int = BACKLOG, rate_limit: float = RATE,
+        timing: str = 'client', database: str | None = None,
+        match_wait: float = MATCH_WAIT, max_running: int = MAX_RUNNING,
+        max_waiting: int = MAX_WAITING) -> None:
+    """
+    Runs the server until it is interrupted.
+    :param mode: Whether to run a thread per connection or an event
+        loop.
+    :param _shard: The shard to run the server as, if any.
+    :param port: The port to listen on.
+    :param metrics_port: The port to serve the metrics on, every shard
+        uses the port after the previous shard's.
+    :param lobby_ttl: The seconds a game can wait for players.
+    :param max_lobbies: The number of games that can wait for players
+        at the same time.
+    :param backlog: The connections the kernel queues until they are
+        accepted.
+    :param rate_limit: The connections per second an address can make,
+        0 for no limit.
+    :param timing: Whether the times of the players are trusted as the
+        client sends them or checked against the times the server
+        measures.
+    :param database: The SQLite database to record the results in, if
+        any. Every shard writes to the same database.
+    :param match_wait: The seconds a player waits for a quick match
+        before being matched with fewer players or players of other
+        skills.
+    :param max_running: The number of games played at the same time.
+    :param max_waiting: The number of games that can wait to be played
+        before new games are refused.
+    """
+    global server, shard, games, limiter, matcher, runner, PORT
+    shard = _shard
+    PORT = port
+    limiter = RateLimiter(rate_limit, max(1, round(rate_limit * 2)))
+    Game.authoritative_timing = AsyncGame.authoritative_timing = timing == 'server'
+    if database:
+        Game.store = AsyncGame.store = ResultStore(database)
+        # The rankings are loaded in the background, whatever asks for
+        # them first waits until they are. Every shard follows the rounds
+        # of the others through the database.
+        leaderboards.store = Game.store
+        threading.Thread(target=leaderboards.follow if shard else leaderboards.load,
+                         daemon=True).start()
+    # The features of the sentences are read before the first game asks
+    # for sentences of a difficulty or a length.
+    features()
+    # The ids of the games are four digits, spread across the shards.
+    games = Registry(shard.id_range() if shard else range(1000, 10000), lobby_ttl, max_lobbies)
+    games.start()
+    matcher = Matchmaker(match_wait)
+    if mode == 'asyncio':
+        runner = AsyncGame.runner = AsyncGameRunner(max_running, max_waiting)
+    else:
+        runner = Game.runner = GameRunner(max_running, max_waiting)
+    if metrics_port:
+        metrics.serve(metrics_port + (shard.index if shard else 0))
+    server = create_server(backlog)
+    if shard:
+        logging.info('main: Shard %s of %s is listening for connections(%s)...',
+                     shard.index, shard.count, mode)
+    else:
+        logging.info('main: Server is listening for connections(%s)...', mode)
+    try:
+        if mode == 'asyncio':
+            asyncio.run(serve_async(backlog))
+        else:
+            if shard:
+                shard.listen(lambda client, address, *request: threading.Thread(
+                    target=handle_client, args=(client, address, *request),
+                    daemon=True).start())
+            serve()
     except KeyboardInterrupt:
         pass
 
@@ -135,4 +638,68 @@ if __name__ == '__main__':
 
     finally:
         server.close()
+        if Game.store:
+            Game.store.close()
         logging.info('main: Server shutdown successful.')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='TypeSpeed server')
+    parser.add_argument('--mode', choices=('thread', 'asyncio'), default='thread',
+                        help='run a thread per connection or a single event loop')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes to spread the connections across')
+    parser.add_argument('--port', type=int, default=PORT, help='port to listen on')
+    parser.add_argument('--metrics-port', type=int,
+                        help='serve the metrics and the profiler on this local port')
+    parser.add_argument('--lobby-ttl', type=float, default=LOBBY_TTL,
+                        help='seconds a game can wait for players before it is closed')
+    parser.add_argument('--max-lobbies', type=int, default=MAX_LOBBIES,
+                        help='games that can wait for players at the same time, per worker')
+    parser.add_argument('--backlog', type=int, default=BACKLOG,
+                        help='connections the kernel queues until they are accepted')
+    parser.add_argument('--rate-limit', type=float, default=RATE,
+                        help='connections per second an address can make, per worker, 0 for '
+                             'no limit')
+    parser.add_argument('--timing', choices=('client', 'server'), default='client',
+                        help='trust the times the clients send or check them against the times '
+                             'measured by the server')
+    parser.add_argument('--database', help='record the results of the rounds in this SQLite '
+                                           'database')
+    parser.add_argument('--match-wait', type=float, default=MATCH_WAIT,
+                        help='seconds a player waits for a full quick match')
+    parser.add_argument('--max-running', type=int, default=MAX_RUNNING,
+                        help='games played at the same time, per worker')
+    parser.add_argument('--max-waiting', type=int, default=MAX_WAITING,
+                        help='games that can wait to be played before new games are refused, '
+                             'per worker')
+    args = parser.parse_args()
+    settings = {'port': args.port, 'metrics_port': args.metrics_port,
+                'lobby_ttl': args.lobby_ttl, 'max_lobbies': args.max_lobbies,
+                'backlog': args.backlog, 'rate_limit': args.rate_limit, 'timing': args.timing,
+                'database': args.database, 'match_wait': args.match_wait,
+                'max_running': args.max_running, 'max_waiting': args.max_waiting}
+
+    if args.workers > 1:
+        inboxes, outboxes = create_channels(args.workers)
+        # The features of the sentences are built once, not by every
+        # worker.
+        features()
+        workers = [multiprocessing.Process(target=run, name=f'shard-{index}',
+                                           args=(args.mode, Shard(index, inbox, outboxes)),
+                                           kwargs=settings)
+                   for index, inbox in enumerate(inboxes)]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            # The workers are interrupted along with the parent when run
+            # from a terminal, otherwise they are stopped here.
+            for worker in workers:
+                worker.join(1)
+                if worker.is_alive():
+                    worker.terminate()
+    else:
+        run(args.mode, **settings)
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of how a game is created and records what its clients report.
+
+Run from the server directory:
+    python -m pytest tests
+"""
+
+import unittest
+from dependencies.modules.base_game import (BaseGame, parse_options, COUNTDOWN,  # noqa
+                                            DISPLAY_DELAY, TIMING_TOLERANCE)
+from dependencies.modules.communicator import set_version  # noqa
+from dependencies.modules.keystrokes import KeystrokeValidator, encode_keystrokes  # noqa
+
+SENTENCE: str = 'The die is cast.'
+
+
+class Connection:
+    """It stands for the connection of a client of version 2."""
+
+    def __init__(self):
+        set_version(self, '2')
+
+
+class Game(BaseGame):
+    """It serves a game to no one, keeping what it would call later."""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.calls = []
+
+    def _call_later(self, delay: float, callback, *args) -> None:
+        self.calls.append((delay, callback, args))
+
+    @staticmethod
+    def _address(connection) -> str:
+        return 'test'
+
+
+def create_game(options: dict[str, str]) -> tuple[Game, Connection]:
+    """
+    Creates a game whose host is playing a round of SENTENCE, having
+    typed all of it.
+    :return: The game and the connection of the host.
+    """
+    host = Connection()
+    game = Game(host, 'host', 2, '1234', options)
+    game.playing = {'host'}
+    game.sentence = SENTENCE
+    validator = KeystrokeValidator(SENTENCE)
+    validator.feed(encode_keystrokes([(character, 100) for character in SENTENCE]))
+    game.keystrokes = {host: validator}
+    return game, host
+
+
+class RecordTimeTest(unittest.TestCase):
+
+    def test_non_finite_time_did_not_finish(self):
+        for mode in ('classic', 'timed'):
+            for report in ('inf', '-inf', 'nan', '1e999'):
+                with self.subTest(mode=mode, report=report):
+                    game, host = create_game({'mode': mode})
+                    game.record_time(host, report)
+                    self.assertEqual(game.time_taken[host], 0)
+
+    def test_finite_time_is_recorded(self):
+        game, host = create_game({})
+        game.record_time(host, '3.5')
+        self.assertEqual(game.time_taken[host], 3.5)
+
+    def test_finite_count_is_recorded(self):
+        game, host = create_game({'mode': 'timed'})
+        game.record_time(host, '10')
+        self.assertEqual(game.time_taken[host], 10)
+
+
+class AuthoritativeTimingTest(unittest.TestCase):
+    # The round is delivered at 0 and every time is in seconds from then.
+
+    def setUp(self):
+        self.game, self.host = create_game({})
+        self.game.authoritative_timing = True
+        self.game.round = 1
+        self.game.delivered = 0
+
+    def receive(self, message: str, at: float) -> None:
+        if message.startswith('r'):
+            self.game.record_ready(self.host, message, int(at * 1e9))
+        else:
+            self.game.record_time(self.host, message, int(at * 1e9))
+
+    def test_time_is_measured_from_ready(self):
+        self.receive('r1', COUNTDOWN + 4)
+        self.receive('2', COUNTDOWN + 7)
+        self.assertEqual(self.game.time_taken[self.host], 3 - TIMING_TOLERANCE)
+
+    def test_early_ready_is_taken_after_the_countdown(self):
+        self.receive('r1', 1)
+        self.assertEqual(self.game.started[self.host], COUNTDOWN * 1e9)
+
+    def test_late_ready_is_ignored(self):
+        self.receive('r1', DISPLAY_DELAY + COUNTDOWN + 1)
+        self.assertNotIn(self.host, self.game.started)
+        # The report is then checked like one of version 1.
+        self.receive('2', DISPLAY_DELAY + COUNTDOWN + 5)
+        self.assertEqual(self.game.time_taken[self.host], 0)
+
+    def test_ready_of_another_round_is_ignored(self):
+        self.receive('r2', COUNTDOWN + 1)
+        self.assertNotIn(self.host, self.game.started)
+
+    def test_version_1_time_too_low_did_not_finish(self):
+        set_version(self.host, '1')
+        self.game.keystrokes = {}
+        self.receive('1', DISPLAY_DELAY + COUNTDOWN + 5)
+        self.assertEqual(self.game.time_taken[self.host], 0)
+
+    def test_version_1_time_is_kept_below_the_measured_time(self):
+        set_version(self.host, '1')
+        self.game.keystrokes = {}
+        self.receive('3.5', COUNTDOWN + 5)
+        self.assertEqual(self.game.time_taken[self.host], 3.5)
+        self.receive('9', COUNTDOWN + 5)
+        self.assertEqual(self.game.time_taken[self.host], 5)
+
+
+class TakeOverTest(unittest.TestCase):
+
+    def test_keystrokes_are_sent_again_before_the_time(self):
+        game, host = create_game({})
+        connection = Connection()
+        game._take_over(host, connection)
+        game.record_keystrokes(connection, encode_keystrokes([(character, 100)
+                                                              for character in SENTENCE]))
+        game.record_time(connection, '3.5')
+        self.assertEqual(game.time_taken[connection], 3.5)
+
+    def test_keystrokes_of_a_time_sent_are_kept(self):
+        game, host = create_game({})
+        game.record_time(host, '3.5')
+        validator = game.keystrokes[host]
+        connection = Connection()
+        game._take_over(host, connection)
+        self.assertEqual(game.time_taken[connection], 3.5)
+        self.assertIs(game.keystrokes[connection], validator)
+
+
+class ParseOptionsTest(unittest.TestCase):
+
+    def test_options_are_parsed(self):
+        self.assertEqual(parse_options('3 difficulty=hard length=20-60'),
+                         (3, {'difficulty': 'hard', 'length': '20-60'}))
+
+    def test_malformed_options_are_ignored(self):
+        self.assertEqual(parse_options('4 hard difficulty=easy'), (4, {'difficulty': 'easy'}))
+
+    def test_invalid_player_count_is_refused(self):
+        for message in ('', 'four', 'difficulty=hard'):
+            with self.subTest(message=message):
+                with self.assertRaises(ValueError):
+                    parse_options(message)
+
+
+if __name__ == '__main__':
+    unittest.main()
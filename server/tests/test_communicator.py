@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of how messages are framed and received.
+
+Run from the server directory:
+    python -m pytest tests
+"""
+
+import socket
+import unittest
+import threading
+from dependencies.modules.communicator import (FrameReader, MAX_FRAME, FRAME_HEADER, header,  # noqa
+                                               receive, set_version)
+
+
+class MaxFrameTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server, self.client = socket.socketpair()
+
+    def tearDown(self):
+        self.server.close()
+        self.client.close()
+
+    def test_receive_refuses_long_frame(self):
+        for version in ('1', '2'):
+            with self.subTest(version=version):
+                set_version(self.server, version)
+                self.client.sendall(header(MAX_FRAME + 1, version) + b'x')
+                with self.assertRaises(ConnectionError):
+                    receive(self.server)
+
+    def test_frame_reader_refuses_long_frame(self):
+        set_version(self.server, '2')
+        reader = FrameReader(self.server)
+        self.client.sendall(FRAME_HEADER.pack(MAX_FRAME + 1) + b'x')
+        with self.assertRaises(ConnectionError):
+            reader.read()
+
+    def test_longest_frame_is_received(self):
+        set_version(self.server, '2')
+        message = b'x' * MAX_FRAME
+        # The frame is larger than the buffers of the socket pair, so it
+        # is sent while it is received.
+        sender = threading.Thread(target=self.client.sendall,
+                                  args=(FRAME_HEADER.pack(MAX_FRAME) + message,))
+        sender.start()
+        self.assertEqual(receive(self.server, decode=False), message)
+        sender.join()
+
+
+class FrameReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server, self.client = socket.socketpair()
+
+    def tearDown(self):
+        self.server.close()
+        self.client.close()
+
+    def test_reassembles_split_frames(self):
+        messages = [b'first', b'', b'x' * 300, 'caf\u00e9'.encode()]
+        for version in ('1', '2'):
+            with self.subTest(version=version):
+                set_version(self.server, version)
+                reader = FrameReader(self.server)
+                data = b''.join(header(len(message), version) + message for message in messages)
+                received = []
+                # Sent a few bytes at a time, so that headers and
+                # messages are split across reads.
+                for start in range(0, len(data), 7):
+                    self.client.sendall(data[start:start + 7])
+                    received += reader.read()
+                self.assertEqual(received, messages)
+
+    def test_nothing_to_read(self):
+        set_version(self.server, '2')
+        reader = FrameReader(self.server)
+        self.assertEqual(reader.read(), [])
+        self.client.sendall(FRAME_HEADER.pack(4) + b'ab')
+        self.assertEqual(reader.read(), [])
+        self.client.sendall(b'cd')
+        self.assertEqual(reader.read(), [b'abcd'])
+
+    def test_closed_connection(self):
+        set_version(self.server, '2')
+        reader = FrameReader(self.server)
+        self.client.close()
+        with self.assertRaises(ConnectionResetError):
+            reader.read()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of how the keystrokes of a player are checked against their time.
+
+Run from the server directory:
+    python -m pytest tests
+"""
+
+import unittest
+from dependencies.modules.keystrokes import (KeystrokeValidator, encode_keystrokes,  # noqa
+                                             BACKSPACE, EDIT)
+
+SENTENCE: str = 'The die is cast.'
+
+
+def validate(keystrokes: list[tuple[str, int]]) -> KeystrokeValidator:
+    """Creates a validator of SENTENCE that has followed the keystrokes."""
+    validator = KeystrokeValidator(SENTENCE)
+    if keystrokes:
+        validator.feed(encode_keystrokes(keystrokes))
+    return validator
+
+
+class CheckTest(unittest.TestCase):
+
+    def test_matching_stream_keeps_the_time(self):
+        validator = validate([(character, 100) for character in SENTENCE])
+        self.assertTrue(validator.matches)
+        self.assertEqual(validator.check(2.0), 2.0)
+
+    def test_corrected_stream_matches(self):
+        validator = validate([('x', 100), (BACKSPACE, 100)] +
+                             [(character, 100) for character in SENTENCE])
+        self.assertEqual(validator.check(2.0), 2.0)
+
+    def test_elapsed_time_is_the_least(self):
+        validator = validate([(character, 500) for character in SENTENCE])
+        self.assertEqual(validator.check(2.0), 0.5 * len(SENTENCE))
+
+    def test_wrong_stream_cheated(self):
+        validator = validate([(character, 100) for character in SENTENCE[:-1] + '!'])
+        self.assertEqual(validator.check(2.0), -1)
+
+    def test_short_stream_cheated(self):
+        validator = validate([(character, 100) for character in SENTENCE[:5]])
+        self.assertEqual(validator.check(2.0), -1)
+
+    def test_missing_stream_did_not_finish(self):
+        self.assertEqual(validate([]).check(2.0), 0)
+
+    def test_edited_stream_needs_every_character(self):
+        typed = [(character, 100) for character in SENTENCE]
+        self.assertEqual(validate([(EDIT, 100)] + typed).check(2.0), 2.0)
+        self.assertEqual(validate([(EDIT, 100)] + typed[:5]).check(2.0), -1)
+
+    def test_reported_failures_are_kept(self):
+        validator = validate([(character, 100) for character in SENTENCE])
+        self.assertEqual(validator.check(0), 0)
+        self.assertEqual(validator.check(-1), -1)
+
+
+if __name__ == '__main__':
+    unittest.main()
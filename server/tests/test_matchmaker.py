@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of how the players that ask for a quick match are grouped.
+
+Run from the server directory:
+    python -m pytest tests
+"""
+
+import unittest
+from dependencies.modules.matchmaker import (Matchmaker, MATCH_INTERVAL, MAX_PLAYERS,  # noqa
+                                             BUCKET_WIDTH, MAX_BUCKET, bucket)
+
+
+class Scheduler:
+    """It keeps the callbacks it is given instead of calling them."""
+
+    def __init__(self):
+        self.calls = []
+
+    def call_later(self, delay: float, callback, *args) -> None:
+        self.calls.append((delay, callback, args))
+
+
+class MatchmakerTest(unittest.TestCase):
+
+    def test_buckets(self):
+        self.assertEqual(bucket(None), bucket(40))
+        self.assertEqual(bucket(-5), 0)
+        self.assertEqual(bucket(BUCKET_WIDTH), 1)
+        self.assertEqual(bucket(10000), MAX_BUCKET)
+
+    def test_full_bucket_is_matched_at_once(self):
+        matchmaker = Matchmaker(wait=3600)
+        tickets = [matchmaker.enqueue(i, f'player{i}', 50) for i in range(MAX_PLAYERS + 1)]
+        self.assertEqual(matchmaker.match(), [tickets[:MAX_PLAYERS]])
+        self.assertEqual(len(matchmaker), 1)
+        self.assertEqual(matchmaker.match(), [])
+
+    def test_players_wait_before_smaller_games(self):
+        matchmaker = Matchmaker(wait=3600)
+        matchmaker.enqueue(0, 'a', 50)
+        matchmaker.enqueue(1, 'b', 50)
+        self.assertEqual(matchmaker.match(), [])
+        self.assertEqual(len(matchmaker), 2)
+
+    def test_closest_buckets_are_drawn_from(self):
+        matchmaker = Matchmaker(wait=0)
+        oldest = matchmaker.enqueue(0, 'oldest', 0)
+        close = [matchmaker.enqueue(i, f'close{i}', BUCKET_WIDTH) for i in range(5)]
+        far = [matchmaker.enqueue(i, f'far{i}', 1000) for i in range(5)]
+        groups = matchmaker.match()
+        self.assertEqual(groups, [[oldest, *close, *far[:4]]])
+        # The player left has no one to play with.
+        self.assertEqual(len(matchmaker), 1)
+
+    def test_same_username_is_not_matched(self):
+        matchmaker = Matchmaker(wait=0)
+        first = matchmaker.enqueue(0, 'a', 50)
+        second = matchmaker.enqueue(1, 'a', 50)
+        self.assertEqual(matchmaker.match(), [])
+        self.assertEqual(matchmaker.tickets, {first, second})
+        other = matchmaker.enqueue(2, 'b', 50)
+        self.assertEqual(matchmaker.match(), [[first, other]])
+        self.assertEqual(matchmaker.tickets, {second})
+
+    def test_cancelled_players_are_skipped(self):
+        matchmaker = Matchmaker(wait=0)
+        cancelled = matchmaker.enqueue(0, 'a', 50)
+        matchmaker.cancel(cancelled)
+        first = matchmaker.enqueue(1, 'b', 50)
+        second = matchmaker.enqueue(2, 'c', 50)
+        self.assertEqual(matchmaker.match(), [[first, second]])
+        matchmaker.requeue(cancelled)
+        self.assertEqual(len(matchmaker), 0)
+
+    def test_requeued_player_keeps_their_place(self):
+        matchmaker = Matchmaker(wait=0)
+        first = matchmaker.enqueue(0, 'a', 50)
+        second = matchmaker.enqueue(1, 'b', 50)
+        self.assertEqual(matchmaker.match(), [[first, second]])
+        third = matchmaker.enqueue(2, 'c', 50)
+        matchmaker.requeue(second)
+        self.assertEqual(matchmaker.match(), [[second, third]])
+
+    def test_tick_removes_closed_connections(self):
+        matchmaker = Matchmaker(wait=0)
+        scheduler, matched, closed = Scheduler(), [], []
+        matchmaker.start(scheduler, matched.append, lambda client: client != 'closed',
+                         closed.append)
+        matchmaker.enqueue('closed', 'a', 50)
+        live = [matchmaker.enqueue('open', username, 50) for username in ('b', 'c')]
+        delay, tick, _ = scheduler.calls.pop()
+        self.assertEqual(delay, MATCH_INTERVAL)
+        tick()
+        self.assertEqual(closed, ['closed'])
+        self.assertEqual(matched, [live])
+        # The next tick is scheduled.
+        self.assertEqual(len(scheduler.calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the rankings of the leaderboards.
+
+Run from the server directory:
+    python -m pytest tests
+"""
+
+import random
+import unittest
+from dependencies.modules.ranking import Ranking, SkipList  # noqa
+
+
+class SkipListTest(unittest.TestCase):
+
+    def assertOrdered(self, skip_list: SkipList, keys: list[tuple]):
+        self.assertEqual(len(skip_list), len(keys))
+        self.assertEqual(list(skip_list), keys)
+        self.assertEqual(skip_list.first(10), keys[:10])
+        for position, key in enumerate(keys):
+            self.assertEqual(skip_list.index(key), position)
+
+    def test_matches_sorted_list(self):
+        generator = random.Random(0)
+        skip_list, keys = SkipList(), []
+        for step in range(2000):
+            if keys and generator.random() < 0.4:
+                key = keys.pop(generator.randrange(len(keys)))
+                skip_list.remove(key)
+            else:
+                key = (-generator.randrange(200), f'player{generator.randrange(50)}')
+                if key in keys:
+                    continue
+                skip_list.insert(key)
+                keys.append(key)
+                keys.sort()
+            if step % 100 == 0:
+                self.assertOrdered(skip_list, keys)
+        self.assertOrdered(skip_list, keys)
+        for key in list(keys):
+            skip_list.remove(key)
+            keys.remove(key)
+        self.assertOrdered(skip_list, keys)
+
+    def test_missing_key(self):
+        skip_list = SkipList()
+        skip_list.insert((-50, 'a'))
+        with self.assertRaises(KeyError):
+            skip_list.index((-60, 'a'))
+        with self.assertRaises(KeyError):
+            skip_list.remove((-40, 'a'))
+        self.assertEqual(len(skip_list), 1)
+
+
+class RankingTest(unittest.TestCase):
+
+    def test_keeps_best_speed(self):
+        ranking = Ranking()
+        for username, wpm in (('a', 50), ('b', 70), ('a', 40), ('c', 70), ('a', 90)):
+            ranking.update(username, wpm)
+        self.assertEqual(ranking.top(10), [('a', 90), ('b', 70), ('c', 70)])
+        self.assertEqual(ranking.rank('c'), (3, 70))
+        self.assertIsNone(ranking.rank('d'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of how the games are kept by their id.
+
+Run from the server directory:
+    python -m pytest tests
+"""
+
+import time
+import unittest
+from dependencies.modules.registry import Registry  # noqa
+
+
+class Game:
+    """It stands for a game waiting for players."""
+
+    def __init__(self, game_id: str):
+        self.game_id = game_id
+        self.active = True
+        self.game_started = False
+        self.created = time.monotonic()
+        self.expired = False
+
+    def expire(self) -> None:
+        self.expired = True
+        self.active = False
+
+
+def add_game(registry: Registry) -> Game:
+    """Adds a game with a new id to a registry."""
+    game = Game(registry.create_id())
+    registry.add(game)
+    return game
+
+
+class RegistryTest(unittest.TestCase):
+
+    def test_ids_are_unique(self):
+        registry = Registry(range(100))
+        ids = [registry.create_id() for _ in range(100)]
+        self.assertEqual(sorted(ids, key=int), [str(_id) for _id in range(100)])
+        self.assertIsNone(registry.create_id())
+
+    def test_released_id_is_reused_last(self):
+        registry = Registry(range(3))
+        game_id = registry.create_id()
+        registry.release(game_id)
+        self.assertNotIn(game_id, {registry.create_id(), registry.create_id()})
+        self.assertEqual(registry.create_id(), game_id)
+
+    def test_reap_evicts_inactive_games(self):
+        registry = Registry(range(2))
+        finished, waiting = add_game(registry), add_game(registry)
+        finished.active = False
+        self.assertIsNone(registry.create_id())
+        registry.reap()
+        self.assertNotIn(finished.game_id, registry)
+        self.assertIs(registry.get(waiting.game_id), waiting)
+        self.assertEqual(registry.create_id(), finished.game_id)
+
+    def test_reap_expires_old_lobbies(self):
+        registry = Registry(range(3), lobby_ttl=60)
+        old, started = add_game(registry), add_game(registry)
+        old.created -= 61
+        started.created -= 61
+        started.game_started = True
+        registry.reap()
+        self.assertTrue(old.expired)
+        self.assertFalse(started.expired)
+        # Expired lobbies are evicted by the next reap.
+        registry.reap()
+        self.assertEqual(registry.values(), [started])
+
+    def test_lobbies_are_capped(self):
+        registry = Registry(range(10), max_lobbies=2)
+        first = add_game(registry)
+        pending = registry.create_id()
+        self.assertIsNone(registry.create_id())
+        registry.release(pending)
+        second = add_game(registry)
+        self.assertIsNone(registry.create_id())
+        # Games that have started are not lobbies anymore.
+        first.game_started = True
+        registry.reap()
+        self.assertIsNotNone(registry.create_id())
+        second.active = False
+        registry.reap()
+        self.assertIsNotNone(registry.create_id())
+        self.assertIsNone(registry.create_id())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the order in which the sentences are drawn.
+
+Run from the server directory:
+    python -m pytest tests
+"""
+
+import unittest
+from dependencies.modules.sentence_generator import Deck, sentences  # noqa
+
+
+class DeckTest(unittest.TestCase):
+
+    def test_draws_every_sentence_once(self):
+        deck = Deck()
+        drawn = [deck.draw() for _ in range(len(sentences))]
+        self.assertEqual(sorted(drawn), list(range(len(sentences))))
+
+    def test_draws_ids(self):
+        ids = [3, 5, 8, 13, 21]
+        deck = Deck(ids)
+        self.assertEqual(sorted(deck.draw() for _ in ids), ids)
+
+    def test_shuffles_again_once_drawn(self):
+        ids = list(range(20))
+        deck = Deck(ids)
+        rounds = [[deck.draw() for _ in ids] for _ in range(50)]
+        for drawn in rounds:
+            self.assertEqual(sorted(drawn), ids)
+        # Every round is shuffled on its own.
+        self.assertGreater(len({tuple(drawn) for drawn in rounds}), 1)
+
+    def test_single_sentence(self):
+        deck = Deck([7])
+        self.assertEqual([deck.draw() for _ in range(3)], [7, 7, 7])
+
+
+if __name__ == '__main__':
+    unittest.main()
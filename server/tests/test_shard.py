@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of how the shards hand over clients to each other.
+
+Run from the server directory:
+    python -m pytest tests
+"""
+
+import queue
+import socket
+import unittest
+from dependencies.modules.shard import Shard, create_channels, BUFFER  # noqa
+from dependencies.modules.communicator import get_version  # noqa
+
+
+class HandOverTest(unittest.TestCase):
+
+    def setUp(self):
+        inboxes, self.outboxes = create_channels(2)
+        self.sender = Shard(0, inboxes[0], self.outboxes)
+        self.receiver = Shard(1, inboxes[1], self.outboxes)
+        self.received = queue.Queue()
+        self.receiver.listen(lambda *request: self.received.put(request))
+        self.client, self.peer = socket.socketpair()
+
+    def tearDown(self):
+        self.client.close()
+        self.peer.close()
+
+    def test_client_is_handed_over(self):
+        self.sender.hand_over(self.client, ('127.0.0.1', 1), '2', '1', '1001')
+        client, address, message, game_id, token, username = self.received.get(timeout=1)
+        self.assertEqual((address, message, game_id, token, username),
+                         (('127.0.0.1', 1), '1', '1001', None, None))
+        self.assertEqual(get_version(client), '2')
+        client.close()
+
+    def test_long_fields_are_not_handed_over(self):
+        self.sender.hand_over(self.client, ('127.0.0.1', 1), '2', '1', '1' * 1501)
+        self.sender.hand_over(self.client, ('127.0.0.1', 1), '2', '3', username='x' * 1000)
+        self.assertTrue(self.received.empty())
+
+    def test_invalid_hand_over_keeps_listening(self):
+        for invalid in (b'{' * (BUFFER + 1), b'not json', b'{}'):
+            socket.send_fds(self.outboxes[1], [invalid], [self.client.fileno()])
+        self.sender.hand_over(self.client, ('127.0.0.1', 1), '2', '5', '1003')
+        client, _, message, game_id, _, _ = self.received.get(timeout=1)
+        self.assertEqual((message, game_id), ('5', '1003'))
+        client.close()
+        self.assertTrue(self.received.empty())
+
+
+if __name__ == '__main__':
+    unittest.main()